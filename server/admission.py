@@ -0,0 +1,224 @@
+# /server/admission.py
+
+# Admission control: per-user rate limits and in-flight caps per endpoint group.
+# Every request is put in a group (auth, public, read, write, heavy, stream) by its endpoint and method. Each
+# group has a token bucket per user (per client address when signed out, and always for sign in and public
+# tracking, so those never load the user): RATE_LIMITS gives the refill rate
+# per second and the burst, so "5/20" allows bursts of 20 and 5 requests a second sustained. An empty bucket
+# answers 429 with Retry-After. Buckets live in the process, or in Redis (RATE_LIMIT_REDIS_URL) so the limit
+# holds across workers and nodes; while Redis is unreachable the process buckets take over.
+# CONCURRENCY_LIMITS caps the group's requests in flight per worker process (bulk imports, exports, route
+# plans...), an extra request fails fast with 503 and Retry-After instead of queueing on the database pool.
+# Counters per group are served at /admin/admission to tune the limits under real load.
+# Behind reverse proxies set PROXY_FIX_HOPS (see config.py), otherwise every signed-out client shares the
+# proxy's address and bucket.
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from flask import g, jsonify, make_response, request
+
+logger = logging.getLogger('admission')
+
+GROUPS = ('auth', 'public', 'read', 'write', 'heavy', 'stream')
+
+# Endpoints not in here are "read" for GET/HEAD and "write" otherwise
+ENDPOINT_GROUPS = {
+    'login': 'auth',
+    'signup': 'auth',
+    'track': 'public',
+    'parcelsbulk': 'heavy',
+    'recipientsimport': 'heavy',
+    'parcelsexport': 'heavy',
+    'routeplans': 'heavy',
+    'quotesbatch': 'heavy',
+    'parcelsbyuseridstream': 'stream',
+}
+EXEMPT_ENDPOINTS = {None, 'static', 'home', 'serve', 'check_session', 'logout'}
+# Keyed by client address, the signed-in user isn't looked up for these
+ADDRESS_GROUPS = {'auth', 'public'}
+
+REJECTION_MESSAGES = {429: "Too many requests, slow down", 503: "Server busy, retry shortly"}
+
+# KEYS[1] is the bucket, ARGV is (rate, burst, now). now comes from the caller's wall clock, so the nodes'
+# clocks only have to be roughly in sync
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local tokens = tonumber(state[1]) or burst
+local stamp = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - stamp) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'stamp', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+def parse_rate_limit(value):
+    # "rate/burst" -> (rate per second, burst), None when the group is unlimited
+    value = (value or '').strip()
+    if value in ('', '0'):
+        return None
+    rate, _, burst = value.partition('/')
+    rate = float(rate)
+    burst = float(burst) if burst else max(rate, 1.0)
+    if rate <= 0 or burst < 1:
+        raise ValueError(f"Invalid rate limit {value!r}, expected \"<per second>/<burst>\"")
+    return rate, burst
+
+
+class TokenBuckets:
+    # Process-local buckets, the least recently used ones are dropped past maxsize (they start full again)
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        # Returns (allowed, tokens left)
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + max(0.0, now - stamp) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RedisTokenBuckets:
+    def __init__(self, url, timeout=0.05):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout)
+        self.script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key, rate, burst):
+        allowed, tokens = self.script(keys=[f'sendit:rate:{key}'], args=[rate, burst, time.time()])
+        return bool(allowed), float(tokens)
+
+
+class AdmissionControl:
+    def __init__(self, config):
+        self.enabled = config.get('ADMISSION_ENABLED', True)
+        self.rate_limits = {group: parse_rate_limit(value) for group, value in config.get('RATE_LIMITS', {}).items()}
+        self.concurrency_limits = dict(config.get('CONCURRENCY_LIMITS', {}))
+        self.local = TokenBuckets(config.get('RATE_LIMIT_MAX_BUCKETS', 100_000))
+        self.shared = None
+        if config.get('RATE_LIMIT_REDIS_URL'):
+            try:
+                self.shared = RedisTokenBuckets(config['RATE_LIMIT_REDIS_URL'])
+            except ImportError:
+                logger.warning("RATE_LIMIT_REDIS_URL is set but the redis package isn't installed, rate limits are per process")
+        self._lock = threading.Lock()
+        self.in_flight = defaultdict(int)
+        self.counters = defaultdict(lambda: {"allowed": 0, "limited": 0, "shed": 0, "peak_in_flight": 0})
+        self.shared_errors = 0
+
+    def _take(self, group, subject, rate, burst):
+        key = f'{group}:{subject}'
+        if self.shared is not None:
+            try:
+                return self.shared.take(key, rate, burst)
+            except Exception as e:
+                # Limits stay per process until the shared backend is back
+                self.shared_errors += 1
+                logger.warning("Shared rate limit backend unavailable: %s", e)
+        return self.local.take(key, rate, burst)
+
+    def admit(self, group, subject):
+        # None when the request may go ahead, it then counts as in flight until release(). Otherwise
+        # (status, retry after seconds)
+        limit = self.rate_limits.get(group)
+        if limit is not None:
+            rate, burst = limit
+            allowed, tokens = self._take(group, subject, rate, burst)
+            if not allowed:
+                with self._lock:
+                    self.counters[group]["limited"] += 1
+                return 429, max(1, math.ceil((1 - tokens) / rate))
+
+        cap = self.concurrency_limits.get(group)
+        with self._lock:
+            counters = self.counters[group]
+            if cap and self.in_flight[group] >= cap:
+                counters["shed"] += 1
+                return 503, 1
+            self.in_flight[group] += 1
+            counters["allowed"] += 1
+            counters["peak_in_flight"] = max(counters["peak_in_flight"], self.in_flight[group])
+        return None
+
+    def release(self, group):
+        with self._lock:
+            self.in_flight[group] -= 1
+
+    def stats(self):
+        with self._lock:
+            groups = {
+                group: dict(
+                    self.counters[group],
+                    in_flight=self.in_flight[group],
+                    rate_limit=dict(zip(('rate', 'burst'), self.rate_limits[group])) if self.rate_limits.get(group) else None,
+                    concurrency_limit=self.concurrency_limits.get(group) or None,
+                )
+                for group in GROUPS
+            }
+        return {
+            "enabled": self.enabled,
+            "backend": 'redis' if self.shared is not None else 'memory',
+            "local_buckets": len(self.local),
+            "shared_errors": self.shared_errors,
+            "groups": groups,
+        }
+
+
+def endpoint_group(endpoint, method):
+    if endpoint in EXEMPT_ENDPOINTS or method == 'OPTIONS':
+        return None
+    return ENDPOINT_GROUPS.get(endpoint) or ('read' if method in ('GET', 'HEAD') else 'write')
+
+
+def rejection(status, retry_after):
+    response = make_response(jsonify({"message": REJECTION_MESSAGES[status]}), status)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def admit_request(controller, load_principal):
+    # Flask side, from before_request. load_principal() (the signed-in user or None) is only called for
+    # groups keyed by user
+    if not controller.enabled:
+        return None
+    group = endpoint_group(request.endpoint, request.method)
+    if group is None:
+        return None
+    principal = None if group in ADDRESS_GROUPS else load_principal()
+    subject = f'user:{principal.id}' if principal else f'ip:{request.remote_addr}'
+    rejected = controller.admit(group, subject)
+    if rejected:
+        return rejection(*rejected)
+    g.admission_group = group
+    return None
+
+
+def release_request(controller):
+    # From teardown_request, which runs after a streamed body is finished too
+    group = g.pop('admission_group', None)
+    if group is not None:
+        controller.release(group)
@@ -2,12 +2,18 @@
 # /server/app.py
 
 # Remote library imports
-from flask import request, make_response, jsonify, session, send_from_directory
+from flask import request, make_response, jsonify, session, Response, stream_with_context
 from flask_restful import Api, Resource
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_migrate import Migrate
-from flask_mail import Mail, Message
+from flask_mail import Mail
+from datetime import date, timedelta
+from sqlalchemy import select
 import functools
+import json
+import secrets
+import time
+import click
 from dotenv import load_dotenv
 import os
 
@@ -15,22 +21,55 @@ load_dotenv()
 
 
 from config import app, db, api
-from models import User, Role, Recipient, Parcel, BillingAddress
+from models import User, Role, Recipient, Parcel, BillingAddress, EmailOutbox, PARCEL_STATUSES
+from pagination import list_response
+from serializers import serialize, serializer_for
+from principal import load_principal, invalidate_principal
+from bulk import iter_request_rows, bulk_insert_parcels
+from outbox import OutboxWorkerPool, enqueue_email
+from tracking import lookup_tracking, invalidate_tracking
+from conditional import conditional_response, etag_response, precondition_failed, lock_query
+from compression import init_compression
+from nearby import find_nearby_parcels, NEARBY_MAX_RADIUS_KM, NEARBY_MAX_LIMIT
+from quotes import rate_table, quote_batch, fill_parcel_costs
+from routing import plan_routes
+from rollups import dashboard_metrics, reconcile_rollups, utc_now
+from replicas import read_replica, pool_stats
+from static_assets import init_static_assets
+from recipient_search import search_recipients, RECIPIENT_SEARCH_MIN_LENGTH
+from recipient_import import RecipientImport, import_format, iter_import_rows, backfill_dedupe_keys
+from parcel_export import EXPORT_FORMATS, RELATED_EXPORT_COLUMNS, export_query, export_chunks
+from compression import compress_stream
+from parcel_events import parcel_history, maintain_partitions
+from parcel_stream import event_stream, broker as parcel_broker
+from datagen import generate_dataset
+from sessions import revoke_user_sessions, session_stats
+from admission import AdmissionControl, admit_request, release_request
 
 migrate = Migrate(app, db)
+init_compression(app)
+static_assets = init_static_assets(app)
+
+# Eager loads for the nested user/recipient that the parcel serializer walks, instead of lazy loads per row
+parcel_load_options = serializer_for(Parcel).load_options(depth=2)
+# The user, recipient and billing address lists embed whole trees of rows, loaded all the way down
+user_load_options = serializer_for(User).load_options()
+recipient_load_options = serializer_for(Recipient).load_options()
+billing_address_load_options = serializer_for(BillingAddress).load_options()
 
 mail_server = os.getenv('mail_server')
 mail_port = os.getenv('mail_port')
 mail_username = os.getenv('mail_username')
 mail_password = os.getenv('mail_password')
 mail_defaul_sender = os.getenv('mail_defaul_sender')
+mail_use_tls = os.getenv('mail_use_tls', 'True')
 
 # Configuring mail
 # app.config['DEBUG'] = True
 # app.config['TESTING'] = False # This will be true while testing 
 app.config['MAIL_SERVER'] = f'{mail_server}'
 app.config['MAIL_PORT'] = f'{mail_port}' # May be another value based on the server
-app.config['MAIL_USE_TLS'] = True # Test first to see whether true or false works
+app.config['MAIL_USE_TLS'] = mail_use_tls.lower() == 'true' # Set mail_use_tls=False for a local SMTP stand-in
 app.config['MAIL_USE_SSL'] = False # Test first to see whether true or false works
 # app.config['MAIL_DEBUG'] = True # same value as the debug
 app.config['MAIL_USERNAME'] = f'{mail_username}'
@@ -43,11 +82,10 @@ app.config['MAIL_DEFAULT_SENDER'] = f'{mail_defaul_sender}'
 # Initialising Flask-Mail
 mail = Mail(app)
 
-def load_user():
-    user_id = session.get('user_id')
-    if user_id:
-        return User.query.get(int(user_id))
-    return None
+# Outbox workers send the queued emails over long-lived SMTP connections
+outbox_pool = OutboxWorkerPool(app, mail)
+if app.config['OUTBOX_WORKERS_IN_PROCESS']:
+    outbox_pool.start()
 
 @app.before_request
 def check_if_logged_in():
@@ -58,17 +96,29 @@ def check_if_logged_in():
     if any(request.path.startswith(path) for path in static_paths):
         return
     
-    whitelist = ['index', 'signup', 'login', 'check_session', 'logout', 'serve_static_files']
+    whitelist = ['index', 'signup', 'login', 'check_session', 'logout', 'serve_static_files', 'track']
     if request.endpoint is None:
         return make_response(jsonify({"message": "Invalid endpoint"}), 404)
     if request.endpoint not in whitelist and not request.endpoint.startswith('admin'):
-        user = load_user()
-        if not user:
+        principal = load_principal()
+        if not principal:
             return make_response(jsonify({"message": "Unauthorized access"}), 401)
-        if request.endpoint.startswith('admin') and not any(role.name == 'admin' for role in user.roles):
+        if request.endpoint.startswith('admin') and not principal.is_admin:
             return make_response(jsonify({"message": "Admin access required"}), 403)
 
 
+admission = AdmissionControl(app.config)
+
+@app.before_request
+def admission_control():
+    # Rate limits and in-flight caps per endpoint group (see admission.py), after the session check
+    return admit_request(admission, load_principal)
+
+@app.teardown_request
+def release_admission(exc):
+    release_request(admission)
+
+
 @app.route('/')
 def home():
     return jsonify({"message": "SendIT API is running"}), 200
@@ -76,14 +126,8 @@ def home():
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    if path != "":
-        full_path = os.path.join(app.static_folder, path)
-        if os.path.exists(full_path):
-            print(f"Serving file from: {full_path}")  # Debug log
-            return send_from_directory(app.static_folder, path)
-        else:
-            print(f"File not found: {full_path}")  # Debug log
-    return send_from_directory(app.static_folder, 'index.html')
+    # Files of the client bundle from memory, index.html for client-side routes
+    return static_assets.response(path)
 
 
 
@@ -110,29 +154,30 @@ class Signup(Resource):
 
         session['user_id'] = new_user.id
 
-        return {"message": "User created successfully", "user": new_user.to_dict()}, 201
+        return {"message": "User created successfully", "user": serialize(new_user)}, 201
 
 api.add_resource(Signup, '/signup', endpoint='signup')
 
+def session_user(user):
+    # The signed-in user as Login and CheckSession return it (also used by asgi.py)
+    roles = [role.name for role in user.roles]
+    return {
+        "id": user.id,
+        "email": user.email,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "roles": roles,
+        "isAdmin": 'admin' in roles,
+        "isUser": 'user' in roles
+    }
+
 class Login(Resource):
     def post(self):
         data = request.get_json()
         user = User.query.filter_by(email=data['email']).first()
         if user and check_password_hash(user.password, data['password']):
             session['user_id'] = user.id
-            roles = [role.name for role in user.roles]
-            return {
-                "message": "Login successful",
-                "user": {
-                    "id": user.id,
-                    "email": user.email,
-                    "first_name": user.first_name,
-                    "last_name": user.last_name,
-                    "roles": roles,
-                    "isAdmin": 'admin' in roles,
-                    "isUser": 'user' in roles
-                }
-            }, 200
+            return {"message": "Login successful", "user": session_user(user)}, 200
         return {"message": "Invalid credentials"}, 401
 
 
@@ -145,33 +190,36 @@ class Logout(Resource):
     
 api.add_resource(Logout, '/logout', endpoint='logout')
 
+# Signs the user out on every other device, needs a server-side SESSION_BACKEND
+class UserSessions(Resource):
+    def delete(self):
+        current_user = load_principal()
+        if not current_user:
+            return make_response(jsonify({"message": "Unauthorized"}), 401)
+        revoked = revoke_user_sessions(app, current_user.id, keep=getattr(session, 'sid', None))
+        if revoked is None:
+            return make_response(jsonify({"message": "Sessions can't be revoked with cookie sessions"}), 409)
+        return make_response(jsonify({"revoked": revoked}), 200)
+
+api.add_resource(UserSessions, '/user/sessions')
+
 class CheckSession(Resource):
+    @read_replica
     def get(self):
         user_id = session.get('user_id')
         if user_id:
             user = User.query.get(int(user_id))
             if user:
-                roles = [role.name for role in user.roles]
-                return {
-                    "message": "Session active",
-                    "user": {
-                        "id": user.id,
-                        "email": user.email,
-                        "first_name": user.first_name,
-                        "last_name": user.last_name,
-                        "roles": roles,
-                        "isAdmin": 'admin' in roles,
-                        "isUser": 'user' in roles
-                    }
-                }, 200
+                return {"message": "Session active", "user": session_user(user)}, 200
         return {"message": "No active session"}, 204
 
 api.add_resource(CheckSession, '/check_session', endpoint='check_session')
 
 class Users(Resource):
+    @read_replica
     def get(self):
-        response_dict_list = [user.to_dict() for user in User.query.all()]
-        return make_response(jsonify(response_dict_list), 200)
+        # Paginated with ?limit=&after=, otherwise streamed in chunks
+        return list_response(User.query.options(*user_load_options), User)
 
     def post(self):
         data = request.get_json()
@@ -184,17 +232,17 @@ class Users(Resource):
         )
         db.session.add(new_user)
         db.session.commit()
-        return make_response(jsonify(new_user.to_dict()), 201)
+        return make_response(jsonify(serialize(new_user)), 201)
 
 api.add_resource(Users, '/users')
 
 class UsersByID(Resource):
+    @read_replica
     def get(self, id):
         user_specific = User.query.filter_by(id=id).first()
         if user_specific:
             try:
-                user_data = user_specific.to_dict()
-                return user_data, 200
+                return conditional_response(user_specific)
             except Exception as e:
                 app.logger.error(f"Error serializing user data: {str(e)}")
                 return {"message": "Error serializing user data", "error": str(e)}, 500
@@ -202,15 +250,22 @@ class UsersByID(Resource):
 
 
     def patch(self, id):
-        user_specific = User.query.filter_by(id=id).first()
+        user_specific = lock_query(User.query.filter_by(id=id)).first()
         if user_specific:
+            stale = precondition_failed(user_specific)
+            if stale:
+                return stale
             data = request.get_json()
             for key, value in data.items():
                 if key == 'password':
                     value = generate_password_hash(value)
                 setattr(user_specific, key, value)
             db.session.commit()
-            return make_response(jsonify(user_specific.to_dict()), 200)
+            invalidate_principal(id)
+            if 'password' in data:
+                # Everywhere else the old password was used to sign in
+                revoke_user_sessions(app, id, keep=getattr(session, 'sid', None) if session.get('user_id') == id else None)
+            return etag_response(user_specific)
         return make_response(jsonify({"message": "User not found"}), 404)
 
     def delete(self, id):
@@ -218,6 +273,8 @@ class UsersByID(Resource):
         if user_specific:
             db.session.delete(user_specific)
             db.session.commit()
+            invalidate_principal(id)
+            revoke_user_sessions(app, id)
             return make_response({}, 204)
         return make_response(jsonify({"message": "User not found"}), 404)
 
@@ -225,8 +282,9 @@ api.add_resource(UsersByID, '/users/<int:id>')
 
 # Role resource
 class Roles(Resource):
+    @read_replica
     def get(self):
-        response_dict_list = [role.to_dict() for role in Role.query.all()]
+        response_dict_list = [serialize(role) for role in Role.query.all()]
         return make_response(jsonify(response_dict_list), 200)
 
     def post(self):
@@ -234,25 +292,30 @@ class Roles(Resource):
         new_role = Role(name=data['name'])
         db.session.add(new_role)
         db.session.commit()
-        return make_response(jsonify(new_role.to_dict()), 201)
+        return make_response(jsonify(serialize(new_role)), 201)
 
 api.add_resource(Roles, '/roles')
 
 class RolesByID(Resource):
+    @read_replica
     def get(self, id):
         role_specific = Role.query.filter_by(id=id).first()
         if role_specific:
-            return make_response(jsonify(role_specific.to_dict()), 200)
+            return conditional_response(role_specific)
         return make_response(jsonify({"message": "Role not found"}), 404)
 
     def patch(self, id):
-        role_specific = Role.query.filter_by(id=id).first()
+        role_specific = lock_query(Role.query.filter_by(id=id)).first()
         if role_specific:
+            stale = precondition_failed(role_specific)
+            if stale:
+                return stale
             data = request.get_json()
             for key, value in data.items():
                 setattr(role_specific, key, value)
             db.session.commit()
-            return make_response(jsonify(role_specific.to_dict()), 200)
+            invalidate_principal()
+            return etag_response(role_specific)
         return make_response(jsonify({"message": "Role not found"}), 404)
 
     def delete(self, id):
@@ -260,6 +323,7 @@ class RolesByID(Resource):
         if role_specific:
             db.session.delete(role_specific)
             db.session.commit()
+            invalidate_principal()
             return make_response({}, 204)
         return make_response(jsonify({"message": "Role not found"}), 404)
 
@@ -267,13 +331,16 @@ api.add_resource(RolesByID, '/roles/<int:id>')
 
 # Recipient resource
 class Recipients(Resource):
+    @read_replica
     def get(self):
-        response_dict_list = [recipient.to_dict() for recipient in Recipient.query.all()]
-        return make_response(jsonify(response_dict_list), 200)
+        # Paginated with ?limit=&after=, otherwise streamed in chunks
+        return list_response(Recipient.query.options(*recipient_load_options), Recipient)
 
     def post(self):
         data = request.get_json()
+        current_user = load_principal()
         new_recipient = Recipient(
+            user_id=current_user.id if current_user else None,
             first_name=data['first_name'],
             last_name=data['last_name'],
             email=data['email'],
@@ -288,25 +355,72 @@ class Recipients(Resource):
         )
         db.session.add(new_recipient)
         db.session.commit()
-        return make_response(jsonify(new_recipient.to_dict()), 201)
+        return make_response(jsonify(serialize(new_recipient)), 201)
 
 api.add_resource(Recipients, '/recipients')
 
+class RecipientsSearch(Resource):
+    @read_replica
+    def get(self):
+        if not load_principal():
+            return make_response(jsonify({"message": "Unauthorized"}), 401)
+        query = request.args.get('q', '')
+        if len(query.strip()) < RECIPIENT_SEARCH_MIN_LENGTH:
+            return make_response(jsonify({"message": f"q must be at least {RECIPIENT_SEARCH_MIN_LENGTH} characters"}), 400)
+        try:
+            limit = int(request.args.get('limit', 10))
+        except ValueError:
+            return make_response(jsonify({"message": "limit must be an integer"}), 400)
+        results = search_recipients(query, limit=limit,
+                                    similarity_threshold=app.config['RECIPIENT_SEARCH_SIMILARITY'])
+        return make_response(jsonify(results), 200)
+
+api.add_resource(RecipientsSearch, '/recipients/search')
+
+class RecipientsImport(Resource):
+    def post(self):
+        current_user = load_principal()
+        if not current_user:
+            return make_response(jsonify({"message": "Unauthorized"}), 401)
+
+        # CSV (with a header row) or NDJSON body, read incrementally
+        format = import_format(request.mimetype)
+        if format is None:
+            return make_response(jsonify({"message": "Send text/csv or application/x-ndjson"}), 415)
+
+        importer = RecipientImport(
+            max_rows=app.config['RECIPIENT_IMPORT_MAX_ROWS'],
+            batch_size=app.config['RECIPIENT_IMPORT_BATCH_SIZE'],
+            on_progress=lambda progress: app.logger.info(
+                "Recipient import: %(rows)s rows, %(inserted)s inserted, %(duplicates)s duplicates, %(failed)s failed", progress),
+            user_id=current_user.id
+        )
+        summary = importer.run(iter_import_rows(request.stream, format))
+        # 201 when every row was imported or already known, 207 when some rows were rejected, 400 when all were
+        status = 201 if not summary['failed'] else (207 if summary['inserted'] or summary['duplicates'] else 400)
+        return make_response(jsonify(summary), status)
+
+api.add_resource(RecipientsImport, '/recipients/import')
+
 class RecipientsByID(Resource):
+    @read_replica
     def get(self, id):
         recipient_specific = Recipient.query.filter_by(id=id).first()
         if recipient_specific:
-            return make_response(jsonify(recipient_specific.to_dict()), 200)
+            return conditional_response(recipient_specific)
         return make_response(jsonify({"message": "Recipient not found"}), 404)
 
     def patch(self, id):
-        recipient_specific = Recipient.query.filter_by(id=id).first()
+        recipient_specific = lock_query(Recipient.query.filter_by(id=id)).first()
         if recipient_specific:
+            stale = precondition_failed(recipient_specific)
+            if stale:
+                return stale
             data = request.get_json()
             for key, value in data.items():
                 setattr(recipient_specific, key, value)
             db.session.commit()
-            return make_response(jsonify(recipient_specific.to_dict()), 200)
+            return etag_response(recipient_specific)
         return make_response(jsonify({"message": "Recipient not found"}), 404)
 
     def delete(self, id):
@@ -321,65 +435,182 @@ api.add_resource(RecipientsByID, '/recipients/<int:id>')
 
 # Parcel resource
 class Parcels(Resource):
+    @read_replica
     def get(self):
-        response_dict_list = [parcel.to_dict() for parcel in Parcel.query.all()]
-        return make_response(jsonify(response_dict_list), 200)
+        # Paginated with ?limit=&after=, otherwise streamed in chunks
+        return list_response(Parcel.query.options(*parcel_load_options), Parcel)
 
     def post(self):
         data = request.get_json()
-        current_user = load_user()
+        current_user = load_principal()
+        values = {
+            'recipient_id': data['recipient_id'],
+            'length': data['length'],
+            'width': data['width'],
+            'height': data['height'],
+            'weight': data['weight'],
+            'cost': data.get('cost'),  # Make cost optional
+            'status': data['status']
+        }
+        if app.config['QUOTE_FILL_PARCEL_COST']:
+            fill_parcel_costs(rate_table, current_user.id, [values])
         new_parcel = Parcel(
             user_id=current_user.id,  # Automatically set the user_id from the current session user
-            recipient_id=data['recipient_id'],
-            length=data['length'],
-            width=data['width'],
-            height=data['height'],
-            weight=data['weight'],
-            cost=data.get('cost'),  # Make cost optional
-            status=data['status']
+            **values
         )
         db.session.add(new_parcel)
         db.session.commit()
-        return make_response(jsonify(new_parcel.to_dict()), 201)
+        return make_response(jsonify(serialize(new_parcel)), 201)
 
 api.add_resource(Parcels, '/parcels')
 
+class ParcelsBulk(Resource):
+    def post(self):
+        current_user = load_principal()
+        if not current_user:
+            return make_response(jsonify({"message": "Unauthorized"}), 401)
+
+        atomic = request.args.get('atomic', 'false').lower() == 'true'
+        try:
+            created, errors = bulk_insert_parcels(
+                current_user.id,
+                iter_request_rows(request),
+                max_rows=app.config['BULK_PARCEL_MAX_ROWS'],
+                atomic=atomic,
+                fill_costs=functools.partial(fill_parcel_costs, rate_table, current_user.id) if app.config['QUOTE_FILL_PARCEL_COST'] else None
+            )
+        except ValueError as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+
+        # 201 when every row went in, 207 when some rows were rejected, 400 when none were inserted
+        status = 201 if not errors else (207 if created else 400)
+        return make_response(jsonify({"created": created, "errors": errors}), status)
+
+api.add_resource(ParcelsBulk, '/parcels/bulk')
+
+class QuotesBatch(Resource):
+    def post(self):
+        # {"shipments": [...]} or a bare array, each shipment gives length/width/height (cm), weight (kg)
+        # and distance_km or origin_lat/origin_lng/destination_lat/destination_lng
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('shipments')
+        if not isinstance(data, list):
+            return make_response(jsonify({"message": "Expected a JSON array of shipments"}), 400)
+        if len(data) > app.config['QUOTE_BATCH_MAX_ROWS']:
+            return make_response(jsonify({"message": f"batch is limited to {app.config['QUOTE_BATCH_MAX_ROWS']} shipments"}), 400)
+
+        quotes, errors = quote_batch(rate_table, data)
+        status = 200 if not errors else (207 if quotes else 400)
+        return make_response(jsonify({"currency": rate_table.currency, "quotes": quotes, "errors": errors}), status)
+
+api.add_resource(QuotesBatch, '/quotes/batch')
+
+class ParcelsNearby(Resource):
+    @read_replica
+    def get(self):
+        if not load_principal():
+            return make_response(jsonify({"message": "Unauthorized"}), 401)
+        try:
+            latitude = float(request.args['lat'])
+            longitude = float(request.args['lng'])
+            radius_km = float(request.args.get('radius_km', 5))
+            limit = int(request.args.get('limit', 100))
+        except (KeyError, ValueError):
+            return make_response(jsonify({"message": "lat and lng are required, radius_km and limit must be numbers"}), 400)
+
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return make_response(jsonify({"message": "lat/lng out of range"}), 400)
+        if not 0 < radius_km <= NEARBY_MAX_RADIUS_KM:
+            return make_response(jsonify({"message": f"radius_km must be between 0 and {NEARBY_MAX_RADIUS_KM}"}), 400)
+
+        parcels = find_nearby_parcels(latitude, longitude, radius_km,
+                                      status=request.args.get('status'),
+                                      limit=min(max(limit, 1), NEARBY_MAX_LIMIT))
+        return make_response(jsonify(parcels), 200)
+
+api.add_resource(ParcelsNearby, '/parcels/nearby')
+
 class ParcelsByID(Resource):
+    @read_replica
     def get(self, id):
         parcel_specific = Parcel.query.filter_by(id=id).first()
         if parcel_specific:
-            return make_response(jsonify(parcel_specific.to_dict()), 200)
+            return conditional_response(parcel_specific)
         return make_response(jsonify({"message": "Parcel not found"}), 404)
 
     def patch(self, id):
-        parcel_specific = Parcel.query.filter_by(id=id).first()
+        parcel_specific = lock_query(Parcel.query.filter_by(id=id)).first()
         if parcel_specific:
+            stale = precondition_failed(parcel_specific)
+            if stale:
+                return stale
             data = request.get_json()
+            previous_tracking_number = parcel_specific.tracking_number
             for key, value in data.items():
                 setattr(parcel_specific, key, value)
             db.session.commit()
-            return make_response(jsonify(parcel_specific.to_dict()), 200)
+            invalidate_tracking(previous_tracking_number, parcel_specific.tracking_number)
+            return etag_response(parcel_specific)
         return make_response(jsonify({"message": "Parcel not found"}), 404)
 
     def delete(self, id):
         parcel_specific = Parcel.query.filter_by(id=id).first()
         if parcel_specific:
+            tracking_number = parcel_specific.tracking_number
             db.session.delete(parcel_specific)
             db.session.commit()
+            invalidate_tracking(tracking_number)
             return make_response({}, 204)
         return make_response(jsonify({"message": "Parcel not found"}), 404)
 
 api.add_resource(ParcelsByID, '/parcels/<int:id>')
 
+class ParcelEvents(Resource):
+    @read_replica
+    def get(self, id):
+        current_user = load_principal()
+        if not current_user:
+            return make_response(jsonify({"message": "Unauthorized"}), 401)
+        # The current status comes from the parcel row, the history from parcel_events. Locations and actors are
+        # for the sender and admins, everyone else has the public tracking projection
+        query = select(Parcel.id, Parcel.status, Parcel.created_at).where(Parcel.id == id)
+        if not current_user.is_admin:
+            query = query.where(Parcel.user_id == current_user.id)
+        parcel = db.session.execute(query).first()
+        if parcel is None:
+            return make_response(jsonify({"message": "Parcel not found"}), 404)
+        return make_response(jsonify({"parcel_id": parcel.id, "status": parcel.status, "events": parcel_history(parcel)}), 200)
+
+api.add_resource(ParcelEvents, '/parcels/<int:id>/events')
+
+# Public tracking lookup, no session required
+class Track(Resource):
+    # Not on a read replica: the projection is cached, a lagging replica would put a stale status back in the cache
+    def get(self, tracking_number):
+        projection = lookup_tracking(tracking_number)
+        if projection is None:
+            response = make_response(jsonify({"message": "Parcel not found"}), 404)
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+        response = make_response(jsonify(projection), 200)
+        # Short shared max-age so a CDN can absorb the polling, stale-while-revalidate hides refetches
+        max_age = app.config['TRACKING_CACHE_TTL']
+        response.headers['Cache-Control'] = f'public, max-age={max_age}, stale-while-revalidate={max_age * 2}'
+        return response
+
+api.add_resource(Track, '/track/<string:tracking_number>', endpoint='track')
+
 # BillingAddress resource
 class BillingAddresses(Resource):
+    @read_replica
     def get(self):
-        response_dict_list = [billing_address.to_dict() for billing_address in BillingAddress.query.all()]
-        return make_response(jsonify(response_dict_list), 200)
+        # Paginated with ?limit=&after=, otherwise streamed in chunks
+        return list_response(BillingAddress.query.options(*billing_address_load_options), BillingAddress)
 
     def post(self):
         data = request.get_json()
-        current_user = load_user()
+        current_user = load_principal()
         if not current_user:
             return make_response(jsonify({"message": "Unauthorized"}), 401)
 
@@ -395,25 +626,29 @@ class BillingAddresses(Resource):
         )
         db.session.add(new_billing_address)
         db.session.commit()
-        return make_response(jsonify(new_billing_address.to_dict()), 201)
+        return make_response(jsonify(serialize(new_billing_address)), 201)
 
 api.add_resource(BillingAddresses, '/billing_addresses')
 
 class BillingAddressesByID(Resource):
+    @read_replica
     def get(self, id):
         billing_address_specific = BillingAddress.query.filter_by(id=id).first()
         if billing_address_specific:
-            return make_response(jsonify(billing_address_specific.to_dict()), 200)
+            return conditional_response(billing_address_specific)
         return make_response(jsonify({"message": "BillingAddress not found"}), 404)
 
     def patch(self, id):
-        billing_address_specific = BillingAddress.query.filter_by(id=id).first()
+        billing_address_specific = lock_query(BillingAddress.query.filter_by(id=id)).first()
         if billing_address_specific:
+            stale = precondition_failed(billing_address_specific)
+            if stale:
+                return stale
             data = request.get_json()
             for key, value in data.items():
                 setattr(billing_address_specific, key, value)
             db.session.commit()
-            return make_response(jsonify(billing_address_specific.to_dict()), 200)
+            return etag_response(billing_address_specific)
         return make_response(jsonify({"message": "BillingAddress not found"}), 404)
 
     def delete(self, id):
@@ -426,9 +661,12 @@ class BillingAddressesByID(Resource):
 
 api.add_resource(BillingAddressesByID, '/billing_addresses/<int:id>')
 
-# SendEmail resource # Work in progress
+# SendEmail resource
 class SendEmail(Resource):
     def post(self):
+        current_user = load_principal()
+        if not current_user:
+            return make_response(jsonify({"message": "Unauthorized"}), 401)
         data = request.get_json()
         
         # Validate the incoming data
@@ -436,33 +674,108 @@ class SendEmail(Resource):
         if not all(field in data for field in required_fields):
             return {"message": "Missing required fields"}, 400
 
-        recipients = data['to']
-        subject = data['subject']
-        body = data['body']
-        
-        try:
-            # Create a new email message
-            # Ensured recipients is a list, even if a single email address is provided.
-            msg = Message(subject=subject,
-                          recipients=[recipients] if isinstance(recipients, str) else recipients,
-                          body=body,
-                          sender=app.config['MAIL_USERNAME'])
-            
-            # Send the email
-            mail.send(msg)
-            return {"message": "Email sent successfully"}, 200
-        
-        except Exception as e:
-            return {"message": f"Error sending email: {str(e)}"}, 500
+        # The email is only queued here, the outbox workers send it so the request never waits on SMTP
+        # Ensured recipients is a list, even if a single email address is provided.
+        outbox = enqueue_email(recipients=data['to'],
+                               subject=data['subject'],
+                               body=data['body'],
+                               sender=app.config['MAIL_USERNAME'],
+                               user_id=current_user.id)
+        outbox_pool.notify()
+        return {"message": "Email queued", "id": outbox.id}, 202
 
 # Add the SendEmail resource to the API
 api.add_resource(SendEmail, '/send-email')
 
+class SendEmailByID(Resource):
+    def get(self, id):
+        current_user = load_principal()
+        if not current_user:
+            return make_response(jsonify({"message": "Unauthorized"}), 401)
+        query = EmailOutbox.query.filter_by(id=id)
+        if not current_user.is_admin:
+            # Someone else's email is reported as missing, ids can't be probed
+            query = query.filter_by(user_id=current_user.id)
+        outbox = query.first()
+        if outbox:
+            return make_response(jsonify(serialize(outbox)), 200)
+        return make_response(jsonify({"message": "Email not found"}), 404)
+
+api.add_resource(SendEmailByID, '/send-email/<int:id>')
+
+@app.cli.command('outbox-worker')
+@click.option('--workers', type=int, default=None, help='Number of sender threads (defaults to OUTBOX_WORKERS)')
+def outbox_worker(workers):
+    """Send queued emails until interrupted."""
+    pool = OutboxWorkerPool(app, mail, workers=workers).start()
+    click.echo(f"Outbox worker running with {pool.workers} sender threads")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pool.stop()
+
+@app.cli.command('recipients-import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format', type=click.Choice(['csv', 'ndjson']), default=None, help='Defaults to the file extension')
+@click.option('--batch-size', type=int, default=None, help='Rows per INSERT/commit (defaults to RECIPIENT_IMPORT_BATCH_SIZE)')
+def recipients_import(path, format, batch_size):
+    """Import recipients from a CSV or NDJSON address book, skipping known contacts."""
+    format = format or import_format(None, path)
+    if format is None:
+        raise click.UsageError("Can't tell the format from the file name, pass --format")
+    importer = RecipientImport(
+        max_rows=float('inf'),
+        batch_size=batch_size or app.config['RECIPIENT_IMPORT_BATCH_SIZE'],
+        on_progress=lambda progress: click.echo(
+            f"{progress['rows']} rows: {progress['inserted']} inserted, {progress['duplicates']} duplicates, "
+            f"{progress['failed']} failed ({progress['rows_per_second']} rows/s)")
+    )
+    with open(path, 'rb') as address_book:
+        summary = importer.run(iter_import_rows(address_book, format))
+    for error in summary['errors']:
+        click.echo(f"row {error['index']}: {json.dumps(error['errors'])}", err=True)
+    click.echo(f"Done: {summary['inserted']} inserted, {summary['duplicates']} duplicates, {summary['failed']} failed "
+               f"in {summary['seconds']}s ({summary['rows_per_second']} rows/s)")
+
+@app.cli.command('recipients-dedupe-keys')
+def recipients_dedupe_keys():
+    """Compute the dedupe key of recipients created before it existed."""
+    click.echo(f"Updated {backfill_dedupe_keys()} recipients")
+
+@app.cli.command('parcel-events-partitions')
+@click.option('--ahead', type=int, default=None, help='Months to create after the current one (defaults to PARCEL_EVENTS_PARTITIONS_AHEAD)')
+@click.option('--retention-months', type=int, default=None, help='Months of history to keep, 0 keeps everything (defaults to PARCEL_EVENTS_RETENTION_MONTHS)')
+def parcel_events_partitions(ahead, retention_months):
+    """Create the coming monthly parcel_events partitions and drop the expired ones."""
+    created, dropped = maintain_partitions(
+        months_ahead=ahead if ahead is not None else app.config['PARCEL_EVENTS_PARTITIONS_AHEAD'],
+        retention_months=retention_months if retention_months is not None else app.config['PARCEL_EVENTS_RETENTION_MONTHS']
+    )
+    click.echo(f"Created {len(created)} partitions {', '.join(created)}".rstrip())
+    click.echo(f"Dropped {len(dropped)} partitions {', '.join(dropped)}".rstrip())
+
+@app.cli.command('datagen')
+@click.option('--scale', type=float, default=1.0, help='1 is 100 users, 500 recipients and 10,000 parcels')
+@click.option('--workers', type=int, default=os.cpu_count(), help='Processes generating parcels (PostgreSQL only)')
+@click.option('--days', type=int, default=365, help='Days of parcel history')
+@click.option('--seed', type=int, default=7, help='Same seed, same data')
+def datagen(scale, workers, days, seed):
+    """Generate a synthetic dataset of users, recipients, billing addresses and parcels."""
+    summary = generate_dataset(scale=scale, workers=workers, days=days, seed=seed, on_progress=click.echo)
+    click.echo(json.dumps(summary))
+
+@app.cli.command('rollups-reconcile')
+def rollups_reconcile():
+    """Rebuild the dashboard rollup tables from the parcels table."""
+    rows = reconcile_rollups()
+    click.echo(f"Rebuilt dashboard rollups ({rows} parcel stat rows)")
+
 def admin_required(f):
     @functools.wraps(f)
     def decorated_function(*args, **kwargs):
-        user = load_user()
-        if user and any(role.name == 'admin' for role in user.roles):
+        principal = load_principal()
+        if principal and principal.is_admin:
             return f(*args, **kwargs)
         return {"message": "Admin access required"}, 403
     return decorated_function
@@ -470,22 +783,222 @@ def admin_required(f):
 class AdminDashboard(Resource):
     @admin_required
     def get(self):
-        # I will see what admin-specific logic to add here
-        return {"message": "Welcome to the admin dashboard"}, 200
+        # Served from the rollup tables, ?from=&to= are inclusive ISO dates (UTC), the last 30 days by default
+        try:
+            end = date.fromisoformat(request.args['to']) if request.args.get('to') else utc_now().date()
+            start = date.fromisoformat(request.args['from']) if request.args.get('from') else end - timedelta(days=29)
+        except ValueError:
+            return make_response(jsonify({"message": "from and to must be dates (YYYY-MM-DD)"}), 400)
+        if start > end:
+            return make_response(jsonify({"message": "from must not be after to"}), 400)
+        return make_response(jsonify(dashboard_metrics(start, end)), 200)
 
 api.add_resource(AdminDashboard, '/admin/dashboard')
 
+class DatabasePools(Resource):
+    @admin_required
+    def get(self):
+        return make_response(jsonify(pool_stats(db)), 200)
+
+api.add_resource(DatabasePools, '/admin/db/pools')
+
+class AdminSessions(Resource):
+    @admin_required
+    def get(self):
+        return make_response(jsonify(session_stats(app)), 200)
+
+api.add_resource(AdminSessions, '/admin/sessions')
+
+class AdminAdmission(Resource):
+    @admin_required
+    def get(self):
+        return make_response(jsonify(admission.stats()), 200)
+
+api.add_resource(AdminAdmission, '/admin/admission')
+
+class AdminUserSessions(Resource):
+    @admin_required
+    def delete(self, id):
+        revoked = revoke_user_sessions(app, id)
+        if revoked is None:
+            return make_response(jsonify({"message": "Sessions can't be revoked with cookie sessions"}), 409)
+        return make_response(jsonify({"revoked": revoked}), 200)
+
+api.add_resource(AdminUserSessions, '/admin/users/<int:id>/sessions')
+
+@app.cli.command('session-key')
+def session_key():
+    """Print a new session signing key, to go in front of SESSION_SIGNING_KEYS."""
+    click.echo(secrets.token_urlsafe(32))
+
+class RoutePlans(Resource):
+    @admin_required
+    def post(self):
+        # {"depot": {"latitude", "longitude"}, "parcel_ids": [...] or "status", "drivers", "time_budget"}
+        data = request.get_json(silent=True) or {}
+        depot = data.get('depot') or {}
+        try:
+            depot = (float(depot['latitude']), float(depot['longitude']))
+            drivers = int(data['drivers']) if data.get('drivers') is not None else None
+            time_budget = min(float(data.get('time_budget', app.config['ROUTE_TIME_BUDGET'])), app.config['ROUTE_TIME_BUDGET'])
+        except (KeyError, TypeError, ValueError):
+            return make_response(jsonify({"message": "depot latitude/longitude are required, drivers and time_budget must be numbers"}), 400)
+        if drivers is not None and drivers < 1:
+            return make_response(jsonify({"message": "drivers must be at least 1"}), 400)
+
+        query = select(Parcel.id, Parcel.latitude, Parcel.longitude)
+        parcel_ids = data.get('parcel_ids')
+        if parcel_ids is not None:
+            # bool is an int too, but true isn't a parcel id
+            if (not isinstance(parcel_ids, list) or len(parcel_ids) > app.config['ROUTE_MAX_STOPS']
+                    or any(type(parcel_id) is not int for parcel_id in parcel_ids)):
+                return make_response(jsonify({"message": f"parcel_ids must be a list of at most {app.config['ROUTE_MAX_STOPS']} ids"}), 400)
+            query = query.where(Parcel.id.in_(parcel_ids))
+        else:
+            query = query.where(Parcel.status == data.get('status', 'Out For Delivery'))
+        rows = db.session.execute(query.limit(app.config['ROUTE_MAX_STOPS'] + 1)).all()
+        if len(rows) > app.config['ROUTE_MAX_STOPS']:
+            return make_response(jsonify({"message": f"more than {app.config['ROUTE_MAX_STOPS']} stops, plan a narrower set"}), 400)
+
+        stops = [row for row in rows if row.latitude is not None and row.longitude is not None]
+        routable = {row.id for row in stops}
+        unroutable = [parcel_id for parcel_id in (parcel_ids if parcel_ids is not None else [row.id for row in rows]) if parcel_id not in routable]
+        try:
+            plan = plan_routes(
+                depot,
+                [row.id for row in stops],
+                [float(row.latitude) for row in stops],
+                [float(row.longitude) for row in stops],
+                max_stops_per_route=app.config['ROUTE_MAX_STOPS_PER_DRIVER'],
+                drivers=drivers,
+                time_budget=time_budget,
+                workers=app.config['ROUTE_WORKERS']
+            )
+        except ValueError as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+        plan['unroutable'] = unroutable
+        return make_response(jsonify(plan), 200)
+
+api.add_resource(RoutePlans, '/routes/plan')
+
+def parse_export_filters(args):
+    # Shared by the export endpoint and CLI, raises ValueError with a message for the client
+    try:
+        start = date.fromisoformat(args['from']) if args.get('from') else None
+        end = date.fromisoformat(args['to']) if args.get('to') else None
+    except ValueError:
+        raise ValueError("from and to must be dates (YYYY-MM-DD)")
+    statuses = [status for status in (args.get('status') or '').split(',') if status]
+    unknown = [status for status in statuses if status not in PARCEL_STATUSES]
+    if unknown:
+        raise ValueError(f"status must be one of {', '.join(PARCEL_STATUSES)}")
+    include = [name for name in (args.get('include') or '').split(',') if name]
+    if any(name not in RELATED_EXPORT_COLUMNS for name in include):
+        raise ValueError(f"include must be made of {', '.join(RELATED_EXPORT_COLUMNS)}")
+    try:
+        user_id = int(args['user_id']) if args.get('user_id') else None
+    except ValueError:
+        raise ValueError("user_id must be an integer")
+    return export_query(start=start, end=end, statuses=statuses, user_id=user_id, include=include)
+
+class ParcelsExport(Resource):
+    @admin_required
+    @read_replica
+    def get(self):
+        # ?from=&to=&status=&user_id=&include=recipient,user&format=csv|ndjson&gzip=true
+        format = request.args.get('format', 'csv')
+        if format not in EXPORT_FORMATS:
+            return make_response(jsonify({"message": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400)
+        try:
+            query = parse_export_filters(request.args)
+        except ValueError as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+
+        chunks = export_chunks(query, format, app.json.dumps)
+        filename = f"parcels.{format}"
+        mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+        if request.args.get('gzip', 'false').lower() == 'true':
+            # A .gz download; otherwise the compression hook still gzips for clients sending Accept-Encoding
+            chunks = compress_stream(chunks, 'gzip', app.config)
+            filename, mimetype = f"{filename}.gz", 'application/gzip'
+        response = Response(stream_with_context(chunks), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+api.add_resource(ParcelsExport, '/parcels/export')
+
+@app.cli.command('parcels-export')
+@click.option('--from', 'start', default=None, help='First creation day (YYYY-MM-DD, UTC)')
+@click.option('--to', 'end', default=None, help='Last creation day (YYYY-MM-DD, UTC)')
+@click.option('--status', default=None, help='Comma separated statuses')
+@click.option('--user-id', default=None, help='Only parcels of this user')
+@click.option('--include', default=None, help='Comma separated joins: recipient, user')
+@click.option('--format', 'format', type=click.Choice(EXPORT_FORMATS), default='csv')
+@click.option('--output', type=click.Path(dir_okay=False, writable=True), default=None, help='Defaults to stdout')
+@click.option('--gzip', 'use_gzip', is_flag=True, help='Gzip the output')
+def parcels_export(start, end, status, user_id, include, format, output, use_gzip):
+    """Stream parcels as CSV or NDJSON with constant memory."""
+    try:
+        query = parse_export_filters({'from': start, 'to': end, 'status': status, 'user_id': user_id, 'include': include})
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    chunks = export_chunks(query, format, app.json.dumps)
+    if use_gzip:
+        chunks = compress_stream(chunks, 'gzip', app.config)
+    else:
+        chunks = (chunk.encode() for chunk in chunks)
+    stream = open(output, 'wb') if output else click.get_binary_stream('stdout')
+    try:
+        for chunk in chunks:
+            stream.write(chunk)
+    finally:
+        if output:
+            stream.close()
+
 class ParcelsByUserID(Resource):
+    @read_replica
     def get(self):
-        current_user = load_user()
+        current_user = load_principal()
         if not current_user:
             return make_response(jsonify({"message": "Unauthorized"}), 401)
         
-        parcels = Parcel.query.filter_by(user_id=current_user.id).all()
-        return jsonify([parcel.to_dict() for parcel in parcels])
+        parcels = Parcel.query.options(*parcel_load_options).filter_by(user_id=current_user.id).all()
+        return jsonify([serialize(parcel) for parcel in parcels])
 
 api.add_resource(ParcelsByUserID, '/user/parcels')
 
+# Live status updates for the signed-in user's parcels, replaces polling /user/parcels
+class ParcelsByUserIDStream(Resource):
+    # Holds the worker thread serving it until the client goes away, capped by CONCURRENCY_LIMIT_STREAM.
+    # Serve streams with the async server (asgi.py) where many clients stay connected
+    def get(self):
+        current_user = load_principal()
+        if not current_user:
+            return make_response(jsonify({"message": "Unauthorized"}), 401)
+
+        # EventSource sends Last-Event-ID on reconnect, ?last_event_id= is for clients that can't set headers
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            return make_response(jsonify({"message": "Last-Event-ID must be an event id"}), 400)
+
+        response = Response(stream_with_context(event_stream(current_user.id, last_event_id, app.json.dumps)), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # Keeps nginx from buffering the events
+        # Compressing would hold events back in the compressor
+        response.direct_passthrough = True
+        return response
+
+api.add_resource(ParcelsByUserIDStream, '/user/parcels/stream')
+
+class ParcelStreamStats(Resource):
+    @admin_required
+    def get(self):
+        return make_response(jsonify(parcel_broker.stats()), 200)
+
+api.add_resource(ParcelStreamStats, '/admin/streams')
+
 if __name__ == '__main__':
     #app.run(port=5555, debug=True) # Commenting out so that it doesn't conflict with deployment server
     #app.run(host='0.0.0.0', port=int(os.getenv('PORT', 5555)), debug=False)
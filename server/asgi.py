@@ -0,0 +1,385 @@
+# /server/asgi.py
+
+# Async serving mode: `uvicorn asgi:application --workers N` (run from /server).
+# The I/O-bound hot paths (session check, the user's parcels and their live event stream, a parcel by id,
+# public tracking and email enqueue) are native async routes on async SQLAlchemy (asyncpg on PostgreSQL,
+# aiosqlite on SQLite), so a worker keeps serving while those requests wait on the database or on parcel
+# events instead of holding a thread each.
+# Every other route falls through to the Flask app, which runs unchanged in a thread pool of
+# ASGI_WSGI_THREADS. The sync deployment (gunicorn app:app) is untouched and both can run side by side.
+# The ORM work runs inside AsyncSession.run_sync, so the serializers and the sync query helpers are reused
+# as they are, only the database round trips are awaited. The async routes read the Flask session cookie
+# but never write it, and they always use the primary (replica routing is Flask-SQLAlchemy only).
+# They go through the same rate limits and in-flight caps as the Flask routes (see admission.py). Behind a
+# reverse proxy run uvicorn with --no-proxy-headers, PROXY_FIX_HOPS decides which X-Forwarded-For entry is
+# the client for both the async routes and Flask.
+
+import asyncio
+import contextlib
+import functools
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+
+from admission import ADDRESS_GROUPS, REJECTION_MESSAGES
+from app import app as flask_app, admission, outbox_pool, parcel_load_options, session_user
+from compression import choose_encoding, compress_body
+from conditional import row_etag, body_etag
+from config import engine_options, CORS_ORIGINS, CORS_EXPOSE_HEADERS
+from models import Parcel, User
+from outbox import enqueue_email
+from parcel_stream import StreamCursor, broker as parcel_broker, replay_events
+from principal import principal_cache, _fetch_principal
+from serializers import serialize
+from tracking import tracking_cache, fetch_tracking_projection, shared_cache, _shared_get, _shared_set
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+
+def create_engine(uri, options):
+    # Same database as the Flask app, on the async driver
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver configured for {backend}")
+    options = dict(options)
+    if backend == 'postgresql' and 'sslmode' in url.query:
+        # asyncpg takes libpq's sslmode values as `ssl`
+        sslmode = url.query['sslmode']
+        url = url.difference_update_query(['sslmode'])
+        if sslmode != 'disable':
+            options['connect_args'] = {'ssl': sslmode}
+    if backend == 'sqlite' and url.database not in (None, '', ':memory:'):
+        # aiosqlite defaults to a new connection (and thread) per checkout, pool them like pysqlite does
+        options.setdefault('poolclass', AsyncAdaptedQueuePool)
+    return create_async_engine(url.set(drivername=ASYNC_DRIVERS[backend]), **options)
+
+
+engine = create_engine(flask_app.config['SQLALCHEMY_DATABASE_URI'], engine_options)
+# Open streams cost no thread here, the cap sized for Flask's worker threads doesn't apply
+admission.concurrency_limits['stream'] = flask_app.config['ASGI_STREAM_LIMIT']
+async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+async def session_user_id(request):
+    # The Flask session as its session interface reads it (see sessions.py), once per request. A server-side
+    # store lookup is a blocking call, it goes to the thread pool
+    if not hasattr(request.state, 'user_id'):
+        interface = flask_app.session_interface
+        cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+        if interface.store is None or not cookie:
+            data = interface.session_from_cookie(flask_app, cookie)
+        else:
+            data = await run_in_threadpool(interface.session_from_cookie, flask_app, cookie)
+        request.state.user_id = int(data['user_id']) if data.get('user_id') else None
+    return request.state.user_id
+
+
+async def load_principal(request, session):
+    # principal.load_principal without flask.g, sharing its per-process cache
+    user_id = await session_user_id(request)
+    if user_id is None:
+        return None
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        principal = await session.run_sync(lambda sync_session: _fetch_principal(user_id, sync_session))
+        ttl = flask_app.config.get('PRINCIPAL_CACHE_TTL', 10)
+        if principal is not None and ttl:
+            principal_cache.set(user_id, principal, ttl=ttl)
+    return principal
+
+
+def cors_headers(request):
+    # What Flask-Cors adds to simple requests. Preflights fall through to the Flask app
+    origin = request.headers.get('origin')
+    if origin not in CORS_ORIGINS:
+        return {}
+    return {
+        'Access-Control-Allow-Origin': origin,
+        'Access-Control-Allow-Credentials': 'true',
+        'Access-Control-Expose-Headers': ', '.join(CORS_EXPOSE_HEADERS),
+    }
+
+
+def json_response(request, body, status=200, headers=None):
+    data = flask_app.json.dumps(body).encode()
+    headers = dict(headers or {}, **cors_headers(request))
+    vary = ['Origin']
+
+    config = flask_app.config
+    if config.get('COMPRESS_ENABLED', True) and request.method != 'HEAD':
+        vary.append('Accept-Encoding')
+        if len(data) >= config['COMPRESS_MIN_SIZE']:
+            encoding = choose_encoding(parse_accept_header(request.headers.get('accept-encoding'), Accept))
+            if encoding is not None:
+                data = compress_body(data, encoding, config)
+                headers['Content-Encoding'] = encoding
+    headers['Vary'] = ', '.join(vary)
+    return Response(data, status_code=status, media_type='application/json', headers=headers)
+
+
+def empty_response(request, status, headers=None):
+    return Response(status_code=status, headers=dict(headers or {}, **cors_headers(request)))
+
+
+def client_address(request):
+    # The address ProxyFix gives the Flask routes (see config.py): the PROXY_FIX_HOPS-th X-Forwarded-For entry
+    # from the right, the peer address when there are fewer entries than trusted proxies
+    address = request.client.host if request.client else None
+    hops = flask_app.config['PROXY_FIX_HOPS']
+    forwarded_for = request.headers.get('x-forwarded-for')
+    if hops and forwarded_for:
+        forwarded = [value.strip() for value in forwarded_for.split(',')]
+        if len(forwarded) >= hops:
+            address = forwarded[-hops]
+    return address
+
+
+async def admit(request, group):
+    # admission.admit_request for the async routes, sharing the Flask app's buckets, caps and counters.
+    # A rejection response, or None when admitted, then admission.release(group) is due once the request is done
+    if not admission.enabled:
+        return None
+    user_id = None if group in ADDRESS_GROUPS else await session_user_id(request)
+    subject = f'user:{user_id}' if user_id else f'ip:{client_address(request)}'
+    if admission.shared is None:
+        rejected = admission.admit(group, subject)
+    else:
+        rejected = await run_in_threadpool(admission.admit, group, subject)
+    if rejected:
+        status, retry_after = rejected
+        return json_response(request, {"message": REJECTION_MESSAGES[status]}, status, {'Retry-After': str(retry_after)})
+    return None
+
+
+def release(group):
+    if admission.enabled:
+        admission.release(group)
+
+
+def admitted(group):
+    def decorate(handler):
+        @functools.wraps(handler)
+        async def admit_handler(request):
+            rejected = await admit(request, group)
+            if rejected is not None:
+                return rejected
+            try:
+                return await handler(request)
+            finally:
+                release(group)
+        return admit_handler
+    return decorate
+
+
+async def check_session(request):
+    user_id = await session_user_id(request)
+    if user_id is None:
+        return empty_response(request, 204)
+
+    def active_user(sync_session):
+        # session_user walks user.roles, a lazy load is fine inside run_sync
+        user = sync_session.get(User, user_id)
+        return session_user(user) if user else None
+
+    async with async_session() as session:
+        user = await session.run_sync(active_user)
+    if user is None:
+        return empty_response(request, 204)
+    return json_response(request, {"message": "Session active", "user": user})
+
+
+@admitted('read')
+async def user_parcels(request):
+    async with async_session() as session:
+        principal = await load_principal(request, session)
+        if principal is None:
+            return json_response(request, {"message": "Unauthorized"}, 401)
+
+        def parcels(sync_session):
+            query = select(Parcel).options(*parcel_load_options).where(Parcel.user_id == principal.id)
+            return [serialize(parcel) for parcel in sync_session.scalars(query)]
+
+        return json_response(request, await session.run_sync(parcels))
+
+
+@admitted('read')
+async def parcel_by_id(request):
+    # conditional.conditional_response, the same ETags as the Flask route
+    parcel_id = request.path_params['id']
+    if_none_match = parse_etags(request.headers.get('if-none-match'))
+
+    def conditional(sync_session):
+        parcel = sync_session.scalars(select(Parcel).where(Parcel.id == parcel_id)).first()
+        if parcel is None:
+            return None, None
+        etag = row_etag(parcel)
+        if etag and if_none_match.contains_weak(etag):
+            return etag, None
+        body = serialize(parcel)
+        return etag or body_etag(body), body
+
+    async with async_session() as session:
+        etag, body = await session.run_sync(conditional)
+
+    if etag is None:
+        return json_response(request, {"message": "Parcel not found"}, 404)
+    headers = {'ETag': quote_etag(etag, weak=True)}
+    if body is None or if_none_match.contains_weak(etag):
+        return empty_response(request, 304, headers)
+    return json_response(request, body, headers=headers)
+
+
+@admitted('public')
+async def track(request):
+    # tracking.lookup_tracking with the database lookup awaited. The Redis client is blocking, so the shared
+    # cache calls go to the thread pool (they are bounded by its 50 ms socket timeout anyway)
+    tracking_number = request.path_params['tracking_number']
+    projection = tracking_cache.get(tracking_number)
+    if projection is None:
+        shared = shared_cache() is not None
+        if shared:
+            projection = await run_in_threadpool(_shared_get, tracking_number)
+        if projection is None:
+            async with async_session() as session:
+                projection = await session.run_sync(
+                    lambda sync_session: fetch_tracking_projection(tracking_number, sync_session)
+                )
+            if projection is not None and shared:
+                await run_in_threadpool(_shared_set, tracking_number, projection)
+        if projection is not None:
+            tracking_cache.set(tracking_number, projection)
+
+    if projection is None:
+        return json_response(request, {"message": "Parcel not found"}, 404, {'Cache-Control': 'no-store'})
+    max_age = flask_app.config['TRACKING_CACHE_TTL']
+    return json_response(request, projection, headers={
+        'Cache-Control': f'public, max-age={max_age}, stale-while-revalidate={max_age * 2}'
+    })
+
+
+@admitted('write')
+async def send_email(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or not all(field in data for field in ('to', 'subject', 'body')):
+        return json_response(request, {"message": "Missing required fields"}, 400)
+
+    async with async_session() as session:
+        principal = await load_principal(request, session)
+        if principal is None:
+            return json_response(request, {"message": "Unauthorized"}, 401)
+        outbox = await session.run_sync(lambda sync_session: enqueue_email(
+            recipients=data['to'],
+            subject=data['subject'],
+            body=data['body'],
+            sender=flask_app.config['MAIL_USERNAME'],
+            user_id=principal.id,
+            session=sync_session
+        ))
+    outbox_pool.notify()
+    return json_response(request, {"message": "Email queued", "id": outbox.id}, 202)
+
+
+class EventStreamResponse(StreamingResponse):
+    # Runs on_close once the stream is over, whether it finished, failed or the client went away
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+
+async def parcel_events(user_id, last_event_id):
+    # parcel_stream.event_stream on the event loop: an idle stream is a task waiting on its subscription
+    config = flask_app.config
+    limit = config['SSE_REPLAY_LIMIT']
+    subscription = parcel_broker.subscribe(user_id, loop=asyncio.get_running_loop())
+    cursor = StreamCursor(last_event_id, flask_app.json.dumps)
+    try:
+        yield f"retry: {config['SSE_RETRY_MS']}\n\n"
+        while True:
+            if cursor.catch_up:
+                if cursor.last_id is None:
+                    replayed = None, True
+                else:
+                    after_id = cursor.last_id
+                    async with async_session() as session:
+                        replayed = await session.run_sync(
+                            lambda sync_session: replay_events(user_id, after_id, limit, sync_session)
+                        )
+                for frame in cursor.replayed_frames(*replayed):
+                    yield frame
+            for frame in cursor.live_frames(*await subscription.wait_async(config['SSE_HEARTBEAT_SECONDS'])):
+                yield frame
+    finally:
+        parcel_broker.unsubscribe(subscription)
+
+
+async def open_stream(request):
+    async with async_session() as session:
+        principal = await load_principal(request, session)
+    if principal is None:
+        return json_response(request, {"message": "Unauthorized"}, 401)
+
+    last_event_id = request.headers.get('last-event-id') or request.query_params.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return json_response(request, {"message": "Last-Event-ID must be an event id"}, 400)
+
+    return EventStreamResponse(
+        parcel_events(principal.id, last_event_id),
+        on_close=lambda: release('stream'),
+        media_type='text/event-stream',
+        headers=dict(cors_headers(request), **{'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}),
+    )
+
+
+async def user_parcel_stream(request):
+    # ParcelsByUserIDStream without a thread per open stream. It counts as in flight until the stream is over
+    rejected = await admit(request, 'stream')
+    if rejected is not None:
+        return rejected
+    response = None
+    try:
+        response = await open_stream(request)
+    finally:
+        if not isinstance(response, EventStreamResponse):
+            release('stream')
+    return response
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    await engine.dispose()
+
+
+# A request whose method an async route doesn't handle (e.g. PATCH /parcels/1) keeps matching and reaches Flask
+application = Starlette(
+    routes=[
+        Route('/check_session', check_session, methods=['GET']),
+        Route('/user/parcels', user_parcels, methods=['GET']),
+        Route('/user/parcels/stream', user_parcel_stream, methods=['GET']),
+        Route('/parcels/{id:int}', parcel_by_id, methods=['GET']),
+        Route('/track/{tracking_number}', track, methods=['GET']),
+        Route('/send-email', send_email, methods=['POST']),
+        Mount('/', WSGIMiddleware(flask_app, workers=flask_app.config['ASGI_WSGI_THREADS'])),
+    ],
+    lifespan=lifespan,
+)
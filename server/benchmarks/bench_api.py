@@ -0,0 +1,464 @@
+# /server/benchmarks/bench_api.py
+
+# End-to-end HTTP benchmark of the API.
+# Starts the app in its own process (threaded werkzeug server, or gunicorn with --server gunicorn) against a
+# scratch SQLite file or the database given with --database-uri, signs up one account per virtual user and
+# seeds its recipients and parcels through the API, then has --concurrency virtual users run a weighted mix of
+# requests (login, check_session, /user/parcels, parcel create/get/patch, list pages, tracking) for --duration
+# seconds after --warmup. Per endpoint it reports throughput, p50/p95/p99 latency and SQL statements per
+# request (counted in the server process and returned in an X-Bench-Statements header).
+# --output writes the results as JSON, --compare diffs them against an earlier file and exits with status 1
+# when an endpoint's p95 got worse by more than --threshold, so two runs can be compared in CI.
+# Run from /server:  python -m benchmarks.bench_api [--concurrency 1 8 32] [--duration 20] [--output bench.json]
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import numpy as np
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATEMENTS_HEADER = 'X-Bench-Statements'
+PASSWORD = 'bench-password'
+STATUSES = ('Pending', 'Accepted', 'Out For Delivery', 'Delivered')
+
+# (endpoint label, weight), labels are what the results are keyed by
+REQUEST_MIX = (
+    ('POST /login', 2),
+    ('GET /check_session', 15),
+    ('GET /user/parcels', 12),
+    ('POST /parcels', 8),
+    ('GET /parcels/<id>', 20),
+    ('PATCH /parcels/<id>', 8),
+    ('GET /parcels?limit=50', 8),
+    ('GET /recipients?limit=50', 6),
+    ('GET /track/<tracking_number>', 8),
+)
+
+
+# Server side
+
+def bench_app():
+    # The app with statement counting, also the gunicorn entry point ('benchmarks.bench_api:bench_app()')
+    from flask import g, has_app_context
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    from app import app
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def count_statement(connection, cursor, statement, parameters, context, executemany):
+        if has_app_context():
+            g.bench_statements = g.get('bench_statements', 0) + 1
+
+    @app.after_request
+    def report_statements(response):
+        response.headers[STATEMENTS_HEADER] = str(g.get('bench_statements', 0))
+        return response
+
+    return app
+
+
+def setup_database():
+    from app import app
+    from config import db
+    from models import Role
+
+    with app.app_context():
+        db.create_all()
+        existing = {role.name for role in Role.query.all()}
+        db.session.add_all(Role(name=name) for name in ('admin', 'user') if name not in existing)
+        db.session.commit()
+
+
+def serve(port):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    make_server('127.0.0.1', port, bench_app(), threaded=True, request_handler=KeepAliveHandler).serve_forever()
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def start_server(args, database_uri):
+    env = dict(os.environ, DATABASE_URI=database_uri)
+    # Shared by the gunicorn workers, otherwise a cookie is only valid on the worker that set it
+    env.setdefault('SESSION_SIGNING_KEYS', secrets.token_urlsafe(32))
+    # The benchmark users would trip the rate limits, ADMISSION_ENABLED=true measures them too
+    env.setdefault('ADMISSION_ENABLED', 'false')
+    subprocess.run([sys.executable, '-m', 'benchmarks.bench_api', 'setup'], cwd=SERVER_DIR, env=env, check=True)
+
+    port = free_port()
+    if args.server == 'gunicorn':
+        command = [
+            sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(args.server_workers),
+            '--threads', str(max(args.concurrency)), '--worker-class', 'gthread', '--log-level', 'warning',
+            'benchmarks.bench_api:bench_app()',
+        ]
+    else:
+        command = [sys.executable, '-m', 'benchmarks.bench_api', 'serve', '--port', str(port)]
+    process = subprocess.Popen(command, cwd=SERVER_DIR, env=env)
+    return wait_for_server(process, port), port
+
+
+def wait_for_server(process, port):
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited with status {process.returncode}")
+        try:
+            status, _, _, _ = Client('127.0.0.1', port).request('GET', '/check_session')
+            if status < 500:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("Server didn't come up within 30 seconds")
+
+
+# Client side
+
+class Client:
+    # One keep-alive connection and session cookie per virtual user
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.connection = http.client.HTTPConnection(host, port, timeout=60)
+        self.cookie = None
+
+    def request(self, method, path, body=None):
+        # Returns (status, body bytes, statements, seconds)
+        headers = {'Accept': 'application/json'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        for attempt in (1, 2):
+            start = time.perf_counter()
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed the keep-alive connection, retry once on a new one
+                self.connection.close()
+                if attempt == 2:
+                    raise
+        elapsed = time.perf_counter() - start
+        for header in response.headers.get_all('Set-Cookie') or ():
+            if header.startswith('session='):
+                self.cookie = header.split(';', 1)[0]
+        statements = response.headers.get(STATEMENTS_HEADER)
+        return response.status, data, int(statements) if statements is not None else None, elapsed
+
+
+class VirtualUser:
+    def __init__(self, client, email, recipients, parcels, rng):
+        self.client = client
+        self.email = email
+        self.recipient_count = recipients
+        self.parcel_count = parcels
+        self.rng = rng
+        self.recipient_ids = []
+        self.parcels = []  # (id, tracking number)
+
+    def expect(self, result, *statuses):
+        status, data, _, _ = result
+        if status not in statuses:
+            raise RuntimeError(f"Seeding failed with {status}: {data[:200]!r}")
+        return json.loads(data) if data else None
+
+    def seed(self):
+        self.expect(self.client.request('POST', '/signup', {
+            'first_name': 'Bench', 'last_name': 'User', 'email': self.email, 'password': PASSWORD,
+        }), 201)
+        for index in range(self.recipient_count):
+            recipient = self.expect(self.client.request('POST', '/recipients', {
+                'first_name': f'Recipient{index}', 'last_name': 'Bench', 'email': f'r{index}.{self.email}',
+                'phone_number': f'07{self.rng.randrange(10 ** 8):08d}', 'street': f'{index} Moi Avenue',
+                'city': self.rng.choice(('Nairobi', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret')), 'state': 'Kenya',
+                'zip_code': f'{self.rng.randrange(100, 99999):05d}', 'country': 'Kenya',
+                'latitude': round(-1.29 + self.rng.uniform(-0.2, 0.2), 6),
+                'longitude': round(36.82 + self.rng.uniform(-0.2, 0.2), 6),
+            }), 201)
+            self.recipient_ids.append(recipient['id'])
+        if self.parcel_count:
+            rows = [self.parcel_values() for _ in range(self.parcel_count)]
+            created = self.expect(self.client.request('POST', '/parcels/bulk', rows), 201)
+            self.parcels.extend((row['id'], row['tracking_number']) for row in created['created'])
+
+    def parcel_values(self):
+        return {
+            'recipient_id': self.rng.choice(self.recipient_ids),
+            'length': round(self.rng.uniform(5, 80), 2), 'width': round(self.rng.uniform(5, 60), 2),
+            'height': round(self.rng.uniform(2, 50), 2), 'weight': round(self.rng.uniform(0.1, 30), 2),
+            'cost': round(self.rng.uniform(150, 5000), 2), 'status': 'Pending',
+        }
+
+    def run(self, label):
+        # Issues the request behind a REQUEST_MIX label
+        client = self.client
+        if label == 'POST /login':
+            return client.request('POST', '/login', {'email': self.email, 'password': PASSWORD})
+        if label == 'GET /check_session':
+            return client.request('GET', '/check_session')
+        if label == 'GET /user/parcels':
+            return client.request('GET', '/user/parcels')
+        if label == 'POST /parcels':
+            result = client.request('POST', '/parcels', self.parcel_values())
+            if result[0] == 201:
+                parcel = json.loads(result[1])
+                self.parcels.append((parcel['id'], parcel['tracking_number']))
+            return result
+        if label == 'GET /parcels/<id>':
+            return client.request('GET', f'/parcels/{self.rng.choice(self.parcels)[0]}')
+        if label == 'PATCH /parcels/<id>':
+            return client.request('PATCH', f'/parcels/{self.rng.choice(self.parcels)[0]}', {'status': self.rng.choice(STATUSES)})
+        if label == 'GET /parcels?limit=50':
+            return client.request('GET', '/parcels?limit=50')
+        if label == 'GET /recipients?limit=50':
+            return client.request('GET', '/recipients?limit=50')
+        if label == 'GET /track/<tracking_number>':
+            return client.request('GET', f'/track/{self.rng.choice(self.parcels)[1]}')
+        raise ValueError(label)
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statements = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def add(self, label, status, statements, seconds):
+        with self.lock:
+            self.latencies[label].append(seconds)
+            self.statuses[label][status] += 1
+            if status >= 400:
+                self.errors[label] += 1
+            if statements is not None:
+                self.statements[label].append(statements)
+
+    def add_failure(self, label):
+        with self.lock:
+            self.errors[label] += 1
+            self.statuses[label]['failed'] += 1
+
+
+def endpoint_stats(latencies, statements, errors, statuses, duration):
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99]) if len(latencies_ms) else (0.0, 0.0, 0.0)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "throughput_rps": round(len(latencies) / duration, 2),
+        "mean_ms": round(float(latencies_ms.mean()), 3) if len(latencies_ms) else 0.0,
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(latencies_ms.max()), 3) if len(latencies_ms) else 0.0,
+        "statements_mean": round(float(np.mean(statements)), 2) if statements else None,
+        "statements_max": int(max(statements)) if statements else None,
+    }
+
+
+def run_level(port, concurrency, args, run_id):
+    rng = random.Random(args.seed + concurrency)
+    users = [
+        VirtualUser(Client('127.0.0.1', port), f'bench-{run_id}-c{concurrency}-{index}@example.com',
+                    args.recipients_per_user, args.parcels_per_user, random.Random(rng.random()))
+        for index in range(concurrency)
+    ]
+    seeders = [threading.Thread(target=user.seed) for user in users]
+    for thread in seeders:
+        thread.start()
+    for thread in seeders:
+        thread.join()
+    if any(not user.parcels for user in users):
+        raise SystemExit("Seeding failed, see the errors above")
+
+    labels = [label for label, _ in REQUEST_MIX]
+    weights = [weight for _, weight in REQUEST_MIX]
+    recorder = Recorder()
+    started = time.monotonic()
+    measure_from = started + args.warmup
+    stop_at = measure_from + args.duration
+
+    def loop(user):
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                return
+            label = user.rng.choices(labels, weights)[0]
+            try:
+                status, _, statements, seconds = user.run(label)
+            except (OSError, http.client.HTTPException):
+                if now >= measure_from:
+                    recorder.add_failure(label)
+                cookie, user.client = user.client.cookie, Client('127.0.0.1', port)
+                user.client.cookie = cookie
+                continue
+            if now >= measure_from:
+                recorder.add(label, status, statements, seconds)
+
+    workers = [threading.Thread(target=loop, args=(user,)) for user in users]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    endpoints = {
+        label: endpoint_stats(recorder.latencies[label], recorder.statements[label], recorder.errors[label],
+                              recorder.statuses[label], args.duration)
+        for label in labels if recorder.latencies[label] or recorder.errors[label]
+    }
+    all_latencies = [seconds for label in labels for seconds in recorder.latencies[label]]
+    all_statements = [count for label in labels for count in recorder.statements[label]]
+    total = endpoint_stats(all_latencies, all_statements, sum(recorder.errors.values()), {}, args.duration)
+    total.pop('statuses')
+    return {"concurrency": concurrency, "duration_s": args.duration, "total": total, "endpoints": endpoints}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SERVER_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_run(run):
+    print(f"\nconcurrency {run['concurrency']}: {run['total']['throughput_rps']} req/s, "
+          f"p50 {run['total']['p50_ms']} ms, p95 {run['total']['p95_ms']} ms, p99 {run['total']['p99_ms']} ms, "
+          f"{run['total']['errors']} errors")
+    print(f"{'endpoint':<30} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'sql':>6} {'errors':>6}")
+    for label, stats in run['endpoints'].items():
+        statements = stats['statements_mean'] if stats['statements_mean'] is not None else '-'
+        print(f"{label:<30} {stats['throughput_rps']:>8} {stats['p50_ms']:>8} {stats['p95_ms']:>8} "
+              f"{stats['p99_ms']:>8} {statements:>6} {stats['errors']:>6}")
+
+
+def compare(baseline, results, threshold):
+    # Prints p95/throughput/statement changes per endpoint, returns whether any p95 regressed beyond threshold
+    regressed = False
+    baseline_runs = {run['concurrency']: run for run in baseline['runs']}
+    for run in results['runs']:
+        before = baseline_runs.get(run['concurrency'])
+        if before is None:
+            continue
+        print(f"\nconcurrency {run['concurrency']} vs {baseline['meta'].get('git_revision') or 'baseline'}")
+        print(f"{'endpoint':<30} {'p95 ms':>18} {'change':>8} {'req/s':>18} {'sql':>12}")
+        for label, stats in [('total', run['total'])] + list(run['endpoints'].items()):
+            old = before['total'] if label == 'total' else before['endpoints'].get(label)
+            if not old or not old['p95_ms']:
+                continue
+            change = stats['p95_ms'] / old['p95_ms'] - 1
+            flag = ''
+            if change > threshold:
+                regressed = True
+                flag = ' REGRESSED'
+            print(f"{label:<30} {old['p95_ms']:>8} -> {stats['p95_ms']:<8} {change:>+8.1%} "
+                  f"{old['throughput_rps']:>8} -> {stats['throughput_rps']:<8} "
+                  f"{str(old['statements_mean']):>5} -> {str(stats['statements_mean']):<5}{flag}")
+    return regressed
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'setup':
+        return setup_database()
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        parser = argparse.ArgumentParser()
+        parser.add_argument('command')
+        parser.add_argument('--port', type=int, required=True)
+        return serve(parser.parse_args().port)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-uri', default=None, help='Defaults to a scratch SQLite file')
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn'), default='werkzeug')
+    parser.add_argument('--server-workers', type=int, default=1, help='gunicorn worker processes')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32], help='Virtual users, one run per value')
+    parser.add_argument('--duration', type=float, default=20, help='Measured seconds per run')
+    parser.add_argument('--warmup', type=float, default=3, help='Unmeasured seconds before each run')
+    parser.add_argument('--recipients-per-user', type=int, default=5)
+    parser.add_argument('--parcels-per-user', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', default=None, help='JSON results file')
+    parser.add_argument('--compare', default=None, help='Earlier JSON results to diff against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='p95 increase that counts as a regression')
+    args = parser.parse_args()
+
+    scratch = None
+    database_uri = args.database_uri
+    if database_uri is None:
+        scratch = tempfile.mkdtemp(prefix='sendit-bench-')
+        database_uri = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+
+    process, port = start_server(args, database_uri)
+    run_id = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
+    try:
+        runs = []
+        for concurrency in args.concurrency:
+            run = run_level(port, concurrency, args, run_id)
+            print_run(run)
+            runs.append(run)
+    finally:
+        process.terminate()
+        process.wait()
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    results = {
+        "meta": {
+            "started_at": run_id,
+            "git_revision": git_revision(),
+            "database": database_uri.split(':', 1)[0],
+            "server": args.server,
+            "server_workers": args.server_workers if args.server == 'gunicorn' else 1,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "request_mix": dict(REQUEST_MIX),
+            "parcels_per_user": args.parcels_per_user,
+            "recipients_per_user": args.recipients_per_user,
+        },
+        "runs": runs,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+        print(f"\nWrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
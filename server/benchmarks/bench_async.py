@@ -0,0 +1,251 @@
+# /server/benchmarks/bench_async.py
+
+# Sync workers vs the async serving mode (see asgi.py) on the endpoints the async mode covers.
+# Runs the same request mix (check_session, /user/parcels, parcel by id, tracking, email enqueue) first against
+# gunicorn sync workers (`gunicorn app:app`, one request per worker at a time) and then against
+# `uvicorn asgi:application`, both with --server-workers processes on the same database, at each --concurrency
+# level of open keep-alive connections. --think-ms adds an idle pause between a connection's requests, which is
+# how many mostly-idle clients (dashboards, tracking pages) look to the server.
+# Per mode and level it reports throughput, p50/p95/p99 latency and failed requests/connections.
+# --accounts users are signed up and seeded once, every connection logs in as one of them per mode.
+# Both servers get the same SESSION_SIGNING_KEYS, so the worker processes accept each other's cookies.
+# Run from /server:  python -m benchmarks.bench_async [--concurrency 16 64 256] [--think-ms 0] [--output async.json]
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from benchmarks.bench_api import (
+    SERVER_DIR, PASSWORD, Client, VirtualUser, Recorder, endpoint_stats, free_port, wait_for_server, git_revision,
+)
+
+MODES = ('sync', 'async')
+
+# (endpoint label, weight), all served natively by asgi.py
+REQUEST_MIX = (
+    ('GET /check_session', 25),
+    ('GET /user/parcels', 15),
+    ('GET /parcels/<id>', 30),
+    ('GET /track/<tracking_number>', 25),
+    ('POST /send-email', 5),
+)
+
+
+def start_server(mode, args, env):
+    port = free_port()
+    if mode == 'sync':
+        command = [
+            sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(args.server_workers),
+            '--worker-class', 'sync', '--backlog', '2048', '--log-level', 'warning', 'app:app',
+        ]
+    else:
+        command = [
+            sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1', '--port', str(port),
+            '--workers', str(args.server_workers), '--backlog', '2048', '--log-level', 'warning', '--no-access-log',
+        ]
+    process = subprocess.Popen(command, cwd=SERVER_DIR, env=env)
+    return wait_for_server(process, port), port
+
+
+def seed_accounts(port, args, run_id):
+    accounts = [
+        VirtualUser(Client('127.0.0.1', port), f'bench-async-{run_id}-{index}@example.com',
+                    args.recipients_per_user, args.parcels_per_user, random.Random(args.seed + index))
+        for index in range(args.accounts)
+    ]
+    seeders = [threading.Thread(target=account.seed) for account in accounts]
+    for thread in seeders:
+        thread.start()
+    for thread in seeders:
+        thread.join()
+    if any(not account.parcels for account in accounts):
+        raise SystemExit("Seeding failed, see the errors above")
+    return accounts
+
+
+def connect(port, account, rng):
+    # A connection of its own, signed in as a seeded account
+    user = VirtualUser(Client('127.0.0.1', port), account.email, 0, 0, rng)
+    user.recipient_ids = account.recipient_ids
+    user.parcels = account.parcels
+    status, data, _, _ = user.client.request('POST', '/login', {'email': user.email, 'password': PASSWORD})
+    if status != 200:
+        raise RuntimeError(f"Login failed with {status}: {data[:200]!r}")
+    return user
+
+
+def run_request(user, label):
+    if label == 'POST /send-email':
+        return user.client.request('POST', '/send-email', {
+            'to': user.email, 'subject': 'Parcel update', 'body': 'Your parcel is on its way.',
+        })
+    return user.run(label)
+
+
+def run_level(port, concurrency, accounts, args):
+    rng = random.Random(args.seed + concurrency)
+    users = [None] * concurrency
+    connect_failures = 0
+
+    def open_connection(index):
+        nonlocal connect_failures
+        try:
+            users[index] = connect(port, accounts[index % len(accounts)], random.Random(rng.random()))
+        except (OSError, http.client.HTTPException, RuntimeError):
+            connect_failures += 1
+
+    # Opened side by side, a server that can't keep up with the logins shows it here already
+    openers = [threading.Thread(target=open_connection, args=(index,)) for index in range(concurrency)]
+    for thread in openers:
+        thread.start()
+    for thread in openers:
+        thread.join()
+    users = [user for user in users if user is not None]
+
+    labels = [label for label, _ in REQUEST_MIX]
+    weights = [weight for _, weight in REQUEST_MIX]
+    recorder = Recorder()
+    measure_from = time.monotonic() + args.warmup
+    stop_at = measure_from + args.duration
+    think = args.think_ms / 1000
+
+    def loop(user):
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                return
+            label = user.rng.choices(labels, weights)[0]
+            try:
+                status, _, _, seconds = run_request(user, label)
+            except (OSError, http.client.HTTPException):
+                if now >= measure_from:
+                    recorder.add_failure(label)
+                cookie, user.client = user.client.cookie, Client('127.0.0.1', port)
+                user.client.cookie = cookie
+                continue
+            if now >= measure_from:
+                recorder.add(label, status, None, seconds)
+            if think:
+                time.sleep(user.rng.uniform(0.5, 1.5) * think)
+
+    workers = [threading.Thread(target=loop, args=(user,)) for user in users]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    endpoints = {
+        label: endpoint_stats(recorder.latencies[label], [], recorder.errors[label], recorder.statuses[label], args.duration)
+        for label in labels if recorder.latencies[label] or recorder.errors[label]
+    }
+    for stats in endpoints.values():
+        stats.pop('statements_mean')
+        stats.pop('statements_max')
+    total = endpoint_stats([seconds for label in labels for seconds in recorder.latencies[label]], [],
+                           sum(recorder.errors.values()), {}, args.duration)
+    for key in ('statuses', 'statements_mean', 'statements_max'):
+        total.pop(key)
+    return {
+        "concurrency": concurrency,
+        "connected": len(users),
+        "connect_failures": connect_failures,
+        "duration_s": args.duration,
+        "total": total,
+        "endpoints": endpoints,
+    }
+
+
+def print_comparison(runs):
+    print(f"\n{'connections':>11} {'mode':<6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'refused':>8}")
+    for concurrency in sorted({run['concurrency'] for run in runs}):
+        for run in runs:
+            if run['concurrency'] == concurrency:
+                total = run['total']
+                print(f"{concurrency:>11} {run['mode']:<6} {total['throughput_rps']:>9} {total['p50_ms']:>9} "
+                      f"{total['p95_ms']:>9} {total['p99_ms']:>9} {total['errors']:>7} {run['connect_failures']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-uri', default=None, help='Defaults to a scratch SQLite file')
+    parser.add_argument('--modes', choices=MODES, nargs='+', default=list(MODES))
+    parser.add_argument('--server-workers', type=int, default=1, help='Worker processes for either server')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[16, 64, 256], help='Open connections, one run per value')
+    parser.add_argument('--think-ms', type=float, default=0, help='Mean idle time between requests on a connection')
+    parser.add_argument('--duration', type=float, default=20, help='Measured seconds per run')
+    parser.add_argument('--warmup', type=float, default=3, help='Unmeasured seconds before each run')
+    parser.add_argument('--accounts', type=int, default=16)
+    parser.add_argument('--recipients-per-user', type=int, default=5)
+    parser.add_argument('--parcels-per-user', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', default=None, help='JSON results file')
+    args = parser.parse_args()
+
+    scratch = None
+    database_uri = args.database_uri
+    if database_uri is None:
+        scratch = tempfile.mkdtemp(prefix='sendit-bench-')
+        database_uri = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+    env = dict(os.environ, DATABASE_URI=database_uri)
+    env.setdefault('SESSION_SIGNING_KEYS', secrets.token_urlsafe(32))
+    # The benchmark users would trip the rate limits, ADMISSION_ENABLED=true measures them too
+    env.setdefault('ADMISSION_ENABLED', 'false')
+    subprocess.run([sys.executable, '-m', 'benchmarks.bench_api', 'setup'], cwd=SERVER_DIR, env=env, check=True)
+
+    run_id = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
+    runs = []
+    accounts = None
+    try:
+        for mode in args.modes:
+            process, port = start_server(mode, args, env)
+            try:
+                if accounts is None:
+                    accounts = seed_accounts(port, args, run_id)
+                for concurrency in args.concurrency:
+                    run = dict(run_level(port, concurrency, accounts, args), mode=mode)
+                    print(f"{mode} at {concurrency} connections: {run['total']['throughput_rps']} req/s, "
+                          f"p95 {run['total']['p95_ms']} ms, {run['total']['errors']} errors")
+                    runs.append(run)
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    print_comparison(runs)
+
+    results = {
+        "meta": {
+            "started_at": run_id,
+            "git_revision": git_revision(),
+            "database": database_uri.split(':', 1)[0],
+            "server_workers": args.server_workers,
+            "think_ms": args.think_ms,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "request_mix": dict(REQUEST_MIX),
+            "accounts": args.accounts,
+        },
+        "runs": runs,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+        print(f"\nWrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# /server/benchmarks/bench_compression.py
+
+# Bytes on the wire and CPU per request for the /parcels and /user/parcels payloads:
+# the old pretty-printed JSON vs compact JSON, uncompressed and with gzip/brotli at the configured levels.
+# Run from /server:  python -m benchmarks.bench_compression [--parcels 1000] [--user-parcels 50]
+
+import argparse
+import time
+
+from benchmarks.bench_serializer import build_parcels
+from config import app
+from compression import available_encodings, compress_body
+from serializers import serialize
+
+
+def encode(payload, pretty):
+    # The body the endpoints send, through the app's JSON provider: compact = False is the old
+    # pretty-printed output (indent=2), compact = True what jsonify produces now
+    compact = app.json.compact
+    app.json.compact = not pretty
+    try:
+        return app.json.response(payload).get_data()
+    finally:
+        app.json.compact = compact
+
+
+def measure(payload, pretty, encoding, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        body = encode(payload, pretty)
+        if encoding != 'identity':
+            body = compress_body(body, encoding, app.config)
+    cpu = (time.process_time() - start) / repeat
+    return len(body), cpu
+
+
+def report(label, payload, repeat):
+    print(f"{label}")
+    print(f"  {'json':<8} {'encoding':<9} {'bytes':>10} {'ratio':>7} {'cpu ms/req':>11}")
+    baseline = None
+    for pretty in (True, False):
+        for encoding in ('identity', *available_encodings()):
+            size, cpu = measure(payload, pretty, encoding, repeat)
+            baseline = baseline or size
+            print(f"  {'pretty' if pretty else 'compact':<8} {encoding:<9} {size:>10} {baseline / size:>6.1f}x {cpu * 1000:>11.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parcels', type=int, default=1000, help='Rows in the /parcels payload')
+    parser.add_argument('--user-parcels', type=int, default=50, help='Rows in the /user/parcels payload')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    parcels = [serialize(parcel) for parcel in build_parcels(args.parcels)]
+    report(f"/parcels ({args.parcels} parcels)", parcels, args.repeat)
+    user_parcels = [parcel for parcel in parcels if parcel['user_id'] == 1][:args.user_parcels]
+    report(f"/user/parcels ({len(user_parcels)} parcels)", user_parcels, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# /server/benchmarks/bench_json.py
+
+# JSON encoding benchmark on realistic parcel rows.
+# Compares Flask's DefaultJSONProvider with FastJSONProvider on the stdlib and orjson backends, for
+# serialized parcels (what the API sends today) and for raw column rows carrying Decimal, timezone-aware
+# datetime and UUID values, in both decimal modes.
+# Run from /server:  python -m benchmarks.bench_json [--rows 10000]
+
+import argparse
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from flask.json.provider import DefaultJSONProvider
+
+from benchmarks.bench_serializer import build_parcels
+from config import app
+from json_provider import FastJSONProvider, orjson
+from serializers import serialize
+
+
+def raw_rows(count):
+    start = datetime(2024, 8, 1, tzinfo=timezone.utc)
+    return [
+        {
+            'id': i + 1,
+            'tracking_number': uuid.UUID(int=i),
+            'status': 'Out For Delivery',
+            'length': Decimal('30.00'), 'width': Decimal('20.00'), 'height': Decimal('10.50'),
+            'weight': Decimal('2.75'), 'cost': Decimal('450.00'),
+            'latitude': Decimal('-4.043477'), 'longitude': Decimal('39.668206'),
+            'created_at': start + timedelta(minutes=i),
+            'updated_at': start + timedelta(minutes=i, seconds=30),
+        }
+        for i in range(count)
+    ]
+
+
+def providers():
+    default = DefaultJSONProvider(app)
+    yield 'flask default', default
+    for backend in ('stdlib', 'orjson'):
+        if backend == 'orjson' and orjson is None:
+            continue
+        for decimal_mode in ('string', 'float'):
+            provider = FastJSONProvider(app)
+            provider.configure(backend, decimal_mode)
+            yield f'{backend}/{decimal_mode}', provider
+
+
+def bench(label, payload, repeat):
+    print(label)
+    baseline = None
+    for name, provider in providers():
+        try:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                body = provider.dumps(payload, separators=(',', ':'))
+            elapsed = (time.perf_counter() - start) / repeat
+        except TypeError as e:
+            print(f"  {name:<16} unsupported ({e})")
+            continue
+        baseline = baseline or elapsed
+        print(f"  {name:<16} {elapsed * 1000:9.2f} ms  {len(body):>10} chars  {baseline / elapsed:6.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    bench(f"serialized parcels ({args.rows} rows)", [serialize(p) for p in build_parcels(args.rows)], args.repeat)
+    bench(f"raw parcel columns ({args.rows} rows)", raw_rows(args.rows), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
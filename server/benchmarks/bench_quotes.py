@@ -0,0 +1,104 @@
+# /server/benchmarks/bench_quotes.py
+
+# Price-quoting benchmark.
+# Per-quote latency at batch sizes 1, 1k and 100k for: the pricing kernel alone on already-parsed columns,
+# the whole batch path (JSON rows -> columns -> quotes -> response rows, what POST /quotes/batch does),
+# and pricing the same shipments one at a time in plain Python.
+# Run from /server:  python -m benchmarks.bench_quotes [--sizes 1 1000 100000]
+
+import argparse
+import bisect
+import math
+import os
+import random
+import time
+
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+
+from geo import EARTH_RADIUS_KM
+from quotes import DEFAULT_RATE_TABLE, RateTable, parse_shipments, quote_batch, quote_shipments
+
+
+def build_shipments(count, seed=7):
+    rng = random.Random(seed)
+    shipments = []
+    for _ in range(count):
+        shipment = {
+            'length': round(rng.uniform(5, 120), 2),
+            'width': round(rng.uniform(5, 80), 2),
+            'height': round(rng.uniform(1, 60), 2),
+            'weight': round(rng.uniform(0.1, 40), 2),
+        }
+        if rng.random() < 0.5:
+            shipment['distance_km'] = round(rng.uniform(0, 1500), 1)
+        else:
+            # Around Kenya
+            shipment.update(
+                origin_lat=rng.uniform(-4.7, 4.6), origin_lng=rng.uniform(33.9, 41.9),
+                destination_lat=rng.uniform(-4.7, 4.6), destination_lng=rng.uniform(33.9, 41.9),
+            )
+        shipments.append(shipment)
+    return shipments
+
+
+def quote_one(table, shipment):
+    # Row-at-a-time reference with the same pricing rules
+    distance = shipment.get('distance_km')
+    if distance is None:
+        lat1, lat2 = math.radians(shipment['origin_lat']), math.radians(shipment['destination_lat'])
+        dlng = math.radians(shipment['destination_lng'] - shipment['origin_lng'])
+        a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlng / 2) ** 2
+        distance = 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(max(a, 0), 1)))
+    zone = bisect.bisect_left(table['limits'], distance)
+    volumetric = shipment['length'] * shipment['width'] * shipment['height'] / table['divisor']
+    chargeable = max(shipment['weight'], volumetric)
+    cost = (table['base'][zone] + table['per_kg'][zone] * chargeable) * table['fuel']
+    return round(max(cost, table['minimum']), 2)
+
+
+def scalar_table():
+    zones = DEFAULT_RATE_TABLE['zones']
+    return {
+        'limits': [zone['max_km'] for zone in zones[:-1]],
+        'base': [zone['base'] for zone in zones],
+        'per_kg': [zone['per_kg'] for zone in zones],
+        'divisor': DEFAULT_RATE_TABLE['volumetric_divisor'],
+        'fuel': 1 + DEFAULT_RATE_TABLE['fuel_surcharge'],
+        'minimum': DEFAULT_RATE_TABLE['minimum_charge'],
+    }
+
+
+def timed(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 1000, 100_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    table = RateTable.load()
+    reference = scalar_table()
+    print(f"{'batch':>8} {'kernel':>12} {'batch path':>12} {'row loop':>12}   (microseconds per quote)")
+    for size in args.sizes:
+        shipments = build_shipments(size)
+        _, arrays, _ = parse_shipments(shipments)
+        kernel_time, _ = timed(lambda: quote_shipments(table, arrays), args.repeat)
+        batch_time, (quotes, errors) = timed(lambda: quote_batch(table, shipments), args.repeat)
+        loop_time, costs = timed(lambda: [quote_one(reference, s) for s in shipments], args.repeat)
+        assert not errors
+        mismatches = sum(abs(q['cost'] - c) > 0.011 for q, c in zip(quotes, costs))
+        print(
+            f"{size:>8} {kernel_time / size * 1e6:>12.3f} {batch_time / size * 1e6:>12.3f} {loop_time / size * 1e6:>12.3f}"
+            + (f"   ({mismatches} mismatches)" if mismatches else "")
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# /server/benchmarks/bench_routes.py
+
+# Route planner benchmark.
+# Plans random stops scattered around a Nairobi depot and reports wall time and total route length
+# after nearest-neighbor construction and after 2-opt/Or-opt improvement, in-process and with a pool.
+# Run from /server:  python -m benchmarks.bench_routes [--stops 500 5000] [--workers 0 4]
+
+import argparse
+import time
+
+import numpy as np
+
+from routing import plan_routes
+
+DEPOT = (-1.286389, 36.817223)
+
+
+def build_stops(count, seed=7):
+    rng = np.random.default_rng(seed)
+    # A dense centre plus a sparser ring of outlying estates
+    spread = np.where(rng.random(count) < 0.7, 0.08, 0.25)
+    latitudes = DEPOT[0] + rng.normal(0, 1, count) * spread
+    longitudes = DEPOT[1] + rng.normal(0, 1, count) * spread
+    return np.arange(1, count + 1), latitudes, longitudes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stops', type=int, nargs='+', default=[500, 5000])
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 4])
+    parser.add_argument('--max-stops-per-route', type=int, default=150)
+    parser.add_argument('--time-budget', type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f"{'stops':>6} {'workers':>7} {'routes':>6} {'seconds':>8} {'nn km':>10} {'final km':>10} {'saved':>6}")
+    for count in args.stops:
+        ids, latitudes, longitudes = build_stops(count)
+        for workers in args.workers:
+            start = time.perf_counter()
+            plan = plan_routes(DEPOT, ids, latitudes, longitudes, args.max_stops_per_route,
+                               time_budget=args.time_budget, workers=workers)
+            elapsed = time.perf_counter() - start
+            planned = sorted(stop for route in plan['routes'] for stop in route['stops'])
+            assert planned == ids.tolist()
+            saved = 1 - plan['distance_km'] / plan['initial_distance_km']
+            print(f"{count:>6} {workers:>7} {len(plan['routes']):>6} {elapsed:>8.2f} "
+                  f"{plan['initial_distance_km']:>10.1f} {plan['distance_km']:>10.1f} {saved:>6.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# /server/benchmarks/bench_serializer.py
+
+# Micro-benchmark: SerializerMixin.to_dict() vs the compiled serializers on in-memory parcels.
+# Run from /server:  python -m benchmarks.bench_serializer [--sizes 10000 100000]
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+
+from models import User, Role, Recipient, Parcel  # noqa: E402
+from serializers import serialize  # noqa: E402
+
+
+def build_parcels(count):
+    # Transient objects so the numbers only measure serialization, not the database
+    now = datetime.now(timezone.utc)
+    role = Role(id=2, name='user')
+    users = []
+    for i in range(100):
+        user = User(id=i + 1, first_name=f'User{i}', last_name='Bench', phone_number='0700000000',
+                    city='Nairobi', country='Kenya', latitude=Decimal('-1.292066'), longitude=Decimal('36.821945'),
+                    created_at=now, updated_at=now)
+        user.roles.append(role)
+        users.append(user)
+    recipients = [
+        Recipient(id=i + 1, first_name=f'Recipient{i}', last_name='Bench', email=f'recipient{i}@example.com',
+                  phone_number='0711111111', street='Moi Avenue', city='Mombasa', country='Kenya',
+                  latitude=Decimal('-4.043477'), longitude=Decimal('39.668206'), created_at=now, updated_at=now)
+        for i in range(1000)
+    ]
+    parcels = []
+    for i in range(count):
+        parcel = Parcel(id=i + 1, length=Decimal('30.00'), width=Decimal('20.00'), height=Decimal('10.50'),
+                        weight=Decimal('2.75'), cost=Decimal('450.00'), status='Pending',
+                        tracking_number=f'{i:032x}', city='Mombasa', country='Kenya',
+                        latitude=Decimal('-4.043477'), longitude=Decimal('39.668206'), created_at=now, updated_at=now)
+        # Set the foreign keys' objects without the back-populated collections growing to every parcel
+        parcel.__dict__['user'] = users[i % len(users)]
+        parcel.__dict__['recipient'] = recipients[i % len(recipients)]
+        parcel.user_id = parcel.user.id
+        parcel.recipient_id = parcel.recipient.id
+        parcels.append(parcel)
+    return parcels
+
+
+def timed(label, func, parcels):
+    start = time.perf_counter()
+    result = [func(parcel) for parcel in parcels]
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<12} {elapsed:8.3f}s  {elapsed / len(parcels) * 1e6:8.2f} us/row")
+    return elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        parcels = build_parcels(size)
+        print(f"{size} parcels")
+        baseline, expected = timed('to_dict()', lambda parcel: parcel.to_dict(), parcels)
+        compiled, actual = timed('compiled', serialize, parcels)
+        assert actual == expected, "compiled serializer output differs from to_dict()"
+        print(f"  speedup      {baseline / compiled:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# /server/bulk.py
+
+# Bulk ingestion helpers.
+# Rows are parsed from a JSON array or an NDJSON body, validated up front, and the valid ones are
+# written with multi-row INSERT ... RETURNING statements inside a single transaction.
+
+import json
+import uuid
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from sqlalchemy import insert, select
+
+from config import db
+from models import Parcel, Recipient, PARCEL_STATUSES
+from rollups import record_new_parcels, utc_now
+from parcel_events import record_parcel_events
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+INSERT_BATCH_SIZE = 1000
+# The measurements and cost are Numeric(10, 2): 8 digits before the point, 2 after
+NUMERIC_PLACES = Decimal('0.01')
+NUMERIC_LIMIT = Decimal(10) ** 8
+
+
+def iter_request_rows(request):
+    # Yields (index, row) pairs, NDJSON is read line by line off the request stream
+    if request.mimetype in NDJSON_MIMETYPES:
+        index = 0
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield index, json.loads(line)
+            except ValueError:
+                yield index, None
+            index += 1
+        return
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('parcels')
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON array of parcels or an NDJSON body")
+    yield from enumerate(data)
+
+
+def _decimal(value, field, errors, required=True):
+    if value is None:
+        if required:
+            errors[field] = "is required"
+        return None
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        errors[field] = "must be a number"
+        return None
+    if not number.is_finite() or number < 0:
+        errors[field] = "must be a non-negative number"
+        return None
+    # Rounded as the database would store it, a value that doesn't fit would fail the whole INSERT.
+    # Compared before rounding too, quantize() can't take numbers wider than the decimal context
+    if number < NUMERIC_LIMIT:
+        number = number.quantize(NUMERIC_PLACES, rounding=ROUND_HALF_UP)
+    if number >= NUMERIC_LIMIT:
+        errors[field] = f"must be less than {NUMERIC_LIMIT:,}"
+        return None
+    return number
+
+
+def validate_parcel_row(row):
+    # Returns (values, errors), values is None when the row is rejected
+    if not isinstance(row, dict):
+        return None, {"row": "must be a JSON object"}
+
+    errors = {}
+    values = {
+        'recipient_id': row.get('recipient_id'),
+        'length': _decimal(row.get('length'), 'length', errors),
+        'width': _decimal(row.get('width'), 'width', errors),
+        'height': _decimal(row.get('height'), 'height', errors),
+        'weight': _decimal(row.get('weight'), 'weight', errors),
+        'cost': _decimal(row.get('cost'), 'cost', errors, required=False),
+        'status': row.get('status', 'Pending'),
+    }
+    if not isinstance(values['recipient_id'], int) or isinstance(values['recipient_id'], bool):
+        errors['recipient_id'] = "must be an integer"
+    if values['status'] not in PARCEL_STATUSES:
+        errors['status'] = f"must be one of {', '.join(PARCEL_STATUSES)}"
+
+    if errors:
+        return None, errors
+    return values, None
+
+
+def bulk_insert_parcels(user_id, rows, max_rows, atomic=False, fill_costs=None):
+    # rows is an iterable of (index, row), returns (created, errors) with per-row results.
+    # With atomic=True nothing is inserted unless every row is valid.
+    # fill_costs, when given, is called once with the accepted rows' values to price the ones without a cost
+    valid = []
+    errors = []
+    for index, row in rows:
+        if index >= max_rows:
+            errors.append({"index": index, "errors": {"row": f"batch is limited to {max_rows} parcels"}})
+            break
+        values, row_errors = validate_parcel_row(row)
+        if row_errors:
+            errors.append({"index": index, "errors": row_errors})
+        else:
+            valid.append((index, values))
+
+    # One lookup for every referenced recipient instead of a foreign key failure aborting the batch
+    recipient_ids = {values['recipient_id'] for _, values in valid}
+    existing = set(db.session.scalars(select(Recipient.id).where(Recipient.id.in_(recipient_ids)))) if recipient_ids else set()
+    accepted = []
+    for index, values in valid:
+        if values['recipient_id'] in existing:
+            accepted.append((index, values))
+        else:
+            errors.append({"index": index, "errors": {"recipient_id": "recipient not found"}})
+
+    errors.sort(key=lambda error: error['index'])
+    created = []
+    if atomic and errors:
+        return created, errors
+
+    if accepted:
+        if fill_costs:
+            fill_costs([values for _, values in accepted])
+        statement = insert(Parcel).returning(Parcel.id, Parcel.tracking_number, sort_by_parameter_order=True)
+        for start in range(0, len(accepted), INSERT_BATCH_SIZE):
+            batch = accepted[start:start + INSERT_BATCH_SIZE]
+            created_at = utc_now()
+            params = [
+                dict(values, user_id=user_id, tracking_number=uuid.uuid4().hex, created_at=created_at)
+                for _, values in batch
+            ]
+            # SQLAlchemy renders executemany + RETURNING as multi-row INSERT ... VALUES (...), (...) statements
+            result = db.session.execute(statement, params)
+            rows = result.all()
+            # Core inserts skip the ORM flush hooks, stage the dashboard rollups and the status history by hand
+            record_new_parcels(db.session, params)
+            record_parcel_events(db.session, [dict(row, id=parcel_id) for row, (parcel_id, _) in zip(params, rows)], actor_id=user_id)
+            for (index, _), (parcel_id, tracking_number) in zip(batch, rows):
+                created.append({"index": index, "id": parcel_id, "tracking_number": tracking_number})
+        db.session.commit()
+
+    return created, errors
@@ -0,0 +1,113 @@
+# /server/compression.py
+
+# Response compression negotiated from Accept-Encoding.
+# brotli is used when the optional `brotli` package is installed and the client accepts it, gzip otherwise.
+# Buffered bodies are only compressed above COMPRESS_MIN_SIZE, streamed bodies (the list endpoints) are
+# compressed incrementally chunk by chunk so memory stays flat.
+
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Optional dependency, gzip is always available
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'text/event-stream',
+    'text/csv',
+    'text/html',
+    'text/css',
+    'text/plain',
+    'image/svg+xml',
+}
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encodings, encodings=None):
+    # Highest quality encoding the client accepts, server preference (br before gzip) breaks ties.
+    # encodings=None means every available one, an empty list means none
+    best, best_quality = None, 0
+    for encoding in available_encodings() if encodings is None else encodings:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _compressor(encoding, config):
+    if encoding == 'br':
+        return brotli.Compressor(quality=config['COMPRESS_BR_LEVEL'])
+    # wbits=31 writes a gzip header and trailer
+    return zlib.compressobj(config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31)
+
+
+def compress_body(data, encoding, config):
+    compressor = _compressor(encoding, config)
+    if encoding == 'br':
+        return compressor.process(data) + compressor.finish()
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding, config):
+    compressor = _compressor(encoding, config)
+    if encoding == 'br':
+        process, finish = compressor.process, compressor.finish
+    else:
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        compressed = process(chunk)
+        if compressed:
+            yield compressed
+    yield finish()
+
+
+def _should_compress(response):
+    if request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return False
+    return response.mimetype in COMPRESSIBLE_MIMETYPES
+
+
+def compress_response(response, config):
+    if not _should_compress(response):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding, config)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress_body(data, encoding, config))
+
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_compression(app):
+    app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+    app.config.setdefault('COMPRESS_GZIP_LEVEL', 6)
+    app.config.setdefault('COMPRESS_BR_LEVEL', 4)
+
+    @app.after_request
+    def compress(response):
+        if not app.config.get('COMPRESS_ENABLED', True):
+            return response
+        return compress_response(response, app.config)
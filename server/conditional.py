@@ -0,0 +1,108 @@
+# /server/conditional.py
+
+# ETags and conditional requests for the ByID resources.
+# The weak ETag is built from version_id (bumped by every ORM update, unlike updated_at it can't repeat within
+# the clock's resolution) of the row and of every row its body embeds (a user's parcels, billing addresses and
+# roles, a parcel's recipient and sender...). Those are read as (parent id, id, version_id) tuples, one small
+# query per relationship the serializer walks, so If-None-Match is answered with a 304 without loading or
+# serializing the nested rows. A row added, removed or moved between parents changes the tuples too.
+# Models without a version fall back to a hash of the serialized body.
+
+import hashlib
+import json
+
+from flask import request, make_response, jsonify
+from sqlalchemy import select
+from sqlalchemy.orm import aliased, object_session
+
+from serializers import serialize, serializer_for
+
+
+def _nested_versions(session, plan, ids, versions, fetched):
+    # Adds the version tuples of the rows plan embeds for the parent rows ids, False when one has no version.
+    # Plans repeat relationships (a parcel's user's billing addresses' user...), each is queried once
+    for key, _, target, _ in plan.relationships:
+        if not hasattr(target, 'version_id'):
+            return False
+        found = fetched.get((plan.model, key, ids))
+        if found is None:
+            child = aliased(target)
+            found = session.execute(
+                select(plan.model.id, child.id, child.version_id)
+                .join(getattr(plan.model, key).of_type(child))
+                .where(plan.model.id.in_(ids))
+            ).all()
+            fetched[(plan.model, key, ids)] = found
+            versions.update((plan.model.__tablename__, key, *row) for row in found)
+        child_ids = frozenset(row[1] for row in found)
+        if child_ids and not _nested_versions(session, plan.child(key), child_ids, versions, fetched):
+            return False
+    return True
+
+
+def row_etag(obj):
+    version = getattr(obj, 'version_id', None)
+    if version is None:
+        return None
+    versions = {(obj.__tablename__, obj.id, version)}
+    if not _nested_versions(object_session(obj), serializer_for(type(obj)), frozenset([obj.id]), versions, {}):
+        return None
+    return hashlib.sha1(repr(sorted(versions, key=repr)).encode()).hexdigest()[:20]
+
+
+def body_etag(body):
+    return hashlib.sha1(json.dumps(body, sort_keys=True, separators=(',', ':')).encode()).hexdigest()[:20]
+
+
+def current_etag(obj):
+    return row_etag(obj) or body_etag(serialize(obj))
+
+
+def not_modified(etag):
+    response = make_response('', 304)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def etag_response(obj, status=200):
+    body = serialize(obj)
+    response = make_response(jsonify(body), status)
+    response.set_etag(row_etag(obj) or body_etag(body), weak=True)
+    return response
+
+
+def conditional_response(obj):
+    # Serializes obj unless the client already holds the current version
+    etag = row_etag(obj)
+    if etag and request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    body = serialize(obj)
+    etag = etag or body_etag(body)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    response = make_response(jsonify(body), 200)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def precondition_failed(obj):
+    # For writes with If-Match: returns a 412 response when the client's version is stale, otherwise None
+    if not request.if_match:
+        return None
+    if request.if_match.star_tag:
+        return None
+    etag = current_etag(obj)
+    if request.if_match.contains_weak(etag):
+        return None
+    response = make_response(jsonify({"message": "Resource has been modified, fetch it again before updating"}), 412)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def lock_query(query):
+    # With If-Match the row is locked until commit so the version check and the write can't interleave
+    if request.if_match:
+        return query.with_for_update()
+    return query
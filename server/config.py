@@ -6,33 +6,170 @@ from flask_migrate import Migrate
 from flask_restful import Api
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import MetaData
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.exceptions import Conflict
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
 import os
 
+from json_provider import FastJSONProvider, output_json
+from replicas import RoutingSession, replica_binds, init_replicas
+from sessions import init_sessions
+
 load_dotenv()
 
 DATABASE_URI = os.getenv("DATABASE_URI")
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = os.urandom(24)
 app.config['SQLALCHEMY_DATABASE_URI'] = f'{DATABASE_URI}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.json.compact = False
+
+# Connection pool, applies to the primary and the replicas. Unset keys keep SQLAlchemy's defaults
+engine_options = {}
+for option, env_var, cast in (
+    ('pool_size', 'DB_POOL_SIZE', int),
+    ('max_overflow', 'DB_MAX_OVERFLOW', int),
+    ('pool_timeout', 'DB_POOL_TIMEOUT', float),
+    ('pool_recycle', 'DB_POOL_RECYCLE', int), # Seconds before a connection is replaced
+    ('pool_pre_ping', 'DB_POOL_PRE_PING', lambda value: value.lower() == 'true'),
+):
+    if os.getenv(env_var):
+        engine_options[option] = cast(os.getenv(env_var))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
+# Read replicas (see replicas.py), comma separated URIs
+replica_uris = [uri.strip() for uri in os.getenv('DATABASE_REPLICA_URIS', '').split(',') if uri.strip()]
+app.config['SQLALCHEMY_BINDS'] = replica_binds(replica_uris, engine_options)
+app.config['DB_READ_YOUR_WRITES_SECONDS'] = float(os.getenv('DB_READ_YOUR_WRITES_SECONDS', 5)) # Longer than the replication lag
+
+# JSON encoding (see json_provider.py)
+app.config['JSON_BACKEND'] = os.getenv('JSON_BACKEND', 'auto') # "auto", "orjson" or "stdlib"
+app.config['JSON_DECIMAL_MODE'] = os.getenv('JSON_DECIMAL_MODE', 'string') # "string" or "float"
+app.json = FastJSONProvider(app)
+# Compact JSON unless running in debug mode, JSON_PRETTY=true forces indented output
+app.json.compact = False if os.getenv('JSON_PRETTY', 'false').lower() == 'true' else None
+
+# Sessions (see sessions.py). Every worker and node must share the signing keys
+app.config['SESSION_SIGNING_KEYS'] = os.getenv('SESSION_SIGNING_KEYS') or os.getenv('SECRET_KEY') # Comma separated, newest first, the older ones only verify
+app.config['SESSION_SIGNING_KEYS_FILE'] = os.getenv('SESSION_SIGNING_KEYS_FILE') # One key per line, newest first, re-read when it changes
+app.config['SESSION_KEYS_RELOAD_SECONDS'] = int(os.getenv('SESSION_KEYS_RELOAD_SECONDS', 30))
+app.config['SESSION_BACKEND'] = os.getenv('SESSION_BACKEND', 'cookie') # "cookie", "memory" (single process) or "redis"
+app.config['SESSION_REDIS_URL'] = os.getenv('SESSION_REDIS_URL')
+app.config['SESSION_MEMORY_MAX'] = int(os.getenv('SESSION_MEMORY_MAX', 100_000))
+init_sessions(app)
+
+# Admission control (see admission.py). Rate limits are "<requests per second>/<burst>" per user (per client
+# address when signed out), "0" turns a group's limit off. Concurrency limits are per worker process, 0 for none.
+# Each event stream holds a Flask worker thread for as long as it is open, so few are allowed there, the async
+# server serves streams without a thread and allows ASGI_STREAM_LIMIT
+app.config['ADMISSION_ENABLED'] = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+app.config['RATE_LIMITS'] = {
+    group: os.getenv(f'RATE_LIMIT_{group.upper()}', default)
+    for group, default in (('auth', '0.2/10'), ('public', '10/30'), ('read', '20/60'), ('write', '5/20'), ('heavy', '0.2/3'), ('stream', '0.5/5'))
+}
+app.config['CONCURRENCY_LIMITS'] = {
+    group: int(os.getenv(f'CONCURRENCY_LIMIT_{group.upper()}', default))
+    for group, default in (('auth', 0), ('public', 0), ('read', 0), ('write', 16), ('heavy', 2), ('stream', 4))
+}
+app.config['RATE_LIMIT_REDIS_URL'] = os.getenv('RATE_LIMIT_REDIS_URL') # Shared buckets across workers and nodes
+app.config['RATE_LIMIT_MAX_BUCKETS'] = int(os.getenv('RATE_LIMIT_MAX_BUCKETS', 100_000)) # Process-local buckets kept
+# Reverse proxies in front of the app whose X-Forwarded-For/-Proto are trusted, 0 when clients connect directly.
+# Signed-out clients are told apart by the address they resolve to, so it must match the deployment
+app.config['PROXY_FIX_HOPS'] = int(os.getenv('PROXY_FIX_HOPS', 0))
+if app.config['PROXY_FIX_HOPS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_HOPS'], x_proto=app.config['PROXY_FIX_HOPS'])
+
+# Seconds the authenticated user's id/roles are reused across requests (0 disables the cache)
+app.config['PRINCIPAL_CACHE_TTL'] = int(os.getenv('PRINCIPAL_CACHE_TTL', 10))
+app.config['BULK_PARCEL_MAX_ROWS'] = int(os.getenv('BULK_PARCEL_MAX_ROWS', 10000))
+
+# Response compression (see compression.py)
+app.config['COMPRESS_ENABLED'] = os.getenv('COMPRESS_ENABLED', 'true').lower() == 'true'
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 500)) # Bytes, smaller bodies aren't worth the CPU
+app.config['COMPRESS_GZIP_LEVEL'] = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+app.config['COMPRESS_BR_LEVEL'] = int(os.getenv('COMPRESS_BR_LEVEL', 4))
+
+# Built client bundle served from memory (see static_assets.py)
+app.config['STATIC_ASSETS_DIR'] = os.getenv('STATIC_ASSETS_DIR') # Defaults to the Flask static folder
+app.config['STATIC_CACHE_MAX_FILE_SIZE'] = int(os.getenv('STATIC_CACHE_MAX_FILE_SIZE', 512 * 1024)) # Bytes, larger files are streamed from disk
+app.config['STATIC_MAX_AGE'] = int(os.getenv('STATIC_MAX_AGE', 3600)) # Seconds, for files without a content hash in their name
+
+# Public tracking lookups (see tracking.py)
+app.config['TRACKING_CACHE_SIZE'] = int(os.getenv('TRACKING_CACHE_SIZE', 100000))
+app.config['TRACKING_CACHE_TTL'] = int(os.getenv('TRACKING_CACHE_TTL', 30)) # Also the max-age sent to browsers and CDNs
+app.config['TRACKING_CACHE_REDIS_URL'] = os.getenv('TRACKING_CACHE_REDIS_URL')
+
+# Recipient autocomplete (see recipient_search.py)
+app.config['RECIPIENT_SEARCH_SIMILARITY'] = float(os.getenv('RECIPIENT_SEARCH_SIMILARITY', 0.4)) # pg_trgm word similarity needed to match
+
+# Address book imports (see recipient_import.py)
+app.config['RECIPIENT_IMPORT_MAX_ROWS'] = int(os.getenv('RECIPIENT_IMPORT_MAX_ROWS', 200000))
+app.config['RECIPIENT_IMPORT_BATCH_SIZE'] = int(os.getenv('RECIPIENT_IMPORT_BATCH_SIZE', 1000))
+
+# Parcel pricing (see quotes.py)
+app.config['RATE_TABLE_PATH'] = os.getenv('RATE_TABLE_PATH') # JSON rate table, the built-in defaults when unset
+app.config['QUOTE_FILL_PARCEL_COST'] = os.getenv('QUOTE_FILL_PARCEL_COST', 'false').lower() == 'true' # Price new parcels sent without a cost
+app.config['QUOTE_BATCH_MAX_ROWS'] = int(os.getenv('QUOTE_BATCH_MAX_ROWS', 100000))
+
+# Parcel status history (see parcel_events.py), applied by `flask parcel-events-partitions`
+app.config['PARCEL_EVENTS_PARTITIONS_AHEAD'] = int(os.getenv('PARCEL_EVENTS_PARTITIONS_AHEAD', 3)) # Monthly partitions created in advance
+app.config['PARCEL_EVENTS_RETENTION_MONTHS'] = int(os.getenv('PARCEL_EVENTS_RETENTION_MONTHS', 0)) # Older partitions are dropped, 0 keeps everything
+
+# Live parcel updates over Server-Sent Events (see parcel_stream.py)
+app.config['SSE_BROKER'] = os.getenv('SSE_BROKER', 'auto') # "postgres" (LISTEN/NOTIFY), "local" (this process only) or "auto"
+app.config['SSE_HEARTBEAT_SECONDS'] = float(os.getenv('SSE_HEARTBEAT_SECONDS', 15)) # Comment frame sent on idle streams so proxies keep them open
+app.config['SSE_BUFFER_SIZE'] = int(os.getenv('SSE_BUFFER_SIZE', 100)) # Undelivered events per stream before it catches up from the database instead
+app.config['SSE_REPLAY_LIMIT'] = int(os.getenv('SSE_REPLAY_LIMIT', 500)) # Events replayed on reconnect, beyond that the client is told to reload
+app.config['SSE_REPLAY_WINDOW_SECONDS'] = int(os.getenv('SSE_REPLAY_WINDOW_SECONDS', 86400)) # How far back Last-Event-ID can reach, 0 for no limit
+app.config['SSE_RETRY_MS'] = int(os.getenv('SSE_RETRY_MS', 3000)) # Reconnect delay suggested to EventSource
+
+# Delivery route planning (see routing.py)
+app.config['ROUTE_MAX_STOPS_PER_DRIVER'] = int(os.getenv('ROUTE_MAX_STOPS_PER_DRIVER', 150))
+app.config['ROUTE_MAX_STOPS'] = int(os.getenv('ROUTE_MAX_STOPS', 20000))
+app.config['ROUTE_TIME_BUDGET'] = float(os.getenv('ROUTE_TIME_BUDGET', 2.0)) # Seconds of improvement per plan, also the most a request may ask for
+app.config['ROUTE_WORKERS'] = int(os.getenv('ROUTE_WORKERS', 0)) # Processes optimizing routes side by side, 0 plans in the request thread
+
+# Async serving mode (see asgi.py)
+app.config['ASGI_WSGI_THREADS'] = int(os.getenv('ASGI_WSGI_THREADS', 10)) # Threads running the sync Flask routes under the ASGI server
+app.config['ASGI_STREAM_LIMIT'] = int(os.getenv('ASGI_STREAM_LIMIT', 1000)) # Open event streams per ASGI worker process, 0 for no limit
+
+# Email outbox worker pool (see outbox.py)
+app.config['OUTBOX_WORKERS'] = int(os.getenv('OUTBOX_WORKERS', 2))
+app.config['OUTBOX_WORKERS_IN_PROCESS'] = os.getenv('OUTBOX_WORKERS_IN_PROCESS', 'false').lower() == 'true'
+app.config['OUTBOX_BATCH_SIZE'] = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+app.config['OUTBOX_POLL_INTERVAL'] = float(os.getenv('OUTBOX_POLL_INTERVAL', 2))
+app.config['OUTBOX_MAX_ATTEMPTS'] = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+app.config['OUTBOX_BACKOFF_BASE'] = float(os.getenv('OUTBOX_BACKOFF_BASE', 30)) # Seconds, doubled on every retry
+app.config['OUTBOX_BACKOFF_MAX'] = float(os.getenv('OUTBOX_BACKOFF_MAX', 3600))
+app.config['OUTBOX_CLAIM_TIMEOUT'] = int(os.getenv('OUTBOX_CLAIM_TIMEOUT', 300))
 
 metadata = MetaData(naming_convention={
+    "ix": "ix_%(column_0_label)s", # SQLAlchemy's default, the migrations use these names
     "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
 })
-db = SQLAlchemy(metadata=metadata)
+db = SQLAlchemy(metadata=metadata, session_options={'class_': RoutingSession})
 migrate = Migrate(app, db)
 db.init_app(app)
+init_replicas(app, db)
+
+class RestfulApi(Api):
+    def handle_error(self, e):
+        # The row's version_id (see conditional.py) changed between this request's read and its update
+        if isinstance(e, StaleDataError):
+            e = Conflict("Resource was modified by another request, fetch it again")
+        return super().handle_error(e)
+
 
-api = Api(app)
+api = RestfulApi(app)
+api.representations['application/json'] = output_json
 
+CORS_ORIGINS = ["https://send-it-eight.vercel.app", "https://send-it-eight-git-main-adamndegwas-projects.vercel.app"]
+CORS_EXPOSE_HEADERS = ['Set-Cookie', 'ETag']
 CORS(app,
-     origins=["https://send-it-eight.vercel.app", "https://send-it-eight-git-main-adamndegwas-projects.vercel.app"],
+     origins=CORS_ORIGINS,
      supports_credentials=True,
-     allow_headers=['Content-Type', 'Authorization'],
+     allow_headers=['Content-Type', 'Authorization', 'If-Match', 'If-None-Match'],
      methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
-     expose_headers=['Set-Cookie'])
+     expose_headers=CORS_EXPOSE_HEADERS)
 
 
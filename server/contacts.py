@@ -0,0 +1,47 @@
+# /server/contacts.py
+
+# Normalization of contact details and the recipient dedupe key.
+# Stored values are trimmed with inner whitespace collapsed (emails lowercased, postcodes uppercased);
+# the dedupe key is a SHA-1 over the case-folded name, email and address so the same contact typed
+# with different spacing or capitalisation maps to the same key.
+
+import hashlib
+import re
+import unicodedata
+
+WHITESPACE = re.compile(r'\s+')
+ADDRESS_PUNCTUATION = re.compile(r'[.,#]')
+DEDUPE_FIELDS = ('first_name', 'last_name', 'email', 'street', 'city', 'state', 'zip_code', 'country')
+
+
+def normalize_text(value):
+    if value is None:
+        return None
+    value = WHITESPACE.sub(' ', unicodedata.normalize('NFKC', str(value))).strip()
+    return value or None
+
+
+def normalize_email(value):
+    value = normalize_text(value)
+    return value.replace(' ', '').lower() if value else None
+
+
+def normalize_zip_code(value):
+    value = normalize_text(value)
+    return value.upper() if value else None
+
+
+def _key_part(field, value):
+    if not value:
+        return ''
+    value = value.casefold()
+    if field in ('street', 'city', 'state', 'zip_code', 'country'):
+        value = WHITESPACE.sub(' ', ADDRESS_PUNCTUATION.sub(' ', value)).strip()
+    return value
+
+
+def recipient_dedupe_key(values):
+    # values is a mapping (or object, through getattr) of already normalized fields
+    get = values.get if isinstance(values, dict) else lambda field: getattr(values, field, None)
+    document = '\x1f'.join(_key_part(field, normalize_text(get(field))) for field in DEDUPE_FIELDS)
+    return hashlib.sha1(document.encode()).hexdigest()
@@ -0,0 +1,332 @@
+# /server/datagen.py
+
+# Synthetic data for capacity testing and query-plan work (`flask datagen --scale N`, or seed.py for a demo set).
+# Scale 1 is 100 users with a billing address each, 500 recipients and 10,000 parcels; everything grows
+# linearly, so scale 1000 is 10M parcels. Rows are generated column-wise with numpy from --seed (same seed,
+# same data) and written with COPY on PostgreSQL or multi-row INSERTs elsewhere, never as ORM objects.
+# Parcels and their parcel_events are generated and written in id ranges by a process pool, each worker on
+# its own connection. Ids continue after the current maximum so an existing database can be grown.
+# Parcels go from their user's address to a recipient's, are priced with the rate table, and carry the status,
+# timestamps and status history their age implies. The dashboard rollups are rebuilt from them at the end.
+
+import csv
+import io
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import create_engine, func, insert, select, text
+from sqlalchemy.pool import NullPool
+from werkzeug.security import generate_password_hash
+
+from config import db
+from contacts import recipient_dedupe_key
+from geo import geocells, haversine_pairwise_km
+from models import (User, Role, Recipient, Parcel, ParcelEvent, BillingAddress, roles_users, PARCEL_STATUSES)
+from parcel_events import add_months, create_partitions, is_partitioned, month_start
+from quotes import rate_table
+from rollups import reconcile_rollups, utc_now
+
+SCALE_UNIT = {'users': 100, 'recipients': 500, 'parcels': 10_000}
+CHUNK_ROWS = 50_000
+PASSWORD = 'password123'
+
+# (city, state, latitude, longitude, share of addresses)
+CITIES = (
+    ('Nairobi', 'Nairobi', -1.286389, 36.817223, 0.42),
+    ('Mombasa', 'Mombasa', -4.043477, 39.668206, 0.14),
+    ('Kisumu', 'Kisumu', -0.091702, 34.767956, 0.09),
+    ('Nakuru', 'Nakuru', -0.303099, 36.080026, 0.09),
+    ('Eldoret', 'Uasin Gishu', 0.514277, 35.269780, 0.07),
+    ('Thika', 'Kiambu', -1.033260, 37.069330, 0.06),
+    ('Machakos', 'Machakos', -1.517684, 37.263414, 0.05),
+    ('Nyeri', 'Nyeri', -0.420130, 36.947590, 0.04),
+    ('Malindi', 'Kilifi', -3.219186, 40.116856, 0.04),
+)
+CITY_SPREAD_DEGREES = 0.06
+FIRST_NAMES = ('Wanjiku', 'Achieng', 'Kamau', 'Otieno', 'Mwangi', 'Njeri', 'Kiprop', 'Chebet', 'Mutua', 'Wambui',
+               'Omondi', 'Atieno', 'Kariuki', 'Nyambura', 'Kibet', 'Jepkosgei', 'Musyoka', 'Akinyi', 'Ochieng', 'Muthoni')
+LAST_NAMES = ('Kamau', 'Odhiambo', 'Mwangi', 'Otieno', 'Kiptoo', 'Wafula', 'Njoroge', 'Mutai', 'Onyango', 'Wekesa',
+              'Kimani', 'Cheruiyot', 'Macharia', 'Owino', 'Gitau', 'Rotich', 'Nduta', 'Barasa', 'Koech', 'Maina')
+STREETS = ('Moi Avenue', 'Kenyatta Avenue', 'Ngong Road', 'Waiyaki Way', 'Mombasa Road', 'Jogoo Road', 'Thika Road',
+           'Oginga Odinga Street', 'Nyerere Road', 'Digo Road', 'Uhuru Highway', 'Kaunda Street', 'Langata Road')
+# Share of parcels created in each hour of the day (UTC+3 business hours)
+HOUR_PROFILE = np.array([1, 1, 1, 1, 2, 4, 7, 9, 9, 8, 7, 7, 6, 6, 6, 5, 4, 3, 3, 2, 2, 1, 1, 1], dtype=float)
+HOUR_PROFILE /= HOUR_PROFILE.sum()
+# Mean hours before Accepted, then Out For Delivery, then Delivered
+STAGE_MEAN_HOURS = (6, 30, 10)
+
+_worker = {}
+
+
+def scaled_counts(scale):
+    return {name: max(int(round(unit * scale)), 1) for name, unit in SCALE_UNIT.items()}
+
+
+def _addresses(rng, count):
+    city = rng.choice(len(CITIES), count, p=[share for *_, share in CITIES])
+    centres = np.array([(latitude, longitude) for _, _, latitude, longitude, _ in CITIES])
+    return {
+        "city": np.array([name for name, *_ in CITIES], dtype=object)[city],
+        "state": np.array([state for _, state, *_ in CITIES], dtype=object)[city],
+        "street": np.char.add(np.char.add(rng.integers(1, 400, count).astype(str), ' '),
+                              np.array(STREETS)[rng.integers(0, len(STREETS), count)]).astype(object),
+        "zip_code": np.char.zfill(rng.integers(100, 99999, count).astype(str), 5).astype(object),
+        "latitude": np.round(centres[city, 0] + rng.normal(0, CITY_SPREAD_DEGREES, count), 6),
+        "longitude": np.round(centres[city, 1] + rng.normal(0, CITY_SPREAD_DEGREES, count), 6),
+    }
+
+
+def _people(rng, count):
+    people = _addresses(rng, count)
+    people["first_name"] = np.array(FIRST_NAMES, dtype=object)[rng.integers(0, len(FIRST_NAMES), count)]
+    people["last_name"] = np.array(LAST_NAMES, dtype=object)[rng.integers(0, len(LAST_NAMES), count)]
+    people["phone_number"] = np.char.add('+2547', np.char.zfill(rng.integers(0, 10 ** 8, count).astype(str), 8)).astype(object)
+    return people
+
+
+def _timestamps(seconds, postgresql):
+    # Epoch seconds (float array) -> ISO strings for COPY, datetimes for INSERT
+    stamps = (seconds * 1e6).astype('datetime64[us]')
+    if postgresql:
+        return np.char.add(np.datetime_as_string(stamps, unit='us'), '+00:00').tolist()
+    return [stamp.replace(tzinfo=timezone.utc) for stamp in stamps.astype(object)]
+
+
+def _hex_tokens(rng, count, size=16):
+    raw = rng.bytes(count * size).hex()
+    step = size * 2
+    return [raw[index:index + step] for index in range(0, len(raw), step)]
+
+
+def _uuids(rng, count):
+    return [str(uuid.UUID(hex=token)) for token in _hex_tokens(rng, count)]
+
+
+def write_rows(connection, table, columns):
+    # columns maps column name -> list/array of equal length
+    names = list(columns)
+    values = [column.tolist() if isinstance(column, np.ndarray) else column for column in columns.values()]
+    if not values or not len(values[0]):
+        return 0
+    if connection.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(zip(*values))
+        buffer.seek(0)
+        # Unquoted empty CSV fields are NULLs
+        with connection.connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY {table.name} ({', '.join(names)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    else:
+        connection.execute(insert(table), [dict(zip(names, row)) for row in zip(*values)])
+    return len(values[0])
+
+
+def _next_id(connection, column):
+    return (connection.scalar(select(func.max(column))) or 0) + 1
+
+
+def generate_people(connection, counts, rng, now, days, postgresql):
+    # Users (with roles and a billing address) and recipients, returns what the parcel workers need of them
+    user_start = _next_id(connection, User.id)
+    recipient_start = _next_id(connection, Recipient.id)
+    billing_start = _next_id(connection, BillingAddress.id)
+    password = generate_password_hash(PASSWORD)
+    roles = dict(connection.execute(select(Role.name, Role.id)).all())
+    for name in ('admin', 'user'):
+        if name not in roles:
+            roles[name] = connection.execute(insert(Role).values(name=name).returning(Role.id)).scalar_one()
+
+    users = _people(rng, counts['users'])
+    user_ids = np.arange(user_start, user_start + counts['users'])
+    # Everyone signed up before the parcel history starts
+    signed_up = _timestamps(now - (days + rng.uniform(0, 365, counts['users'])) * 86400, postgresql)
+    write_rows(connection, User.__table__, {
+        "id": user_ids,
+        "first_name": users["first_name"], "last_name": users["last_name"],
+        "email": [f"user{user_id}@example.test" for user_id in user_ids.tolist()],
+        "password": [password] * counts['users'],
+        "phone_number": users["phone_number"],
+        "fs_uniquifier": _uuids(rng, counts['users']),
+        "street": users["street"], "city": users["city"], "state": users["state"], "zip_code": users["zip_code"],
+        "country": ['Kenya'] * counts['users'],
+        "latitude": users["latitude"], "longitude": users["longitude"],
+        "created_at": signed_up, "updated_at": signed_up,
+    })
+    write_rows(connection, roles_users, {
+        "user_id": np.concatenate([user_ids, user_ids[:1]]),
+        "role_id": [roles['user']] * counts['users'] + [roles['admin']],
+    })
+    write_rows(connection, BillingAddress.__table__, {
+        "id": np.arange(billing_start, billing_start + counts['users']),
+        "user_id": user_ids,
+        "street": users["street"], "city": users["city"], "state": users["state"], "zip_code": users["zip_code"],
+        "country": ['Kenya'] * counts['users'],
+        "latitude": users["latitude"], "longitude": users["longitude"],
+    })
+
+    recipients = _people(rng, counts['recipients'])
+    recipient_ids = np.arange(recipient_start, recipient_start + counts['recipients'])
+    emails = [f"{first.lower()}.{last.lower()}{recipient_id}@example.test" for first, last, recipient_id
+              in zip(recipients["first_name"].tolist(), recipients["last_name"].tolist(), recipient_ids.tolist())]
+    added = _timestamps(now - (days + rng.uniform(0, 365, counts['recipients'])) * 86400, postgresql)
+    recipient_columns = {
+        "id": recipient_ids,
+        "first_name": recipients["first_name"], "last_name": recipients["last_name"], "email": emails,
+        "phone_number": recipients["phone_number"],
+        "fs_uniquifier": _uuids(rng, counts['recipients']),
+        "street": recipients["street"], "city": recipients["city"], "state": recipients["state"],
+        "zip_code": recipients["zip_code"], "country": ['Kenya'] * counts['recipients'],
+        "latitude": recipients["latitude"], "longitude": recipients["longitude"],
+        "created_at": added, "updated_at": added,
+    }
+    text_fields = ('first_name', 'last_name', 'email', 'street', 'city', 'state', 'zip_code', 'country')
+    recipient_columns["dedupe_key"] = [
+        recipient_dedupe_key(dict(zip(text_fields, row)))
+        for row in zip(*(recipient_columns[field].tolist() if isinstance(recipient_columns[field], np.ndarray)
+                         else recipient_columns[field] for field in text_fields))
+    ]
+    write_rows(connection, Recipient.__table__, recipient_columns)
+
+    return {
+        "user_ids": user_ids,
+        "user_city": users["city"], "user_latitude": users["latitude"], "user_longitude": users["longitude"],
+        "recipient_ids": recipient_ids,
+        "recipient_street": recipients["street"], "recipient_city": recipients["city"],
+        "recipient_state": recipients["state"], "recipient_zip_code": recipients["zip_code"],
+        "recipient_latitude": recipients["latitude"], "recipient_longitude": recipients["longitude"],
+    }
+
+
+def _init_worker(database_uri, context):
+    _worker['engine'] = create_engine(database_uri, poolclass=NullPool)
+    _worker['context'] = context
+
+
+def generate_parcels(task):
+    # One id range of parcels and their status events, written on the worker's own connection.
+    # Returns (parcels, events)
+    start_id, count, seed = task
+    context = _worker['context']
+    postgresql = context['postgresql']
+    rng = np.random.default_rng(seed)
+    ids = np.arange(start_id, start_id + count)
+    owner = rng.integers(0, len(context['user_ids']), count)
+    recipient = rng.integers(0, len(context['recipient_ids']), count)
+
+    length = np.round(rng.uniform(5, 80, count), 2)
+    width = np.round(rng.uniform(5, 60, count), 2)
+    height = np.round(rng.uniform(2, 50, count), 2)
+    weight = np.round(np.clip(rng.lognormal(0.7, 0.9, count), 0.1, 70), 2)
+    destination_latitude = context['recipient_latitude'][recipient]
+    destination_longitude = context['recipient_longitude'][recipient]
+    distance = haversine_pairwise_km(context['user_latitude'][owner], context['user_longitude'][owner],
+                                     destination_latitude, destination_longitude)
+    cost = rate_table.quote(length, width, height, weight, distance)['cost']
+
+    # Created on one of the last `days` days, at a business-hours biased time, never in the future
+    days_ago = rng.integers(0, context['days'], count)
+    hours = rng.choice(24, count, p=HOUR_PROFILE)
+    created = context['midnight'] - days_ago * 86400.0 + hours * 3600.0 + rng.uniform(0, 3600, count)
+    created = np.minimum(created, context['now'] - rng.uniform(60, 3600, count))
+    # Time of each later status, the parcel's age decides how far it got
+    transitions = created[:, None] + np.cumsum(rng.exponential(np.array(STAGE_MEAN_HOURS) * 3600.0, (count, 3)), axis=1)
+    reached = (transitions <= context['now']).sum(axis=1)
+    updated = np.where(reached > 0, transitions[np.arange(count), np.maximum(reached - 1, 0)], created)
+
+    statuses = np.array(PARCEL_STATUSES, dtype=object)
+    with _worker['engine'].begin() as connection:
+        write_rows(connection, Parcel.__table__, {
+            "id": ids,
+            "user_id": context['user_ids'][owner],
+            "recipient_id": context['recipient_ids'][recipient],
+            "length": length, "width": width, "height": height, "weight": weight, "cost": cost,
+            "status": statuses[reached],
+            "tracking_number": _hex_tokens(rng, count),
+            "street": context['recipient_street'][recipient], "city": context['recipient_city'][recipient],
+            "state": context['recipient_state'][recipient], "zip_code": context['recipient_zip_code'][recipient],
+            "country": ['Kenya'] * count,
+            "latitude": destination_latitude, "longitude": destination_longitude,
+            "geocell": geocells(destination_latitude, destination_longitude),
+            "created_at": _timestamps(created, postgresql),
+            "updated_at": _timestamps(updated, postgresql),
+        })
+
+        events = 0
+        for stage, status in enumerate(PARCEL_STATUSES):
+            selected = np.nonzero(reached >= stage)[0]
+            # Picked up at the sender's city, then on the way to and at the recipient's
+            at_origin = stage < 2
+            events += write_rows(connection, ParcelEvent.__table__, {
+                "parcel_id": ids[selected],
+                "status": [status] * len(selected),
+                "previous_status": [PARCEL_STATUSES[stage - 1] if stage else None] * len(selected),
+                "occurred_at": _timestamps(created[selected] if stage == 0 else transitions[selected, stage - 1], postgresql),
+                "city": (context['user_city'][owner] if at_origin else context['recipient_city'][recipient])[selected],
+                "latitude": (context['user_latitude'][owner] if at_origin else destination_latitude)[selected],
+                "longitude": (context['user_longitude'][owner] if at_origin else destination_longitude)[selected],
+                "actor_id": context['user_ids'][owner][selected] if stage == 0 else [None] * len(selected),
+            })
+    return count, events
+
+
+def generate_dataset(scale=1.0, workers=1, days=365, seed=7, on_progress=None):
+    counts = scaled_counts(scale)
+    started = time.perf_counter()
+    now = utc_now()
+    postgresql = db.engine.dialect.name == 'postgresql'
+    rng = np.random.default_rng(seed)
+
+    with db.engine.begin() as connection:
+        people = generate_people(connection, counts, rng, now.timestamp(), days, postgresql)
+        parcel_start = _next_id(connection, Parcel.id)
+    if on_progress:
+        on_progress(f"{counts['users']} users, {counts['recipients']} recipients in {time.perf_counter() - started:.1f}s")
+
+    if is_partitioned():
+        # Historical months get their own partitions instead of piling up in parcel_events_default
+        first_month = month_start((now - timedelta(days=days + 1)).date())
+        create_partitions(first_month, add_months(month_start(now.date()), 1))
+        db.session.commit()
+
+    midnight = datetime.combine(now.date(), datetime.min.time(), timezone.utc).timestamp()
+    context = dict(people, postgresql=postgresql, days=days, now=now.timestamp(), midnight=midnight)
+    tasks = [
+        (parcel_start + offset, min(CHUNK_ROWS, counts['parcels'] - offset), seed * 1_000_003 + offset)
+        for offset in range(0, counts['parcels'], CHUNK_ROWS)
+    ]
+    database_uri = db.engine.url.render_as_string(hide_password=False)
+    parcels = events = 0
+    if workers > 1 and postgresql:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(database_uri, context)) as pool:
+            for written, written_events in pool.map(generate_parcels, tasks):
+                parcels += written
+                events += written_events
+                if on_progress:
+                    on_progress(f"{parcels} parcels, {events} events in {time.perf_counter() - started:.1f}s")
+    else:
+        # SQLite has a single writer, chunks go one after another on this process
+        _init_worker(database_uri, context)
+        for task in tasks:
+            written, written_events = generate_parcels(task)
+            parcels += written
+            events += written_events
+            if on_progress:
+                on_progress(f"{parcels} parcels, {events} events in {time.perf_counter() - started:.1f}s")
+
+    if postgresql:
+        # Explicit ids skip the sequences, move them past what was written
+        with db.engine.begin() as connection:
+            for table in ('users', 'recipients', 'billing_addresses', 'parcels'):
+                connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"
+                ))
+    reconcile_rollups()
+    if postgresql:
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text("ANALYZE"))
+
+    elapsed = time.perf_counter() - started
+    return dict(counts, billing_addresses=counts['users'], parcel_events=events, seconds=round(elapsed, 1),
+                parcels_per_second=round(parcels / elapsed) if elapsed > 0 else None)
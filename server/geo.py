@@ -0,0 +1,88 @@
+# /server/geo.py
+
+# Grid-cell spatial indexing for coordinates.
+# The globe is cut into GEOCELL_SIZE_DEGREES squares numbered row by row, so every row of cells is a
+# contiguous integer range. A radius search becomes a handful of BETWEEN ranges on the indexed `geocell`
+# column (no table scan), and the candidates are then filtered exactly with vectorized haversine math.
+
+import math
+
+import numpy as np
+
+# Changing this invalidates every stored geocell, they would have to be recomputed
+GEOCELL_SIZE_DEGREES = 0.05  # ~5.5 km north-south
+GEOCELL_COLUMNS = math.ceil(360 / GEOCELL_SIZE_DEGREES)
+GEOCELL_ROWS = math.ceil(180 / GEOCELL_SIZE_DEGREES)
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LATITUDE = 111.32
+
+
+def _row(latitude):
+    return min(max(int(math.floor((latitude + 90) / GEOCELL_SIZE_DEGREES)), 0), GEOCELL_ROWS - 1)
+
+
+def _column(longitude):
+    return int(math.floor((longitude + 180) / GEOCELL_SIZE_DEGREES)) % GEOCELL_COLUMNS
+
+
+def geocell(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    return _row(float(latitude)) * GEOCELL_COLUMNS + _column(float(longitude))
+
+
+def geocells(latitudes, longitudes):
+    # geocell() over float arrays
+    rows = np.clip(np.floor((latitudes + 90) / GEOCELL_SIZE_DEGREES).astype(np.int64), 0, GEOCELL_ROWS - 1)
+    columns = np.floor((longitudes + 180) / GEOCELL_SIZE_DEGREES).astype(np.int64) % GEOCELL_COLUMNS
+    return rows * GEOCELL_COLUMNS + columns
+
+
+def covering_ranges(latitude, longitude, radius_km):
+    # (first_cell, last_cell) ranges that cover the bounding box of the circle
+    lat_delta = radius_km / KM_PER_DEGREE_LATITUDE
+    first_row = _row(latitude - lat_delta)
+    last_row = _row(latitude + lat_delta)
+
+    # Longitude degrees shrink towards the poles, use the widest latitude the box touches
+    widest = min(abs(latitude) + lat_delta, 89.9)
+    lng_delta = radius_km / (KM_PER_DEGREE_LATITUDE * math.cos(math.radians(widest)))
+
+    if lng_delta * 2 >= 360:
+        column_spans = [(0, GEOCELL_COLUMNS - 1)]
+    else:
+        first_column = _column(longitude - lng_delta)
+        last_column = _column(longitude + lng_delta)
+        if first_column <= last_column:
+            column_spans = [(first_column, last_column)]
+        else:
+            # The box crosses the antimeridian
+            column_spans = [(first_column, GEOCELL_COLUMNS - 1), (0, last_column)]
+
+    ranges = []
+    for row in range(first_row, last_row + 1):
+        base = row * GEOCELL_COLUMNS
+        for first_column, last_column in column_spans:
+            ranges.append((base + first_column, base + last_column))
+    return ranges
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    # Distance from one point to arrays of points, in one vectorized pass
+    lat1 = math.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlng = np.radians(longitudes) - math.radians(longitude)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def haversine_pairwise_km(latitudes1, longitudes1, latitudes2, longitudes2):
+    # Element-wise distance between two arrays of points
+    lat1 = np.radians(latitudes1)
+    lat2 = np.radians(latitudes2)
+    dlat = lat2 - lat1
+    dlng = np.radians(longitudes2) - np.radians(longitudes1)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
@@ -0,0 +1,95 @@
+# /server/json_provider.py
+
+# Flask JSON provider with a fast path.
+# orjson is used when it is installed (JSON_BACKEND=auto|orjson), the stdlib json module otherwise.
+# Decimal (all the Numeric columns), timezone-aware datetimes and UUIDs are handled explicitly instead
+# of going through Flask's generic default(). JSON_DECIMAL_MODE picks how Decimals go out: as strings
+# (default, exact and what clients get today) or as floats.
+
+import dataclasses
+import json
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import current_app, make_response
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional dependency, the stdlib backend is always available
+    orjson = None
+
+
+def decimal_encoder(mode):
+    return float if mode == 'float' else str
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    decimal_mode = 'string'
+    backend = 'auto'
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.configure(app.config.get('JSON_BACKEND', self.backend), app.config.get('JSON_DECIMAL_MODE', self.decimal_mode))
+
+    def configure(self, backend='auto', decimal_mode='string'):
+        if backend == 'orjson' and orjson is None:
+            raise RuntimeError("JSON_BACKEND=orjson but orjson is not installed")
+        self.backend = 'orjson' if backend in ('auto', 'orjson') and orjson is not None else 'stdlib'
+        self.decimal_mode = decimal_mode
+        self._encode_decimal = decimal_encoder(decimal_mode)
+
+    def default(self, o):
+        # Types the backend can't encode natively, most frequent first
+        if isinstance(o, Decimal):
+            return self._encode_decimal(o)
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        if isinstance(o, uuid.UUID):
+            return str(o)
+        if dataclasses.is_dataclass(o) and not isinstance(o, type):
+            return dataclasses.asdict(o)
+        if hasattr(o, '__html__'):
+            return str(o.__html__())
+        raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+    def dumps(self, obj, **kwargs):
+        if self.backend == 'orjson':
+            return self._orjson_dumps(obj, **kwargs).decode()
+        kwargs.setdefault('default', self.default)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+    def _orjson_dumps(self, obj, indent=None, sort_keys=None, **kwargs):
+        # orjson always writes compact UTF-8, `separators`/`ensure_ascii` don't apply; it encodes
+        # datetimes (RFC 3339, keeping the offset) and UUIDs natively and calls default() for the rest
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys if sort_keys is None else sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get('default', self.default), option=option)
+
+    def loads(self, s, **kwargs):
+        if self.backend == 'orjson' and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        if self.backend == 'orjson':
+            body = self._orjson_dumps(obj, indent=2 if pretty else None) + b'\n'
+        else:
+            dump_args = {'indent': 2} if pretty else {'separators': (',', ':')}
+            body = f"{self.dumps(obj, **dump_args)}\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def output_json(data, code, headers=None):
+    # Flask-RESTful representation so Resources returning dicts use the same provider as jsonify
+    response = make_response(current_app.json.response(data), code)
+    response.headers.extend(headers or {})
+    return response
@@ -0,0 +1,91 @@
+"""Adds parcel events
+
+Revision ID: b9e5f1c7d3a8
+Revises: a6d4e2f9c3b1
+Create Date: 2026-10-18 21:36:12.480917
+
+"""
+from datetime import date, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9e5f1c7d3a8'
+down_revision = 'a6d4e2f9c3b1'
+branch_labels = None
+depends_on = None
+
+# Same as PARCEL_EVENTS_PARTITIONS_AHEAD, later months come from `flask parcel-events-partitions`
+PARTITIONS_AHEAD = 3
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        op.create_table('parcel_events',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('parcel_id', sa.BigInteger(), nullable=False),
+        sa.Column('status', sa.String(length=50), nullable=False),
+        sa.Column('previous_status', sa.String(length=50), nullable=True),
+        sa.Column('occurred_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+        sa.Column('city', sa.Text(), nullable=True),
+        sa.Column('latitude', sa.Numeric(precision=10, scale=6), nullable=True),
+        sa.Column('longitude', sa.Numeric(precision=10, scale=6), nullable=True),
+        sa.Column('actor_id', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_parcel_events_parcel_id_occurred_at', 'parcel_events', ['parcel_id', 'occurred_at'], unique=False)
+        op.create_index('ix_parcel_events_occurred_at', 'parcel_events', ['occurred_at'], unique=False)
+    else:
+        # Every month the backfill below writes to gets its own partition, rows left in the default partition
+        # would block creating that month's partition later and never be dropped by retention
+        oldest = op.get_bind().scalar(sa.text("SELECT MIN(COALESCE(updated_at, created_at)) FROM parcels"))
+        create_partitioned_table(oldest)
+
+    # History starts here, existing parcels get one event with their current status
+    op.execute("""
+        INSERT INTO parcel_events (parcel_id, status, occurred_at, city, latitude, longitude)
+        SELECT id, COALESCE(status, 'Pending'), COALESCE(updated_at, created_at, CURRENT_TIMESTAMP), city, latitude, longitude
+        FROM parcels
+    """)
+
+
+def create_partitioned_table(oldest=None):
+    # The primary key of a partitioned table has to include the partition key
+    op.execute("""
+        CREATE TABLE parcel_events (
+            id BIGSERIAL NOT NULL,
+            parcel_id BIGINT NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            previous_status VARCHAR(50),
+            occurred_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            city TEXT,
+            latitude NUMERIC(10, 6),
+            longitude NUMERIC(10, 6),
+            actor_id INTEGER,
+            PRIMARY KEY (id, occurred_at)
+        ) PARTITION BY RANGE (occurred_at)
+    """)
+    # Created on every partition, present and future
+    op.execute("CREATE INDEX ix_parcel_events_parcel_id_occurred_at ON parcel_events (parcel_id, occurred_at)")
+    op.execute("CREATE INDEX ix_parcel_events_occurred_at ON parcel_events USING brin (occurred_at)")
+    op.execute("CREATE TABLE parcel_events_default PARTITION OF parcel_events DEFAULT")
+
+    today = date.today()
+    first = today.year * 12 + today.month - 1
+    if oldest is not None:
+        oldest = oldest.astimezone(timezone.utc) if oldest.tzinfo is not None else oldest
+        first = min(first, oldest.year * 12 + oldest.month - 1)
+    for index in range(first, today.year * 12 + today.month + PARTITIONS_AHEAD):
+        start = date(index // 12, index % 12 + 1, 1)
+        end = date((index + 1) // 12, (index + 1) % 12 + 1, 1)
+        op.execute(
+            f"CREATE TABLE parcel_events_y{start.year}m{start.month:02d} PARTITION OF parcel_events "
+            f"FOR VALUES FROM ('{start.isoformat()} 00:00:00+00') TO ('{end.isoformat()} 00:00:00+00')"
+        )
+
+
+def downgrade():
+    # Drops every partition with it
+    op.drop_table('parcel_events')
@@ -0,0 +1,33 @@
+"""Adds recipient search index
+
+Revision ID: f3c8d2b6e1a4
+Revises: e8b3c5d1a7f2
+Create Date: 2026-10-18 20:12:27.604519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c8d2b6e1a4'
+down_revision = 'e8b3c5d1a7f2'
+branch_labels = None
+depends_on = None
+
+# Must stay identical to recipient_search.search_document()
+SEARCH_DOCUMENT = """lower(coalesce(first_name, '') || ' ' || coalesce(last_name, '') || ' ' || coalesce(email, '')
+    || ' ' || coalesce(phone_number, '') || ' ' || regexp_replace(coalesce(phone_number, ''), '[^0-9]', '', 'g'))"""
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(f"CREATE INDEX ix_recipients_search_trgm ON recipients USING gin (({SEARCH_DOCUMENT}) gin_trgm_ops)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("DROP INDEX IF EXISTS ix_recipients_search_trgm")
@@ -1,6 +1,6 @@
 # /server/models.py
 
-from sqlalchemy import DateTime, func, Column, Integer, String, Float, ForeignKey, Text, BigInteger, Numeric
+from sqlalchemy import Date, DateTime, func, Column, Integer, String, Float, ForeignKey, Text, BigInteger, Numeric, JSON, Index, event
 from sqlalchemy.orm import relationship, validates
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy_serializer import SerializerMixin
@@ -10,6 +10,14 @@ import uuid
 import re
 
 from config import db
+from geo import geocell
+from contacts import recipient_dedupe_key
+
+# BIGINT primary keys, except on SQLite where only INTEGER PRIMARY KEY autoincrements (local and benchmark databases)
+BigIntegerKey = BigInteger().with_variant(Integer, 'sqlite')
+
+# Parcel lifecycle, in order
+PARCEL_STATUSES = ('Pending', 'Accepted', 'Out For Delivery', 'Delivered')
 
 # Association tables for many-to-many relationships
 roles_users = db.Table('roles_users',
@@ -22,11 +30,14 @@ class Role(db.Model, RoleMixin, SerializerMixin):
     
     id = Column(Integer, primary_key=True)
     name = Column(String(80), unique=True)
+    version_id = Column(Integer, nullable=False, server_default='1') # Bumped by every ORM update, the row's ETag (see conditional.py)
+
+    __mapper_args__ = {'version_id_col': version_id}
     
     # Many-to-many relationship with users
     users = relationship('User', secondary=roles_users, back_populates='roles')
 
-    serialize_rules = ('-users.roles',)
+    serialize_rules = ('-users.roles', '-version_id')
 
     def __repr__(self):
         return f"<Role(id={self.id}, name='{self.name}')>"
@@ -50,6 +61,9 @@ class User(db.Model, UserMixin, SerializerMixin):
     longitude = Column(Numeric(10, 6)) # Accurate to one micrometer)
     created_at = Column(DateTime(timezone=True), server_default=func.current_timestamp()) # adding current timezone to the timestamp
     updated_at = Column(DateTime(timezone=True), server_default=func.current_timestamp(), onupdate=func.current_timestamp())
+    version_id = Column(Integer, nullable=False, server_default='1') # Bumped by every ORM update, the row's ETag (see conditional.py)
+
+    __mapper_args__ = {'version_id_col': version_id}
 
     # Many-to-many relationship with roles
     roles = relationship('Role', secondary=roles_users, back_populates='users')
@@ -61,7 +75,7 @@ class User(db.Model, UserMixin, SerializerMixin):
     billing_addresses = relationship('BillingAddress', back_populates='user')
 
     # Serialization rules
-    serialize_rules = ('-roles.users', '-parcels.user', '-password', '-fs_uniquifier') # excluding the password and uniquifier from serialisation since they are sensitive
+    serialize_rules = ('-roles.users', '-parcels.user', '-password', '-fs_uniquifier', '-version_id') # excluding the password and uniquifier from serialisation since they are sensitive
     # exclude = ('password', 'fs_uniquifier') # Still learning how to implement this one
 
     @validates('email')
@@ -116,19 +130,32 @@ class Recipient(db.Model, SerializerMixin):
     country = Column(String(100), nullable=True) # Will see whether to handle as nullable based on google maps API
     latitude = Column(Numeric(10, 6)) # Accurate to one micrometer)
     longitude = Column(Numeric(10, 6)) # Accurate to one micrometer)
+    user_id = Column(Integer, ForeignKey('users.id')) # Who added the contact, imports are deduplicated per user
+    dedupe_key = Column(String(40), index=True) # Hash of the normalized name, email and address, maintained automatically (see contacts.py)
     created_at = Column(DateTime(timezone=True), server_default=func.current_timestamp())
     updated_at = Column(DateTime(timezone=True), server_default=func.current_timestamp(), onupdate=func.current_timestamp())
+    version_id = Column(Integer, nullable=False, server_default='1') # Bumped by every ORM update, the row's ETag (see conditional.py)
+
+    __mapper_args__ = {'version_id_col': version_id}
 
     # One-to-many relationship with parcels
     parcels = relationship('Parcel', back_populates='recipient')
 
+    serialize_rules = ('-dedupe_key', '-version_id')
+
     def __repr__(self):
         return f"<Recipient(id={self.id}, full_name='{self.first_name} {self.last_name}', email='{self.email}', phone_number='{self.phone_number}')>"
 
+# Keep the dedupe key in step with the contact details on every ORM insert/update
+@event.listens_for(Recipient, 'before_insert')
+@event.listens_for(Recipient, 'before_update')
+def set_recipient_dedupe_key(mapper, connection, target):
+    target.dedupe_key = recipient_dedupe_key(target)
+
 class Parcel(db.Model, SerializerMixin):
     __tablename__ = 'parcels'
     
-    id = Column(BigInteger, primary_key=True) # We expect that with scale the parcels will be significantly more than the users and recipients
+    id = Column(BigIntegerKey, primary_key=True) # We expect that with scale the parcels will be significantly more than the users and recipients
     user_id = Column(Integer, ForeignKey('users.id'))
     recipient_id = Column(Integer, ForeignKey('recipients.id'))
     length = Column(Numeric(10, 2)) # Precision = 10 digits total. Scale = 2 digits to the right of the decimal point
@@ -145,8 +172,15 @@ class Parcel(db.Model, SerializerMixin):
     country = Column(String(100), nullable=True) # Will see whether to handle as nullable based on google maps API
     latitude = Column(Numeric(10, 6)) # Accurate to one micrometer)
     longitude = Column(Numeric(10, 6)) # Accurate to one micrometer)
+    geocell = Column(Integer) # Grid cell of latitude/longitude for radius searches, maintained automatically (see geo.py)
     created_at = Column(DateTime(timezone=True), server_default=func.current_timestamp())
     updated_at = Column(DateTime(timezone=True), server_default=func.current_timestamp(), onupdate=func.current_timestamp())
+    version_id = Column(Integer, nullable=False, server_default='1') # Bumped by every ORM update, the row's ETag (see conditional.py)
+
+    __table_args__ = (
+        Index('ix_parcels_geocell_status', 'geocell', 'status'),
+    )
+    __mapper_args__ = {'version_id_col': version_id}
 
     # Many-to-one relationship with User
     user = relationship('User', back_populates='parcels')
@@ -154,11 +188,47 @@ class Parcel(db.Model, SerializerMixin):
     # Many-to-one relationship with Recipient
     recipient = relationship('Recipient', back_populates='parcels')
 
-    serialize_rules = ('-user.parcels', '-recipient.parcels')
+    serialize_rules = ('-user.parcels', '-recipient.parcels', '-geocell', '-version_id')
 
     def __repr__(self):
         return f"<Parcel(id={self.id}, length={self.length}, width={self.width}, height={self.height}, weight={self.weight}, cost={self.cost}, tracking_number='{self.tracking_number}')>"
 
+# Keep the geocell in step with the coordinates on every ORM insert/update
+@event.listens_for(Parcel, 'before_insert')
+@event.listens_for(Parcel, 'before_update')
+def set_parcel_geocell(mapper, connection, target):
+    target.geocell = geocell(target.latitude, target.longitude)
+
+# The dashboard rollups (see rollups.py) need the value being replaced even when the attribute was expired
+@event.listens_for(Parcel.status, 'set', active_history=True)
+@event.listens_for(Parcel.city, 'set', active_history=True)
+@event.listens_for(Parcel.cost, 'set', active_history=True)
+def keep_previous_parcel_value(target, value, oldvalue, initiator):
+    pass
+
+# Append-only status history, one row per status change (see parcel_events.py). The parcel row keeps the current status.
+# On PostgreSQL the table is range partitioned by month on occurred_at (migration b9e5f1c7d3a8)
+class ParcelEvent(db.Model, SerializerMixin):
+    __tablename__ = 'parcel_events'
+
+    id = Column(BigIntegerKey, primary_key=True)
+    parcel_id = Column(BigInteger, nullable=False) # No foreign key, the history outlives deleted parcels and inserts skip the lookup
+    status = Column(String(50), nullable=False)
+    previous_status = Column(String(50)) # None for the event recorded when the parcel was created
+    occurred_at = Column(DateTime(timezone=True), nullable=False, server_default=func.current_timestamp())
+    city = Column(Text) # Where the parcel was when its status changed
+    latitude = Column(Numeric(10, 6))
+    longitude = Column(Numeric(10, 6))
+    actor_id = Column(Integer) # User who made the change, None for system changes
+
+    __table_args__ = (
+        Index('ix_parcel_events_parcel_id_occurred_at', 'parcel_id', 'occurred_at'),
+        Index('ix_parcel_events_occurred_at', 'occurred_at', postgresql_using='brin'),
+    )
+
+    def __repr__(self):
+        return f"<ParcelEvent(id={self.id}, parcel_id={self.parcel_id}, status='{self.status}', occurred_at={self.occurred_at})>"
+
 class BillingAddress(db.Model, SerializerMixin):
     __tablename__ = 'billing_addresses'
     
@@ -171,11 +241,59 @@ class BillingAddress(db.Model, SerializerMixin):
     country = Column(String(100), nullable=True) # Will see whether to handle as nullable based on google maps API
     latitude = Column(Numeric(10, 6)) # Accurate to one micrometer
     longitude = Column(Numeric(10, 6)) # Accurate to one micrometer
+    version_id = Column(Integer, nullable=False, server_default='1') # Bumped by every ORM update, the row's ETag (see conditional.py)
+
+    __mapper_args__ = {'version_id_col': version_id}
     
     # Relationship to User
     user = relationship('User', back_populates='billing_addresses')
 
-    serialize_rules = ('-user.billing_addresses',)
+    serialize_rules = ('-user.billing_addresses', '-version_id')
+
+    def __repr__(self):
+        return f"<BillingAddress(id={self.id}, user_id={self.user_id}, street={self.street}, city={self.city}, state={self.state}, zip_code={self.zip_code}, country={self.country})>"
+
+class EmailOutbox(db.Model, SerializerMixin):
+    __tablename__ = 'email_outbox'
+
+    id = Column(BigIntegerKey, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id')) # Who queued it, only they and admins can look it up
+    sender = Column(String(255))
+    recipients = Column(JSON, nullable=False) # List of addresses
+    subject = Column(Text, nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default='queued', index=True) # "queued", "sending", "sent" or "failed"
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.current_timestamp(), index=True) # When a worker may pick it up (again)
+    claimed_at = Column(DateTime(timezone=True)) # When a worker started sending, used to recover from crashed workers
+    claimed_by = Column(String(64)) # Claim token of the worker sending it
+    sent_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.current_timestamp())
+
+    serialize_rules = ('-body', '-claimed_by')
+
+    def __repr__(self):
+        return f"<EmailOutbox(id={self.id}, subject='{self.subject}', status='{self.status}', attempts={self.attempts})>"
+
+# Dashboard rollups, maintained incrementally in the same transaction as the parcel writes (see rollups.py)
+class ParcelDailyStats(db.Model, SerializerMixin):
+    __tablename__ = 'parcel_daily_stats'
+
+    day = Column(Date, primary_key=True) # UTC day the parcels were created
+    city = Column(Text, primary_key=True, default='') # Parcel city, '' when unknown
+    status = Column(String(50), primary_key=True)
+    parcel_count = Column(Integer, nullable=False, default=0)
+    revenue = Column(Numeric(14, 2), nullable=False, default=0) # Sum of the parcels' cost
+
+    def __repr__(self):
+        return f"<ParcelDailyStats(day={self.day}, city='{self.city}', status='{self.status}', parcel_count={self.parcel_count}, revenue={self.revenue})>"
+
+class UserDailyActivity(db.Model, SerializerMixin):
+    __tablename__ = 'user_daily_activity'
+
+    day = Column(Date, primary_key=True) # UTC day the user created at least one parcel
+    user_id = Column(Integer, primary_key=True)
 
     def __repr__(self):
-        return f"<BillingAddress(id={self.id}, user_id={self.user_id}, street={self.street}, city={self.city}, state={self.state}, zip_code={self.zip_code}, country={self.country})>"
\ No newline at end of file
+        return f"<UserDailyActivity(day={self.day}, user_id={self.user_id})>"
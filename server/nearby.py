@@ -0,0 +1,62 @@
+# /server/nearby.py
+
+# "Which parcels are within N km of this point" for dispatch.
+# Candidates come from an index range scan over the geocells covering the search circle,
+# only their id and coordinates are fetched, and the exact distance filter runs vectorized in NumPy.
+
+import numpy as np
+from sqlalchemy import select, or_
+
+from config import db
+from geo import covering_ranges, haversine_km
+from models import Parcel
+
+NEARBY_MAX_RADIUS_KM = 100
+NEARBY_MAX_LIMIT = 1000
+
+
+def find_nearby_parcels(latitude, longitude, radius_km, status=None, limit=100):
+    ranges = covering_ranges(latitude, longitude, radius_km)
+    query = select(Parcel.id, Parcel.latitude, Parcel.longitude).where(
+        or_(*[Parcel.geocell.between(first, last) for first, last in ranges])
+    )
+    if status:
+        query = query.where(Parcel.status == status)
+
+    candidates = db.session.execute(query).all()
+    if not candidates:
+        return []
+
+    ids = np.fromiter((row[0] for row in candidates), dtype=np.int64, count=len(candidates))
+    latitudes = np.fromiter((row[1] for row in candidates), dtype=np.float64, count=len(candidates))
+    longitudes = np.fromiter((row[2] for row in candidates), dtype=np.float64, count=len(candidates))
+
+    distances = haversine_km(latitude, longitude, latitudes, longitudes)
+    inside = np.flatnonzero(distances <= radius_km)
+    nearest = inside[np.argsort(distances[inside], kind='stable')][:limit]
+    if nearest.size == 0:
+        return []
+
+    distance_by_id = dict(zip(ids[nearest].tolist(), distances[nearest].tolist()))
+    rows = db.session.execute(
+        select(Parcel.id, Parcel.tracking_number, Parcel.status, Parcel.user_id, Parcel.recipient_id,
+               Parcel.city, Parcel.latitude, Parcel.longitude)
+        .where(Parcel.id.in_(list(distance_by_id)))
+    ).all()
+
+    results = [
+        {
+            "id": row.id,
+            "tracking_number": row.tracking_number,
+            "status": row.status,
+            "user_id": row.user_id,
+            "recipient_id": row.recipient_id,
+            "city": row.city,
+            "latitude": row.latitude,
+            "longitude": row.longitude,
+            "distance_km": round(distance_by_id[row.id], 3)
+        }
+        for row in rows
+    ]
+    results.sort(key=lambda parcel: parcel['distance_km'])
+    return results
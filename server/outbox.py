@@ -0,0 +1,206 @@
+# /server/outbox.py
+
+# Email outbox: /send-email only writes a row to `email_outbox`, a pool of worker threads sends it.
+# Each worker keeps one long-lived SMTP connection open (TLS handshake and login happen once, not per
+# message), claims due messages in batches with an UPDATE over SELECT ... FOR UPDATE SKIP LOCKED so
+# several worker processes can share the table, and retries failures with exponential backoff.
+#
+# Run the pool with `flask outbox-worker`, or in the web process with OUTBOX_WORKERS_IN_PROCESS=true.
+
+import logging
+import os
+import random
+import smtplib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from flask_mail import Message
+from sqlalchemy import and_, or_, select, update
+
+from config import db
+from models import EmailOutbox
+
+logger = logging.getLogger('outbox')
+
+# The server refusing this message rather than the connection failing, permanent for 5xx replies only
+MESSAGE_REJECTIONS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def rejection_code(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        # Raised when every recipient was refused, retried while any of the refusals is temporary
+        return min((code for code, _ in error.recipients.values()), default=550)
+    return error.smtp_code
+
+
+def enqueue_email(recipients, subject, body, sender=None, user_id=None, session=None):
+    session = session or db.session
+    outbox = EmailOutbox(
+        user_id=user_id,
+        sender=sender,
+        recipients=[recipients] if isinstance(recipients, str) else list(recipients),
+        subject=subject,
+        body=body,
+        status='queued',
+        attempts=0,
+        next_attempt_at=datetime.now(timezone.utc)
+    )
+    session.add(outbox)
+    session.commit()
+    return outbox
+
+
+class SMTPSession:
+    # A Flask-Mail connection kept open between batches and reopened after errors or when idle too long
+    def __init__(self, mail, idle_timeout=60):
+        self.mail = mail
+        self.idle_timeout = idle_timeout
+        self.connection = None
+        self.last_used = 0
+
+    def send(self, message):
+        if self.connection is None or time.monotonic() - self.last_used > self.idle_timeout:
+            self.open()
+        self.connection.send(message)
+        self.last_used = time.monotonic()
+
+    def open(self):
+        self.close()
+        self.connection = self.mail.connect().__enter__()
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.connection is not None and self.connection.host is not None:
+            try:
+                self.connection.host.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        self.connection = None
+
+
+class OutboxWorkerPool:
+    def __init__(self, app, mail, workers=None, batch_size=None, poll_interval=None):
+        config = app.config
+        self.app = app
+        self.mail = mail
+        self.workers = workers or config['OUTBOX_WORKERS']
+        self.batch_size = batch_size or config['OUTBOX_BATCH_SIZE']
+        self.poll_interval = poll_interval or config['OUTBOX_POLL_INTERVAL']
+        self.max_attempts = config['OUTBOX_MAX_ATTEMPTS']
+        self.backoff_base = config['OUTBOX_BACKOFF_BASE']
+        self.backoff_max = config['OUTBOX_BACKOFF_MAX']
+        self.claim_timeout = timedelta(seconds=config['OUTBOX_CLAIM_TIMEOUT'])
+        self._threads = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    def start(self):
+        if self._threads:
+            return self
+        self._stop.clear()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'outbox-worker-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        # Called after enqueueing so in-process workers don't wait for the next poll
+        self._wake.set()
+
+    def _run(self):
+        smtp = SMTPSession(self.mail)
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    processed = self.process_batch(smtp)
+                except Exception:
+                    logger.exception("Outbox batch failed")
+                    db.session.rollback()
+                    processed = 0
+                finally:
+                    db.session.remove()
+                if not processed:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+        smtp.close()
+
+    def claim_batch(self):
+        now = datetime.now(timezone.utc)
+        token = f'{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex[:12]}'
+        due = and_(EmailOutbox.status == 'queued', EmailOutbox.next_attempt_at <= now)
+        # Rows left in "sending" by a worker that died are picked up again after the claim timeout, unless they
+        # used up their attempts: a message that keeps killing its worker must not be claimed forever
+        abandoned = and_(EmailOutbox.status == 'sending', EmailOutbox.claimed_at <= now - self.claim_timeout)
+        exhausted = db.session.execute(
+            update(EmailOutbox)
+            .where(abandoned, EmailOutbox.attempts >= self.max_attempts)
+            .values(status='failed', last_error='Abandoned while sending, out of attempts')
+            .execution_options(synchronize_session=False)
+        )
+        if exhausted.rowcount:
+            logger.warning("Gave up on %s abandoned emails out of attempts", exhausted.rowcount)
+        abandoned = and_(abandoned, EmailOutbox.attempts < self.max_attempts)
+        candidates = (
+            select(EmailOutbox.id)
+            .where(or_(due, abandoned))
+            .order_by(EmailOutbox.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        # Claiming is a single conditional UPDATE, so two workers can never both take a row,
+        # even on databases without SKIP LOCKED
+        db.session.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.id.in_(candidates.scalar_subquery()), or_(due, abandoned))
+            .values(status='sending', claimed_at=now, claimed_by=token, attempts=EmailOutbox.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return EmailOutbox.query.filter_by(claimed_by=token, status='sending').order_by(EmailOutbox.id).all()
+
+    def process_batch(self, smtp):
+        messages = self.claim_batch()
+        for outbox in messages:
+            try:
+                message = Message(subject=outbox.subject,
+                                  recipients=outbox.recipients,
+                                  body=outbox.body,
+                                  sender=outbox.sender or self.app.config['MAIL_USERNAME'])
+                smtp.send(message)
+            except MESSAGE_REJECTIONS as e:
+                self._failed(outbox, e, permanent=rejection_code(e) >= 500)
+            except (smtplib.SMTPException, OSError) as e:
+                # The connection is suspect after any transport error, the next send reconnects
+                smtp.close()
+                self._failed(outbox, e)
+            except Exception as e:
+                # Anything else (a malformed row, a bug) only fails this message, retried until it runs out of attempts
+                logger.exception("Sending email %s failed", outbox.id)
+                smtp.close()
+                self._failed(outbox, e)
+            else:
+                outbox.status = 'sent'
+                outbox.sent_at = datetime.now(timezone.utc)
+                outbox.last_error = None
+            db.session.commit()
+        return len(messages)
+
+    def _failed(self, outbox, error, permanent=False):
+        outbox.last_error = str(error)
+        if permanent or outbox.attempts >= self.max_attempts:
+            outbox.status = 'failed'
+            logger.warning("Giving up on email %s after %s attempts: %s", outbox.id, outbox.attempts, error)
+            return
+        delay = min(self.backoff_base * 2 ** (outbox.attempts - 1), self.backoff_max)
+        outbox.status = 'queued'
+        outbox.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay * random.uniform(0.8, 1.2))
@@ -0,0 +1,94 @@
+# /server/pagination.py
+
+# Keyset (cursor) pagination and streamed JSON arrays for the collection endpoints.
+# Both walk the table in primary key order so that every page is an index range scan on `id`
+# instead of an OFFSET scan, and neither ever holds more than one page/chunk of rows in memory.
+
+import base64
+import binascii
+import json
+
+from flask import request, make_response, jsonify, current_app, Response, stream_with_context
+
+from serializers import serialize
+
+DEFAULT_PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 500
+STREAM_CHUNK_SIZE = 1000
+
+
+def encode_cursor(last_id):
+    payload = json.dumps({"id": last_id}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    # Cursors are opaque to clients, anything we can't decode is treated as a bad request
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return int(payload['id'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def keyset_page(query, model, limit, after_id=None):
+    if after_id is not None:
+        query = query.filter(model.id > after_id)
+    # Fetch one extra row so we know whether there is a next page without a COUNT(*)
+    rows = query.order_by(model.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1].id) if has_more and rows else None
+    return rows, next_cursor
+
+
+def stream_json_array(query, model, serialize, chunk_size=STREAM_CHUNK_SIZE):
+    # yield_per makes psycopg2 use a server-side (named) cursor, so rows arrive in chunks
+    # and the JSON array is written out as we go instead of being built up in memory
+    def generate():
+        dumps = current_app.json.dumps
+        yield '['
+        first = True
+        for row in query.order_by(model.id).yield_per(chunk_size):
+            if not first:
+                yield ','
+            yield dumps(serialize(row))
+            first = False
+        yield ']'
+
+    return Response(stream_with_context(generate()), status=200, mimetype='application/json')
+
+
+def _parse_limit(raw_limit):
+    limit = int(raw_limit)
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, current_app.config.get('MAX_PAGE_LIMIT', MAX_PAGE_LIMIT))
+
+
+def list_response(query, model, serialize=serialize):
+    # ?limit=&after= returns a page wrapped with the next cursor,
+    # no pagination params streams the whole collection as a plain JSON array (unchanged shape)
+    raw_limit = request.args.get('limit')
+    raw_after = request.args.get('after')
+
+    if raw_limit is None and raw_after is None:
+        return stream_json_array(query, model, serialize)
+
+    try:
+        limit = _parse_limit(raw_limit) if raw_limit is not None else DEFAULT_PAGE_LIMIT
+    except ValueError:
+        return make_response(jsonify({"message": "limit must be a positive integer"}), 400)
+
+    try:
+        after_id = decode_cursor(raw_after) if raw_after else None
+    except ValueError:
+        return make_response(jsonify({"message": "Invalid cursor"}), 400)
+
+    rows, next_cursor = keyset_page(query, model, limit, after_id)
+    return make_response(jsonify({
+        "items": [serialize(row) for row in rows],
+        "next_cursor": next_cursor,
+        "limit": limit
+    }), 200)
@@ -0,0 +1,227 @@
+# /server/parcel_events.py
+
+# Parcel status history.
+# Every status change appends a parcel_events row (status, previous status, time, location, actor) in the
+# same transaction as the parcel write: ORM changes through an after_flush hook, Core bulk inserts by calling
+# record_parcel_events. Each event is also published to the live update streams (see parcel_stream.py).
+# The parcels row still holds the current status, the events are only read for history.
+# On PostgreSQL parcel_events is partitioned by month on occurred_at, with a BRIN index on occurred_at and a
+# btree on (parcel_id, occurred_at) in every partition. `flask parcel-events-partitions` creates the coming
+# months ahead of time and drops the months past PARCEL_EVENTS_RETENTION_MONTHS, so retention is a DROP TABLE
+# instead of a DELETE. Rows outside every monthly partition land in parcel_events_default, they move to their
+# month's partition when it is created.
+
+import re
+from datetime import date, datetime, timedelta, timezone
+
+from flask import has_request_context, session
+from sqlalchemy import event, inspect, insert, select, text
+from sqlalchemy.orm import Session
+
+from config import db
+from models import Parcel, ParcelEvent
+from rollups import utc_now
+from parcel_stream import event_message, publish_parcel_events
+
+PARTITION_NAME = re.compile(r'^parcel_events_y(\d{4})m(\d{2})$')
+DEFAULT_PARTITION = 'parcel_events_default'
+# Parcels are stamped before their first event, the slack only guards against clock skew
+HISTORY_PRUNE_SLACK = timedelta(days=1)
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'parcel_events_y{month.year}m{month.month:02d}'
+
+
+def current_actor():
+    # The signed-in user making the change, None outside a request (CLI, workers)
+    if has_request_context() and session.get('user_id'):
+        return int(session['user_id'])
+    return None
+
+
+def _event(parcel_id, status, previous_status, occurred_at, city, latitude, longitude, actor_id):
+    return {
+        "parcel_id": parcel_id,
+        "status": status,
+        "previous_status": previous_status,
+        "occurred_at": occurred_at,
+        "city": city,
+        "latitude": latitude,
+        "longitude": longitude,
+        "actor_id": actor_id,
+    }
+
+
+def _write_events(session, events, owners):
+    # owners[i] is (user_id, tracking_number) of events[i]'s parcel, used to route the live update
+    if not events:
+        return
+    statement = insert(ParcelEvent.__table__).returning(ParcelEvent.id, sort_by_parameter_order=True)
+    ids = session.connection().execute(statement, events).scalars().all()
+    publish_parcel_events(session, [
+        event_message(event_id, user_id, values['parcel_id'], tracking_number, values['status'],
+                      values['previous_status'], values['occurred_at'], values['city'])
+        for event_id, values, (user_id, tracking_number) in zip(ids, events, owners)
+        if user_id is not None
+    ])
+
+
+def record_parcel_events(session, rows, actor_id=None):
+    # For parcels inserted outside the ORM, rows carry id, user_id, tracking_number, status and
+    # optionally city/latitude/longitude/created_at
+    occurred_at = utc_now()
+    events = [
+        _event(row['id'], row.get('status') or Parcel.__table__.c.status.default.arg, None,
+               row.get('created_at') or occurred_at, row.get('city'), row.get('latitude'), row.get('longitude'), actor_id)
+        for row in rows
+    ]
+    _write_events(session, events, [(row.get('user_id'), row.get('tracking_number')) for row in rows])
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_parcel_events(session, flush_context):
+    # Runs after the parcels were written (new ones have their id), while the attribute history still holds the old status
+    events = []
+    owners = []
+    occurred_at = None
+    for parcel in session.new:
+        if isinstance(parcel, Parcel):
+            occurred_at = occurred_at or utc_now()
+            events.append(_event(parcel.id, parcel.status or Parcel.__table__.c.status.default.arg, None,
+                                 occurred_at, parcel.city, parcel.latitude, parcel.longitude, current_actor()))
+            owners.append((parcel.user_id, parcel.tracking_number))
+
+    for parcel in session.dirty:
+        if isinstance(parcel, Parcel):
+            history = inspect(parcel).attrs['status'].history
+            previous = history.deleted[0] if history.deleted else None
+            if history.added and history.added[0] != previous:
+                occurred_at = occurred_at or utc_now()
+                events.append(_event(parcel.id, history.added[0], previous,
+                                     occurred_at, parcel.city, parcel.latitude, parcel.longitude, current_actor()))
+                owners.append((parcel.user_id, parcel.tracking_number))
+
+    _write_events(session, events, owners)
+
+
+def parcel_history(parcel):
+    # Oldest first. The lower bound on occurred_at lets PostgreSQL skip the partitions before the parcel existed
+    query = select(
+        ParcelEvent.id, ParcelEvent.status, ParcelEvent.previous_status, ParcelEvent.occurred_at,
+        ParcelEvent.city, ParcelEvent.latitude, ParcelEvent.longitude, ParcelEvent.actor_id
+    ).where(ParcelEvent.parcel_id == parcel.id)
+    if parcel.created_at is not None:
+        query = query.where(ParcelEvent.occurred_at >= parcel.created_at - HISTORY_PRUNE_SLACK)
+    return [dict(row._mapping) for row in db.session.execute(query.order_by(ParcelEvent.occurred_at, ParcelEvent.id))]
+
+
+def is_partitioned():
+    # False on other databases, or when parcel_events came from create_all instead of the migration
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.scalar(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('parcel_events')")) == 'p'
+
+
+def _partitions():
+    rows = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'parcel_events'::regclass"
+    )).scalars()
+    partitions = {}
+    for name in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def _month_bounds(month):
+    return (datetime.combine(month, datetime.min.time(), timezone.utc),
+            datetime.combine(add_months(month, 1), datetime.min.time(), timezone.utc))
+
+
+def _has_default():
+    return db.session.scalar(text(f"SELECT to_regclass('{DEFAULT_PARTITION}')")) is not None
+
+
+def _default_months():
+    # Months the default partition holds events of, oldest first
+    if not _has_default():
+        return []
+    rows = db.session.execute(text(
+        f"SELECT DISTINCT date_trunc('month', occurred_at AT TIME ZONE 'UTC') FROM {DEFAULT_PARTITION}"
+    )).scalars()
+    return sorted(month_start(row) for row in rows)
+
+
+def create_partitions(first_month, last_month, existing=None):
+    # Creates the missing monthly partitions from first_month to last_month inclusive, returns their names.
+    # PostgreSQL refuses to create a partition over rows the default partition holds, those are moved into a
+    # new table first which is then attached. The caller commits
+    existing = _partitions() if existing is None else existing
+    has_default = _has_default()
+    created = []
+    month = month_start(first_month)
+    while month <= last_month:
+        if month not in existing:
+            name = partition_name(month)
+            start, end = _month_bounds(month)
+            bounds = {'start': start, 'end': end}
+            values = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            in_default = has_default and db.session.scalar(text(
+                f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE occurred_at >= :start AND occurred_at < :end)"
+            ), bounds)
+            if in_default:
+                db.session.execute(text(f"CREATE TABLE {name} (LIKE parcel_events INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+                db.session.execute(text(
+                    f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE occurred_at >= :start AND occurred_at < :end RETURNING *) "
+                    f"INSERT INTO {name} SELECT * FROM moved"
+                ), bounds)
+                # Builds the partitioned indexes on it
+                db.session.execute(text(f"ALTER TABLE parcel_events ATTACH PARTITION {name} {values}"))
+            else:
+                db.session.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF parcel_events {values}"))
+            existing[month] = name
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def maintain_partitions(months_ahead=3, retention_months=0):
+    # Returns (created, dropped) partition names. A no-op without partitioning
+    if not is_partitioned():
+        return [], []
+    this_month = month_start(utc_now().date())
+    # Keeps the current month plus retention_months - 1 before it
+    cutoff = add_months(this_month, -(retention_months - 1)) if retention_months else None
+    existing = _partitions()
+
+    # Months sitting in the default partition (written before their partition existed) get their own, so
+    # retention can drop them like any other month. Those before the cutoff are deleted instead
+    created = []
+    for month in _default_months():
+        if cutoff is None or month >= cutoff:
+            created += create_partitions(month, month, existing)
+    if cutoff is not None and _has_default():
+        db.session.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE occurred_at < :cutoff"), {'cutoff': _month_bounds(cutoff)[0]})
+    created += create_partitions(this_month, add_months(this_month, months_ahead), existing)
+
+    dropped = []
+    if cutoff is not None:
+        for month, name in sorted(existing.items()):
+            if month < cutoff:
+                db.session.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                dropped.append(name)
+
+    db.session.commit()
+    return created, dropped
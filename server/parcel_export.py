@@ -0,0 +1,91 @@
+# /server/parcel_export.py
+
+# Streaming parcel export as CSV or NDJSON.
+# The export selects plain columns (no ORM entities) and reads them with stream_results/yield_per, which is
+# a server-side cursor on PostgreSQL, so rows arrive in fixed-size partitions and each partition is
+# encoded and handed off before the next is fetched. Memory stays flat whatever the row count.
+
+import csv
+import io
+from datetime import datetime, time, timedelta, timezone
+
+from sqlalchemy import select
+
+from config import db
+from models import Parcel, Recipient, User
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_CHUNK_ROWS = 5000
+
+PARCEL_EXPORT_COLUMNS = (
+    Parcel.id, Parcel.tracking_number, Parcel.status, Parcel.user_id, Parcel.recipient_id,
+    Parcel.length, Parcel.width, Parcel.height, Parcel.weight, Parcel.cost,
+    Parcel.street, Parcel.city, Parcel.state, Parcel.zip_code, Parcel.country,
+    Parcel.latitude, Parcel.longitude, Parcel.created_at, Parcel.updated_at,
+)
+
+# Optional joined fields, by the name used in ?include=
+RELATED_EXPORT_COLUMNS = {
+    'recipient': (Recipient, Parcel.recipient_id == Recipient.id, (
+        Recipient.first_name.label('recipient_first_name'),
+        Recipient.last_name.label('recipient_last_name'),
+        Recipient.email.label('recipient_email'),
+        Recipient.phone_number.label('recipient_phone_number'),
+        Recipient.city.label('recipient_city'),
+    )),
+    'user': (User, Parcel.user_id == User.id, (
+        User.first_name.label('user_first_name'),
+        User.last_name.label('user_last_name'),
+        User.email.label('user_email'),
+    )),
+}
+
+
+def export_query(start=None, end=None, statuses=None, user_id=None, include=()):
+    # start/end are inclusive UTC dates on created_at
+    columns = list(PARCEL_EXPORT_COLUMNS)
+    joins = []
+    for name in include:
+        model, on, related = RELATED_EXPORT_COLUMNS[name]
+        columns.extend(related)
+        joins.append((model, on))
+
+    query = select(*columns).select_from(Parcel)
+    for model, on in joins:
+        query = query.outerjoin(model, on)
+    if start:
+        query = query.where(Parcel.created_at >= datetime.combine(start, time.min, timezone.utc))
+    if end:
+        query = query.where(Parcel.created_at < datetime.combine(end + timedelta(days=1), time.min, timezone.utc))
+    if statuses:
+        query = query.where(Parcel.status.in_(statuses))
+    if user_id is not None:
+        query = query.where(Parcel.user_id == user_id)
+    return query.order_by(Parcel.id)
+
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_chunks(query, format, dumps, chunk_rows=EXPORT_CHUNK_ROWS):
+    # Yields str chunks, one per fetched partition
+    result = db.session.execute(query.execution_options(stream_results=True, yield_per=chunk_rows))
+    try:
+        keys = list(result.keys())
+        if format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator='\n')
+            writer.writerow(keys)
+            for partition in result.partitions():
+                writer.writerows([_csv_value(value) for value in row] for row in partition)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        else:
+            for partition in result.partitions():
+                yield ''.join(dumps(dict(zip(keys, row))) + '\n' for row in partition)
+    finally:
+        result.close()
@@ -0,0 +1,362 @@
+# /server/parcel_stream.py
+
+# Live parcel status updates over Server-Sent Events.
+# The status events written by parcel_events.py are published to a broker once their transaction commits and
+# fanned out to the open streams of the parcel's owner. With PostgreSQL the broker is LISTEN/NOTIFY: the
+# NOTIFY is sent inside the writing transaction (so it is delivered on commit only) and one listener thread
+# per process feeds every stream in that process. Otherwise an in-process broker stands in, which only
+# reaches streams served by the same process.
+# Each stream has a bounded buffer. A stream that falls behind, or misses notifications while the listener
+# reconnects, catches up from parcel_events, which is also how a reconnecting client's Last-Event-ID is
+# replayed. Idle streams wait on a condition with a heartbeat timeout and hold no database connection, but
+# a stream served by the Flask app holds its worker (or thread) until the client disconnects. Under the async
+# server (asgi.py) streams wait on the event loop instead and cost no thread.
+
+import asyncio
+import json
+import logging
+import select as selectors
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from config import app, db
+from models import Parcel, ParcelEvent
+from rollups import utc_now
+
+logger = logging.getLogger('parcel_stream')
+
+PENDING_KEY = 'parcel_stream_pending'
+NOTIFY_CHANNEL = 'sendit_parcel_events'
+NOTIFY_PAYLOAD_LIMIT = 7000  # Bytes, PostgreSQL caps a payload at 8000
+
+
+def event_message(event_id, user_id, parcel_id, tracking_number, status, previous_status, occurred_at, city):
+    return {
+        "id": event_id,
+        "user_id": user_id,
+        "parcel_id": parcel_id,
+        "tracking_number": tracking_number,
+        "status": status,
+        "previous_status": previous_status,
+        "occurred_at": occurred_at.isoformat() if occurred_at is not None else None,
+        "city": city,
+    }
+
+
+class Subscription:
+    __slots__ = ('user_id', 'buffer', 'maxsize', 'overflowed', 'condition')
+
+    def __init__(self, user_id, maxsize):
+        self.user_id = user_id
+        self.buffer = deque()
+        self.maxsize = maxsize
+        self.overflowed = False  # Messages were dropped, the stream has to catch up from the database
+        self.condition = threading.Condition()
+
+    def put(self, message):
+        with self.condition:
+            if self.overflowed:
+                return
+            if len(self.buffer) >= self.maxsize:
+                self.buffer.clear()
+                self.overflowed = True
+            else:
+                self.buffer.append(message)
+            self._notify()
+
+    def mark_overflowed(self):
+        with self.condition:
+            self.buffer.clear()
+            self.overflowed = True
+            self._notify()
+
+    def _notify(self):
+        self.condition.notify()
+
+    def _drain(self):
+        # Called with the condition held
+        messages, overflowed = list(self.buffer), self.overflowed
+        self.buffer.clear()
+        self.overflowed = False
+        return messages, overflowed
+
+    def wait(self, timeout):
+        # Returns (messages, overflowed), both empty/False when the timeout passed first
+        with self.condition:
+            if not self.buffer and not self.overflowed:
+                self.condition.wait(timeout)
+            return self._drain()
+
+
+class AsyncSubscription(Subscription):
+    # A stream served on an event loop (see asgi.py). Messages are put from the listener thread or whichever
+    # thread committed, the waiting task is woken on its own loop
+    __slots__ = ('loop', 'ready')
+
+    def __init__(self, user_id, maxsize, loop):
+        super().__init__(user_id, maxsize)
+        self.loop = loop
+        self.ready = asyncio.Event()
+
+    def _notify(self):
+        try:
+            self.loop.call_soon_threadsafe(self.ready.set)
+        except RuntimeError:
+            # The loop is closed, the stream is going away with it
+            pass
+
+    async def wait_async(self, timeout):
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        # Cleared before draining, a message put in between sets it again for the next wait
+        self.ready.clear()
+        with self.condition:
+            return self._drain()
+
+
+class LocalBroker:
+    def __init__(self, buffer_size=100):
+        self.buffer_size = buffer_size
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, user_id, loop=None):
+        # loop: the event loop of an async stream
+        if loop is None:
+            subscription = Subscription(user_id, self.buffer_size)
+        else:
+            subscription = AsyncSubscription(user_id, self.buffer_size, loop)
+        with self.lock:
+            self.subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscribers.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscribers[subscription.user_id]
+
+    def stage(self, session, messages):
+        # Held on the session until its transaction commits
+        session.info.setdefault(PENDING_KEY, []).extend(messages)
+
+    def deliver(self, messages):
+        with self.lock:
+            targets = [(message, list(self.subscribers.get(message['user_id'], ()))) for message in messages]
+        for message, subscriptions in targets:
+            for subscription in subscriptions:
+                subscription.put(message)
+
+    def resync_all(self):
+        with self.lock:
+            subscriptions = [subscription for group in self.subscribers.values() for subscription in group]
+        for subscription in subscriptions:
+            subscription.mark_overflowed()
+
+    def stats(self):
+        with self.lock:
+            return {"broker": type(self).__name__, "users": len(self.subscribers),
+                    "streams": sum(len(group) for group in self.subscribers.values())}
+
+
+class PostgresBroker(LocalBroker):
+    def __init__(self, engine, buffer_size=100, channel=NOTIFY_CHANNEL, reconnect_delay=1.0):
+        super().__init__(buffer_size)
+        self.engine = engine
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.listener = None
+
+    def stage(self, session, messages):
+        # NOTIFY is transactional, listeners (this process included) get it when the transaction commits
+        connection = session.connection()
+        for payload in self._payloads(messages):
+            connection.execute(select(func.pg_notify(self.channel, payload)))
+
+    def _payloads(self, messages):
+        batch, size = [], 2
+        for message in messages:
+            encoded = json.dumps(message, separators=(',', ':'))
+            if batch and size + len(encoded) + 1 > NOTIFY_PAYLOAD_LIMIT:
+                yield '[' + ','.join(batch) + ']'
+                batch, size = [], 2
+            batch.append(encoded)
+            size += len(encoded) + 1
+        if batch:
+            yield '[' + ','.join(batch) + ']'
+
+    def subscribe(self, user_id, loop=None):
+        # Started on first use so forked workers and CLI commands don't inherit or start a listener
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self._listen, name='parcel-stream-listener', daemon=True)
+                self.listener.start()
+        return super().subscribe(user_id, loop)
+
+    def _connect(self):
+        # A dedicated connection outside the pool, it stays in LISTEN for the life of the process
+        dialect = self.engine.dialect
+        args, kwargs = dialect.create_connect_args(self.engine.url)
+        connection = dialect.connect(*args, **kwargs)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.channel}')
+        return connection
+
+    def _listen(self):
+        connected_before = False
+        while True:
+            try:
+                connection = self._connect()
+            except Exception as e:
+                logger.warning("Parcel stream listener can't connect: %s", e)
+                time.sleep(self.reconnect_delay)
+                continue
+            if connected_before:
+                # Notifications sent while we were away are gone, every stream catches up from the database
+                self.resync_all()
+            connected_before = True
+            try:
+                while True:
+                    if selectors.select([connection], [], [], 60) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        notification = connection.notifies.pop(0)
+                        self.deliver(json.loads(notification.payload))
+            except Exception as e:
+                logger.warning("Parcel stream listener lost its connection: %s", e)
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+                time.sleep(self.reconnect_delay)
+
+
+def create_broker(config):
+    backend = config['SSE_BROKER']
+    if backend == 'auto':
+        backend = 'postgres' if make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name() == 'postgresql' else 'local'
+    if backend == 'postgres':
+        with app.app_context():
+            return PostgresBroker(db.engine, buffer_size=config['SSE_BUFFER_SIZE'])
+    return LocalBroker(buffer_size=config['SSE_BUFFER_SIZE'])
+
+
+broker = create_broker(app.config)
+
+
+def publish_parcel_events(session, messages):
+    if messages:
+        broker.stage(session, messages)
+
+
+@event.listens_for(Session, 'after_commit')
+def deliver_pending(session):
+    messages = session.info.pop(PENDING_KEY, None)
+    if messages:
+        broker.deliver(messages)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_pending(session):
+    session.info.pop(PENDING_KEY, None)
+
+
+def replay_events(user_id, after_id, limit, session=None):
+    # Returns (messages, complete), the user's events after after_id, oldest first
+    query = (
+        select(ParcelEvent.id, Parcel.user_id, ParcelEvent.parcel_id, Parcel.tracking_number, ParcelEvent.status,
+               ParcelEvent.previous_status, ParcelEvent.occurred_at, ParcelEvent.city)
+        .join(Parcel, Parcel.id == ParcelEvent.parcel_id)
+        .where(Parcel.user_id == user_id, ParcelEvent.id > after_id)
+        .order_by(ParcelEvent.id)
+        .limit(limit + 1)
+    )
+    window = app.config['SSE_REPLAY_WINDOW_SECONDS']
+    if window:
+        # Keeps the scan to the recent parcel_events partitions
+        query = query.where(ParcelEvent.occurred_at >= utc_now() - timedelta(seconds=window))
+    rows = (session or db.session).execute(query).all()
+    return [event_message(*row) for row in rows[:limit]], len(rows) <= limit
+
+
+RESYNC_FRAME = "event: resync\ndata: {}\n\n"
+HEARTBEAT_FRAME = ": heartbeat\n\n"
+
+
+def _format(message, dumps):
+    data = dict(message)
+    data.pop('user_id', None)
+    return f"id: {message['id']}\nevent: parcel\ndata: {dumps(data)}\n\n"
+
+
+class StreamCursor:
+    # Where a stream is, shared by the sync stream below and the async one in asgi.py which fetch and wait
+    # their own way. catch_up means the next frames come from replay_events() after last_id
+    def __init__(self, last_event_id, dumps):
+        self.last_id = last_event_id
+        self.dumps = dumps
+        self.replayed = set()
+        self.catch_up = last_event_id is not None
+
+    def replayed_frames(self, messages, complete):
+        # messages is None when there is no last_id to catch up from, the client reloads its parcels instead
+        self.catch_up = False
+        if messages is None:
+            return [RESYNC_FRAME]
+        self.replayed = {message['id'] for message in messages}
+        frames = []
+        for message in messages:
+            frames.append(_format(message, self.dumps))
+            self.last_id = max(self.last_id, message['id'])
+        if not complete:
+            frames.append(RESYNC_FRAME)
+        return frames
+
+    def live_frames(self, messages, overflowed):
+        if overflowed:
+            self.catch_up = True
+            return []
+        if not messages:
+            return [HEARTBEAT_FRAME]
+        frames = []
+        for message in messages:
+            # Commit order isn't id order, so only skip what the last replay already sent
+            if message['id'] in self.replayed:
+                continue
+            frames.append(_format(message, self.dumps))
+            self.last_id = message['id'] if self.last_id is None else max(self.last_id, message['id'])
+        return frames
+
+
+def event_stream(user_id, last_event_id=None, dumps=json.dumps):
+    # Yields SSE frames until the client goes away. Each open stream holds the thread serving it, asgi.py
+    # serves the same stream on the event loop instead
+    config = app.config
+    subscription = broker.subscribe(user_id)
+    cursor = StreamCursor(last_event_id, dumps)
+    try:
+        yield f"retry: {config['SSE_RETRY_MS']}\n\n"
+        while True:
+            if cursor.catch_up:
+                if cursor.last_id is None:
+                    yield from cursor.replayed_frames(None, True)
+                else:
+                    yield from cursor.replayed_frames(*replay_events(user_id, cursor.last_id, config['SSE_REPLAY_LIMIT']))
+
+            # Give the connection back before waiting, idle streams don't hold one
+            db.session.remove()
+            yield from cursor.live_frames(*subscription.wait(config['SSE_HEARTBEAT_SECONDS']))
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,61 @@
+# /server/principal.py
+
+# The authenticated user's id and role names, resolved at most once per request.
+# Within a request the principal is kept on flask.g, across requests it is kept in a short-TTL
+# per-process cache so check_if_logged_in, the handlers and admin_required don't each query
+# the users/roles tables again. Anything that changes a user or a role must call invalidate_principal().
+
+from collections import namedtuple
+
+from flask import g, session, current_app
+
+from cache import TTLCache
+from config import db
+from models import User, Role, roles_users
+
+Principal = namedtuple('Principal', ['id', 'role_names'])
+Principal.is_admin = property(lambda self: 'admin' in self.role_names)
+
+principal_cache = TTLCache(maxsize=10_000)
+
+
+def _fetch_principal(user_id, session=None):
+    # One round trip for the user and all of their role names
+    rows = (
+        (session or db.session).query(User.id, Role.name)
+        .outerjoin(roles_users, roles_users.c.user_id == User.id)
+        .outerjoin(Role, Role.id == roles_users.c.role_id)
+        .filter(User.id == user_id)
+        .all()
+    )
+    if not rows:
+        return None
+    return Principal(id=rows[0][0], role_names=frozenset(name for _, name in rows if name is not None))
+
+
+def load_principal():
+    if 'principal' in g:
+        return g.principal
+
+    principal = None
+    user_id = session.get('user_id')
+    if user_id:
+        user_id = int(user_id)
+        principal = principal_cache.get(user_id)
+        if principal is None:
+            principal = _fetch_principal(user_id)
+            ttl = current_app.config.get('PRINCIPAL_CACHE_TTL', 10)
+            if principal is not None and ttl:
+                principal_cache.set(user_id, principal, ttl=ttl)
+
+    g.principal = principal
+    return principal
+
+
+def invalidate_principal(user_id=None):
+    # No user id means a role itself changed, which can affect any cached user
+    if user_id is None:
+        principal_cache.clear()
+    else:
+        principal_cache.delete(int(user_id))
+    g.pop('principal', None)
@@ -0,0 +1,208 @@
+# /server/quotes.py
+
+# Parcel price quoting.
+# cost = (zone base fee + zone rate per kg * chargeable weight) * (1 + fuel surcharge), never below the
+# minimum charge, where the chargeable weight is the larger of the actual and the volumetric weight
+# (L x W x H in cm / divisor) and the zone comes from the origin-destination distance.
+# The rate table is loaded once (RATE_TABLE_PATH, or the defaults below) and kept as NumPy arrays so
+# a whole batch of shipments is priced in a single vectorized pass.
+
+import json
+from decimal import Decimal
+
+import numpy as np
+from sqlalchemy import select
+
+from config import app, db
+from geo import haversine_pairwise_km
+from models import User, Recipient
+
+DEFAULT_RATE_TABLE = {
+    "currency": "KES",
+    "volumetric_divisor": 5000,  # cm3 per kg
+    "fuel_surcharge": 0.08,
+    "minimum_charge": 150,
+    "zones": [
+        {"name": "local", "max_km": 10, "base": 150, "per_kg": 20},
+        {"name": "metro", "max_km": 50, "base": 250, "per_kg": 35},
+        {"name": "regional", "max_km": 200, "base": 400, "per_kg": 50},
+        {"name": "national", "max_km": 800, "base": 650, "per_kg": 80},
+        {"name": "long_haul", "max_km": None, "base": 1000, "per_kg": 120},
+    ],
+}
+
+DIMENSION_FIELDS = ('length', 'width', 'height', 'weight')
+COORDINATE_FIELDS = ('origin_lat', 'origin_lng', 'destination_lat', 'destination_lng')
+
+
+class RateTable:
+    def __init__(self, table):
+        zones = table['zones']
+        self.currency = table.get('currency')
+        self.zone_names = np.array([zone['name'] for zone in zones])
+        # Upper distance bound of every zone but the last, searchsorted maps a distance to its zone index
+        self.zone_limits = np.array([zone['max_km'] for zone in zones[:-1]], dtype=np.float64)
+        self.base = np.array([zone['base'] for zone in zones], dtype=np.float64)
+        self.per_kg = np.array([zone['per_kg'] for zone in zones], dtype=np.float64)
+        self.volumetric_divisor = float(table['volumetric_divisor'])
+        self.fuel_multiplier = 1.0 + float(table.get('fuel_surcharge', 0))
+        self.minimum_charge = float(table.get('minimum_charge', 0))
+
+    @classmethod
+    def load(cls, path=None):
+        if not path:
+            return cls(DEFAULT_RATE_TABLE)
+        with open(path) as rate_file:
+            return cls(json.load(rate_file))
+
+    def quote(self, length, width, height, weight, distance_km):
+        # All arguments are equal-length float arrays, returns arrays
+        volumetric_weight = length * width * height / self.volumetric_divisor
+        chargeable_weight = np.maximum(weight, volumetric_weight)
+        zone = np.searchsorted(self.zone_limits, distance_km, side='left')
+        cost = (self.base[zone] + self.per_kg[zone] * chargeable_weight) * self.fuel_multiplier
+        cost = np.round(np.maximum(cost, self.minimum_charge), 2)
+        return {
+            "cost": cost,
+            "chargeable_weight": np.round(chargeable_weight, 2),
+            "zone": self.zone_names[zone],
+            "distance_km": np.round(distance_km, 3),
+        }
+
+
+def _number(value):
+    if value is None or isinstance(value, bool):
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _column(values):
+    # (floats, malformed): missing values become NaN, malformed marks the values that were given but aren't
+    # numbers (NaN too). The whole column is converted in C, only a column holding booleans (NumPy would take
+    # them as 1 and 0), lists (every row's list of the same length makes a 2-D array) or something unparseable
+    # falls back to converting value by value
+    if bool not in set(map(type, values)):
+        try:
+            column = np.array(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            column = None
+        if column is not None and column.ndim == 1:
+            return column, np.zeros(len(values), dtype=bool)
+    column = np.fromiter((_number(value) for value in values), dtype=np.float64, count=len(values))
+    given = np.fromiter((value is not None for value in values), dtype=bool, count=len(values))
+    return column, given & np.isnan(column)
+
+
+def parse_shipments(rows):
+    # Splits request rows into column arrays for quote() plus per-row errors, validation is vectorized.
+    # A row gives either distance_km or origin_lat/origin_lng/destination_lat/destination_lng
+    objects = [row if isinstance(row, dict) else {} for row in rows]
+    arrays, malformed = {}, {}
+    for field in DIMENSION_FIELDS + ('distance_km',) + COORDINATE_FIELDS:
+        arrays[field], malformed[field] = _column([row.get(field) for row in objects])
+
+    # NaN compares false, so missing dimensions are caught by the >= 0 check; distance_km and the coordinates
+    # may be missing but not malformed
+    invalid = {field: ~(arrays[field] >= 0) | np.isinf(arrays[field]) for field in DIMENSION_FIELDS}
+    distance = arrays['distance_km']
+    invalid['distance_km'] = (distance < 0) | np.isinf(distance) | malformed['distance_km']
+    for field in COORDINATE_FIELDS:
+        invalid[field] = malformed[field]
+    no_coordinates = np.zeros(len(objects), dtype=bool)
+    for field in COORDINATE_FIELDS:
+        no_coordinates |= ~np.isfinite(arrays[field])
+    no_distance = np.isnan(arrays['distance_km']) & no_coordinates
+
+    rejected = no_distance.copy()
+    for mask in invalid.values():
+        rejected |= mask
+
+    errors = []
+    for index in np.flatnonzero(rejected).tolist():
+        if not isinstance(rows[index], dict):
+            errors.append({"index": index, "errors": {"row": "must be a JSON object"}})
+            continue
+        row_errors = {
+            field: "must be a number" if field in COORDINATE_FIELDS else "must be a non-negative number"
+            for field, mask in invalid.items() if mask[index]
+        }
+        if no_distance[index] and 'distance_km' not in row_errors:
+            row_errors['distance_km'] = "give distance_km or origin/destination coordinates"
+        errors.append({"index": index, "errors": row_errors})
+
+    accepted = np.flatnonzero(~rejected)
+    if errors:
+        arrays = {field: column[accepted] for field, column in arrays.items()}
+    return accepted.tolist(), arrays, errors
+
+
+def quote_shipments(table, arrays):
+    distance = arrays['distance_km']
+    missing = np.isnan(distance)
+    if missing.any():
+        distance = distance.copy()
+        distance[missing] = haversine_pairwise_km(
+            arrays['origin_lat'][missing], arrays['origin_lng'][missing],
+            arrays['destination_lat'][missing], arrays['destination_lng'][missing]
+        )
+    return table.quote(arrays['length'], arrays['width'], arrays['height'], arrays['weight'], distance)
+
+
+def quote_batch(table, rows):
+    indexes, arrays, errors = parse_shipments(rows)
+    if not indexes:
+        return [], errors
+    result = quote_shipments(table, arrays)
+    costs = result['cost'].tolist()
+    weights = result['chargeable_weight'].tolist()
+    zones = result['zone'].tolist()
+    distances = result['distance_km'].tolist()
+    quotes = [
+        {"index": index, "cost": cost, "chargeable_weight": weight, "zone": zone, "distance_km": distance}
+        for index, cost, weight, zone, distance in zip(indexes, costs, weights, zones, distances)
+    ]
+    return quotes, errors
+
+
+def fill_parcel_costs(table, user_id, rows):
+    # Prices new parcels that came without a cost, in place. The route runs from the sender's
+    # coordinates to the recipient's; parcels whose endpoints have no coordinates keep cost=None
+    pending = [values for values in rows if values.get('cost') is None]
+    if not pending:
+        return
+    origin = db.session.execute(select(User.latitude, User.longitude).where(User.id == user_id)).first()
+    if origin is None or origin.latitude is None or origin.longitude is None:
+        return
+    recipient_ids = {values['recipient_id'] for values in pending}
+    destinations = {
+        row.id: (row.latitude, row.longitude)
+        for row in db.session.execute(
+            select(Recipient.id, Recipient.latitude, Recipient.longitude).where(Recipient.id.in_(recipient_ids))
+        )
+        if row.latitude is not None and row.longitude is not None
+    }
+    pending = [values for values in pending if values['recipient_id'] in destinations]
+    if not pending:
+        return
+
+    def column(read):
+        return np.fromiter((float(read(values)) for values in pending), dtype=np.float64, count=len(pending))
+
+    distance_km = haversine_pairwise_km(
+        float(origin.latitude), float(origin.longitude),
+        column(lambda values: destinations[values['recipient_id']][0]),
+        column(lambda values: destinations[values['recipient_id']][1])
+    )
+    result = table.quote(
+        column(lambda values: values['length']), column(lambda values: values['width']),
+        column(lambda values: values['height']), column(lambda values: values['weight']), distance_km
+    )
+    for values, cost in zip(pending, result['cost'].tolist()):
+        # Numeric(10, 2), a price that doesn't fit stays unset rather than failing the insert
+        values['cost'] = Decimal(f"{cost:.2f}") if cost < 10 ** 8 else None
+
+
+rate_table = RateTable.load(app.config['RATE_TABLE_PATH'])
@@ -0,0 +1,213 @@
+# /server/recipient_import.py
+
+# Streaming recipient import from CSV or NDJSON address books.
+# Rows are read one at a time off the upload (or file), normalized (see contacts.py) and validated, then
+# written in batches: one indexed lookup of the batch's dedupe keys skips contacts the importing user already
+# has (or that appeared earlier in the same import), the rest go in with a single executemany INSERT, and each
+# batch is committed so memory stays flat and progress is durable. Imported contacts belong to the importing
+# user (user_id), the CLI imports shared contacts without one.
+
+import csv
+import io
+import json
+import re
+import time
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import insert, select, update
+
+from config import db
+from contacts import normalize_text, normalize_email, normalize_zip_code, recipient_dedupe_key
+from models import Recipient
+
+CSV_MIMETYPES = ('text/csv', 'application/csv')
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+EMAIL_PATTERN = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+MAX_REPORTED_ERRORS = 1000
+
+TEXT_FIELDS = {
+    # field: (normalizer, max length, required)
+    'first_name': (normalize_text, 130, True),
+    'last_name': (normalize_text, 130, True),
+    'email': (normalize_email, 130, True),
+    'phone_number': (normalize_text, 50, False),
+    'street': (normalize_text, None, False),
+    'city': (normalize_text, None, False),
+    'state': (normalize_text, None, False),
+    'zip_code': (normalize_zip_code, 20, False),
+    'country': (normalize_text, 100, False),
+}
+COORDINATE_RANGES = {'latitude': 90, 'longitude': 180}
+
+
+def import_format(mimetype, filename=None):
+    if mimetype in CSV_MIMETYPES or (filename or '').lower().endswith('.csv'):
+        return 'csv'
+    if mimetype in NDJSON_MIMETYPES or (filename or '').lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return None
+
+
+def iter_import_rows(stream, format):
+    # Yields (index, row). stream is a binary file-like object read incrementally
+    if format == 'csv':
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        reader = csv.DictReader(text)
+        index = 0
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except UnicodeDecodeError:
+                # The rest of the stream can't be decoded either
+                yield index, None
+                return
+            except csv.Error:
+                row = None
+            yield index, row
+            index += 1
+    else:
+        index = 0
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield index, json.loads(line)
+            except (ValueError, UnicodeDecodeError):
+                yield index, None
+            index += 1
+
+
+def normalize_recipient_row(row):
+    # Returns (values, errors), values is None when the row is rejected
+    if not isinstance(row, dict):
+        return None, {"row": "must be a JSON object or a CSV record"}
+    # CSV headers like "First Name" or "ZIP code"
+    row = {str(key).strip().lower().replace(' ', '_'): value for key, value in row.items() if key}
+
+    values, errors = {}, {}
+    for field, (normalize, max_length, required) in TEXT_FIELDS.items():
+        value = row.get(field)
+        value = normalize(value) if value is not None and not isinstance(value, (dict, list)) else None
+        if value is None and required:
+            errors[field] = "is required"
+        elif value is not None and max_length and len(value) > max_length:
+            errors[field] = f"must be at most {max_length} characters"
+        values[field] = value
+    if values['email'] and not EMAIL_PATTERN.fullmatch(values['email']):
+        errors['email'] = "Invalid email format"
+
+    for field, limit in COORDINATE_RANGES.items():
+        value = row.get(field)
+        if value in (None, ''):
+            values[field] = None
+            continue
+        try:
+            number = Decimal(str(value))
+        except InvalidOperation:
+            number = None
+        if number is None or not number.is_finite() or abs(number) > limit:
+            errors[field] = f"must be a number between -{limit} and {limit}"
+        values[field] = number
+
+    if errors:
+        return None, errors
+    values['dedupe_key'] = recipient_dedupe_key(values)
+    return values, None
+
+
+class RecipientImport:
+    def __init__(self, max_rows, batch_size=1000, on_progress=None, user_id=None):
+        self.max_rows = max_rows
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.rows = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.errors = []
+        self.started = None
+
+    def _error(self, index, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"index": index, "errors": errors})
+
+    def run(self, rows):
+        self.started = time.perf_counter()
+        batch = []
+        for index, row in rows:
+            if index >= self.max_rows:
+                self._error(index, {"row": f"imports are limited to {self.max_rows} rows"})
+                break
+            self.rows += 1
+            values, errors = normalize_recipient_row(row)
+            if errors:
+                self._error(index, errors)
+                continue
+            batch.append(values)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+        return self.summary()
+
+    def _write(self, batch):
+        keys = {values['dedupe_key'] for values in batch}
+        # Earlier batches are committed, so the lookup also catches repeats within the same file
+        # Only the importing user's contacts, the counts mustn't tell whether someone else has a contact
+        seen = set(db.session.scalars(
+            select(Recipient.dedupe_key).where(Recipient.dedupe_key.in_(keys), Recipient.user_id == self.user_id)
+        ))
+        fresh = []
+        for values in batch:
+            if values['dedupe_key'] in seen:
+                self.duplicates += 1
+                continue
+            seen.add(values['dedupe_key'])
+            fresh.append(dict(values, user_id=self.user_id))
+        if fresh:
+            db.session.execute(insert(Recipient), fresh)
+        db.session.commit()
+        self.inserted += len(fresh)
+        if self.on_progress:
+            self.on_progress(self.summary())
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+            "seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows / elapsed) if elapsed > 0 else None,
+        }
+
+
+def backfill_dedupe_keys(batch_size=1000):
+    # Sets dedupe_key on recipients created before it existed, returns how many were updated
+    updated = 0
+    last_id = 0
+    columns = [Recipient.id, Recipient.version_id] + [getattr(Recipient, field) for field in TEXT_FIELDS]
+    while True:
+        rows = db.session.execute(
+            select(*columns).where(Recipient.id > last_id, Recipient.dedupe_key.is_(None))
+            .order_by(Recipient.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return updated
+        db.session.execute(
+            update(Recipient),
+            # version_id is checked and bumped like any ORM update, a recipient edited meanwhile raises StaleDataError
+            [{"id": row.id, "version_id": row.version_id, "dedupe_key": recipient_dedupe_key(dict(row._mapping))} for row in rows]
+        )
+        db.session.commit()
+        updated += len(rows)
+        last_id = rows[-1].id
@@ -0,0 +1,84 @@
+# /server/recipient_search.py
+
+# Recipient autocomplete.
+# On PostgreSQL the name, email and phone number (also as bare digits) are folded into one lowercase search
+# document with a pg_trgm GIN index on it (migration f3c8d2b6e1a4). Candidates come from that index via
+# word similarity (typos, partial words) or substring LIKE, and are ranked with field prefix matches
+# first, then by word similarity. Other databases get the same ranking over an unindexed LIKE scan.
+
+import re
+
+from sqlalchemy import case, func, literal, or_, select
+
+from config import db
+from models import Recipient
+
+RECIPIENT_SEARCH_MAX_LIMIT = 50
+# Trigrams need 3 characters, a shorter term can only be answered by scanning the whole table
+RECIPIENT_SEARCH_MIN_LENGTH = 3
+
+
+def _text(column):
+    return func.coalesce(column, '')
+
+
+def phone_digits(column):
+    return func.regexp_replace(_text(column), '[^0-9]', '', 'g')
+
+
+def search_document():
+    # Must stay identical to the indexed expression in the migration
+    return func.lower(
+        _text(Recipient.first_name) + ' ' + _text(Recipient.last_name) + ' ' + _text(Recipient.email)
+        + ' ' + _text(Recipient.phone_number) + ' ' + phone_digits(Recipient.phone_number)
+    )
+
+
+def search_recipients(query, limit=10, similarity_threshold=0.4):
+    term = query.strip().lower()
+    if not term:
+        return []
+    digits = re.sub(r'[^0-9]', '', term)
+    postgresql = db.engine.dialect.name == 'postgresql'
+
+    prefix_matches = [
+        func.lower(Recipient.first_name).startswith(term, autoescape=True),
+        func.lower(Recipient.last_name).startswith(term, autoescape=True),
+        func.lower(Recipient.email).startswith(term, autoescape=True),
+        (func.lower(Recipient.first_name) + ' ' + func.lower(Recipient.last_name)).startswith(term, autoescape=True),
+    ]
+    if len(digits) >= 3:
+        digit_column = phone_digits(Recipient.phone_number) if postgresql else Recipient.phone_number
+        prefix_matches.append(digit_column.startswith(digits, autoescape=True))
+    prefix_score = case((or_(*prefix_matches), 1.0), else_=0.0)
+
+    document = search_document() if postgresql else func.lower(
+        _text(Recipient.first_name) + ' ' + _text(Recipient.last_name) + ' ' + _text(Recipient.email) + ' ' + _text(Recipient.phone_number)
+    )
+    candidates = [document.contains(term, autoescape=True)]
+    if postgresql:
+        # Both predicates are answered by the trigram index, the threshold applies to this transaction only
+        db.session.execute(select(func.set_config('pg_trgm.word_similarity_threshold', str(similarity_threshold), True)))
+        candidates.append(literal(term).op('<%')(document))
+        score = prefix_score + func.word_similarity(term, document)
+    else:
+        score = prefix_score
+
+    statement = (
+        select(Recipient.id, Recipient.first_name, Recipient.last_name, Recipient.email, Recipient.phone_number,
+               score.label('score'))
+        .where(or_(*candidates))
+        .order_by(score.desc(), Recipient.last_name, Recipient.first_name, Recipient.id)
+        .limit(min(max(limit, 1), RECIPIENT_SEARCH_MAX_LIMIT))
+    )
+    return [
+        {
+            "id": row.id,
+            "first_name": row.first_name,
+            "last_name": row.last_name,
+            "email": row.email,
+            "phone_number": row.phone_number,
+            "score": round(float(row.score), 3),
+        }
+        for row in db.session.execute(statement)
+    ]
@@ -0,0 +1,92 @@
+# /server/replicas.py
+
+# Read-replica routing and connection pool stats.
+# Replicas are Flask-SQLAlchemy binds named replica_<n> (DATABASE_REPLICA_URIS). Views wrapped in
+# @read_replica send their SELECTs to one replica per session, everything else stays on the primary:
+# writes, anything after the request's first write, and every request for DB_READ_YOUR_WRITES_SECONDS
+# after the same client last wrote (tracked in its session cookie), so users see their own changes.
+
+import functools
+import random
+import time
+
+from flask import current_app, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_BIND_PREFIX = 'replica_'
+LAST_WRITE_KEY = 'db_last_write_at'
+
+
+def replica_binds(uris, engine_options):
+    # SQLALCHEMY_ENGINE_OPTIONS only covers the primary, each bind carries its own copy
+    return {f'{REPLICA_BIND_PREFIX}{index}': dict(engine_options, url=uri) for index, uri in enumerate(uris)}
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if isinstance(clause, UpdateBase):
+            # insert()/update()/delete() run through session.execute, flushes are caught by after_flush
+            self.info['wrote'] = True
+        elif bind is None and self.info.get('use_replica') and not self.info.get('wrote') and not self._flushing \
+                and (clause is None or isinstance(clause, Select)) and not (self.new or self.dirty or self.deleted):
+            replica = self._replica_engine()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica_engine(self):
+        # Sticks to one replica for the whole session so reads in a request see one snapshot
+        engines = self._db.engines
+        if 'replica' not in self.info:
+            keys = [key for key in engines if key and key.startswith(REPLICA_BIND_PREFIX)]
+            self.info['replica'] = random.choice(keys) if keys else None
+        return engines.get(self.info['replica']) if self.info['replica'] else None
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def mark_flush_write(session, flush_context):
+    session.info['wrote'] = True
+
+
+def read_replica(f):
+    # Lets the view's reads go to a replica, unless this client wrote recently
+    @functools.wraps(f)
+    def decorated_function(*args, **kwargs):
+        db = current_app.extensions['sqlalchemy']
+        window = current_app.config['DB_READ_YOUR_WRITES_SECONDS']
+        if current_app.config['SQLALCHEMY_BINDS'] and time.time() - session.get(LAST_WRITE_KEY, 0) > window:
+            db.session.info['use_replica'] = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def init_replicas(app, db):
+    @app.before_request
+    def reset_replica_routing():
+        for key in ('use_replica', 'wrote', 'replica'):
+            db.session.info.pop(key, None)
+
+    @app.after_request
+    def remember_write(response):
+        if app.config['SQLALCHEMY_BINDS'] and db.session.info.get('wrote'):
+            session[LAST_WRITE_KEY] = time.time()
+        return response
+
+
+def pool_stats(db):
+    stats = {}
+    for key, engine in db.engines.items():
+        pool = engine.pool
+        entry = {
+            "url": engine.url.render_as_string(hide_password=True),
+            "pool": type(pool).__name__,
+            "status": pool.status(),
+        }
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            if hasattr(pool, name):
+                entry[name] = getattr(pool, name)()
+        stats[key or 'primary'] = entry
+    return stats
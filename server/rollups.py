@@ -0,0 +1,319 @@
+# /server/rollups.py
+
+# Admin dashboard rollups.
+# parcel_daily_stats keeps parcel counts and revenue per (creation day, city, current status) and
+# user_daily_activity the users who created parcels each day. The city is the parcel's own, or its recipient's
+# when it has none (the tracking page's destination city), so a recipient moving to another city moves their
+# parcels too. The changes are collected while the parcels are written (ORM changes through a before_flush
+# hook, Core bulk inserts by calling record_new_parcels) and applied with upserts in a short transaction of
+# their own once the parcel write has committed, rows in key order.
+# The hot rollup rows are then only locked for that one statement instead of for the whole request, which
+# kept concurrent parcel writes queueing (and deadlocking) on them. A rolled back write applies nothing. Deltas
+# that fail to apply after the commit are kept and retried with the next commit, the dashboard reports them as
+# stale meanwhile; a process exiting with some left loses them until `flask rollups-reconcile`, which rebuilds
+# both tables from the parcels table. The dashboard aggregates a few rows per day instead of scanning parcels.
+
+import logging
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import Date, cast, delete, distinct, event, func, inspect, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from config import db
+from models import Parcel, ParcelDailyStats, Recipient, UserDailyActivity
+
+logger = logging.getLogger('rollups')
+
+UNKNOWN_CITY = ''
+PENDING_KEY = 'rollup_deltas_pending'
+
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+
+def rollup_day(created_at):
+    if created_at is None:
+        return utc_now().date()
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc)
+    return created_at.date()
+
+
+class RollupDeltas:
+    def __init__(self):
+        self.stats = defaultdict(lambda: [0, Decimal(0)])
+        self.activity = set()
+        self.engine = None  # Set when staged on a session
+
+    def add(self, day, city, status, cost, sign=1, count=1):
+        # cost is the total of the count parcels
+        bucket = self.stats[(day, city or UNKNOWN_CITY, status or '')]
+        bucket[0] += sign * count
+        bucket[1] += sign * Decimal(cost or 0)
+
+    def merge(self, other):
+        for key, (count, revenue) in other.stats.items():
+            bucket = self.stats[key]
+            bucket[0] += count
+            bucket[1] += revenue
+        self.activity |= other.activity
+
+    def __bool__(self):
+        return bool(self.activity) or any(count or revenue for count, revenue in self.stats.values())
+
+
+def _upsert(connection, table, rows, key_columns, increments=()):
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(table)
+    if increments:
+        statement = statement.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={column: table.c[column] + statement.excluded[column] for column in increments}
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=key_columns)
+    connection.execute(statement, rows)
+
+
+def apply_deltas(connection, deltas):
+    # Rows in key order, so concurrent upserts lock them in the same order and can't deadlock
+    stats = [
+        {"day": day, "city": city, "status": status, "parcel_count": count, "revenue": revenue}
+        for (day, city, status), (count, revenue) in sorted(deltas.stats.items())
+        if count or revenue
+    ]
+    if stats:
+        _upsert(connection, ParcelDailyStats.__table__, stats, ['day', 'city', 'status'], ('parcel_count', 'revenue'))
+    if deltas.activity:
+        activity = [{"day": day, "user_id": user_id} for day, user_id in sorted(deltas.activity)]
+        _upsert(connection, UserDailyActivity.__table__, activity, ['day', 'user_id'])
+
+
+def stage_deltas(session, deltas):
+    # Held on the session until its transaction commits, merged across flushes
+    if not deltas:
+        return
+    pending = session.info.get(PENDING_KEY)
+    if pending is None:
+        # The engine the parcels are written to, the session can't run SQL once it has committed
+        pending = session.info[PENDING_KEY] = RollupDeltas()
+        pending.engine = session.connection().engine
+    pending.merge(deltas)
+
+
+def _recipient_cities(session, recipient_ids):
+    # Stored city per recipient id, for parcels without a city of their own
+    recipient_ids = {recipient_id for recipient_id in recipient_ids if recipient_id is not None}
+    if not recipient_ids:
+        return {}
+    with session.no_autoflush:
+        return dict(session.execute(select(Recipient.id, Recipient.city).where(Recipient.id.in_(recipient_ids))).all())
+
+
+def record_new_parcels(session, rows):
+    # For parcels inserted outside the ORM, rows carry created_at, user_id, recipient_id, city, status and cost
+    deltas = RollupDeltas()
+    cities = _recipient_cities(session, [row.get('recipient_id') for row in rows if not row.get('city')])
+    for row in rows:
+        day = rollup_day(row.get('created_at'))
+        deltas.add(day, row.get('city') or cities.get(row.get('recipient_id')), row.get('status'), row.get('cost'))
+        if row.get('user_id') is not None:
+            deltas.activity.add((day, row['user_id']))
+    stage_deltas(session, deltas)
+
+
+# Deltas whose parcels committed but that couldn't be applied, retried with the next commit
+unapplied = RollupDeltas()
+unapplied_lock = threading.Lock()
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_pending_deltas(session):
+    deltas = session.info.pop(PENDING_KEY, None)
+    if deltas is None and not unapplied:
+        return
+    deltas = deltas or RollupDeltas()
+    with unapplied_lock:
+        if unapplied:
+            deltas.merge(unapplied)
+            deltas.engine = deltas.engine or unapplied.engine
+            unapplied.stats.clear()
+            unapplied.activity.clear()
+    if not deltas:
+        return
+    try:
+        # All or nothing, so a failed attempt can be repeated as a whole
+        with deltas.engine.begin() as connection:
+            apply_deltas(connection, deltas)
+    except Exception:
+        logger.exception("Couldn't apply dashboard rollups, retrying with the next commit "
+                         "(`flask rollups-reconcile` rebuilds them if this process exits first)")
+        with unapplied_lock:
+            unapplied.merge(deltas)
+            unapplied.engine = deltas.engine
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_pending_deltas(session):
+    session.info.pop(PENDING_KEY, None)
+
+
+def _previous(parcel, attribute):
+    history = inspect(parcel).attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return getattr(parcel, attribute)
+
+
+def _stored_day(value):
+    # SQLite's date() gives a string
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_parcel_deltas(session, flush_context, instances):
+    new = [parcel for parcel in session.new if isinstance(parcel, Parcel)]
+    changed = [parcel for parcel in session.dirty if isinstance(parcel, Parcel) and session.is_modified(parcel)]
+    deleted = [parcel for parcel in session.deleted if isinstance(parcel, Parcel)]
+    moved = [
+        recipient for recipient in session.dirty
+        if isinstance(recipient, Recipient) and inspect(recipient).attrs.city.history.has_changes()
+    ]
+    if not (new or changed or deleted or moved):
+        return
+
+    # Recipient cities as stored (the previous ones) and as they will be after this flush
+    stored = _recipient_cities(session, [parcel.recipient_id for parcel in new + changed]
+                               + [_previous(parcel, 'recipient_id') for parcel in changed + deleted]
+                               + [recipient.id for recipient in moved])
+    current = {**stored, **{recipient.id: recipient.city for recipient in moved}}
+
+    def current_city(parcel):
+        if parcel.city:
+            return parcel.city
+        recipient = parcel.__dict__.get('recipient')
+        # A recipient added in the same flush has no id yet
+        return recipient.city if recipient is not None else current.get(parcel.recipient_id)
+
+    def previous_city(parcel):
+        return _previous(parcel, 'city') or stored.get(_previous(parcel, 'recipient_id'))
+
+    deltas = RollupDeltas()
+    for parcel in new:
+        # Stamped here so the stored created_at and the rollup day agree
+        if parcel.created_at is None:
+            parcel.created_at = utc_now()
+        day = rollup_day(parcel.created_at)
+        deltas.add(day, current_city(parcel), parcel.status or Parcel.__table__.c.status.default.arg, parcel.cost)
+        if parcel.user_id is not None:
+            deltas.activity.add((day, parcel.user_id))
+
+    for parcel in changed:
+        previous = (previous_city(parcel) or UNKNOWN_CITY, _previous(parcel, 'status'), _previous(parcel, 'cost'))
+        current = (current_city(parcel) or UNKNOWN_CITY, parcel.status, parcel.cost)
+        if previous != current:
+            day = rollup_day(parcel.created_at)
+            deltas.add(day, *previous, sign=-1)
+            deltas.add(day, *current)
+
+    for parcel in deleted:
+        deltas.add(rollup_day(parcel.created_at), previous_city(parcel), _previous(parcel, 'status'), _previous(parcel, 'cost'), sign=-1)
+
+    # Stored parcels that take their city from a moved recipient, in one aggregate per recipient
+    handled = [parcel.id for parcel in changed + deleted]
+    day = _day_expression(Parcel.created_at)
+    for recipient in moved:
+        if (stored.get(recipient.id) or UNKNOWN_CITY) == (recipient.city or UNKNOWN_CITY):
+            continue
+        query = (
+            select(day, Parcel.status, func.count(), func.sum(Parcel.cost))
+            .where(Parcel.recipient_id == recipient.id, func.coalesce(Parcel.city, '') == '')
+            .group_by(day, Parcel.status)
+        )
+        if handled:
+            query = query.where(Parcel.id.notin_(handled))
+        with session.no_autoflush:
+            groups = session.execute(query).all()
+        for parcel_day, status, count, cost in groups:
+            deltas.add(_stored_day(parcel_day), stored.get(recipient.id), status, cost, sign=-1, count=count)
+            deltas.add(_stored_day(parcel_day), recipient.city, status, cost, count=count)
+
+    stage_deltas(session, deltas)
+
+
+def _day_expression(column):
+    if db.engine.dialect.name == 'postgresql':
+        return cast(func.timezone('UTC', column), Date)
+    return func.date(column)
+
+
+def reconcile_rollups():
+    # Rebuilds both rollup tables from parcels in one transaction
+    day = _day_expression(Parcel.created_at)
+    city = func.coalesce(func.nullif(Parcel.city, ''), Recipient.city, UNKNOWN_CITY)
+    status = func.coalesce(Parcel.status, '')
+    with unapplied_lock:
+        # Rebuilt from the parcels, which already include them
+        unapplied.stats.clear()
+        unapplied.activity.clear()
+    db.session.execute(delete(ParcelDailyStats))
+    db.session.execute(delete(UserDailyActivity))
+    db.session.execute(
+        insert(ParcelDailyStats).from_select(
+            ['day', 'city', 'status', 'parcel_count', 'revenue'],
+            select(day, city, status, func.count(), func.coalesce(func.sum(Parcel.cost), 0))
+            .outerjoin(Recipient, Parcel.recipient_id == Recipient.id)
+            .group_by(day, city, status)
+        )
+    )
+    db.session.execute(
+        insert(UserDailyActivity).from_select(
+            ['day', 'user_id'],
+            select(day, Parcel.user_id).where(Parcel.user_id.isnot(None)).distinct()
+        )
+    )
+    db.session.commit()
+    return db.session.scalar(select(func.count()).select_from(ParcelDailyStats))
+
+
+def dashboard_metrics(start, end):
+    # start/end are inclusive dates
+    in_range = ParcelDailyStats.day.between(start, end)
+    by_status = db.session.execute(
+        select(ParcelDailyStats.status, func.sum(ParcelDailyStats.parcel_count))
+        .where(in_range).group_by(ParcelDailyStats.status)
+    ).all()
+    by_day = db.session.execute(
+        select(ParcelDailyStats.day, func.sum(ParcelDailyStats.parcel_count), func.sum(ParcelDailyStats.revenue))
+        .where(in_range).group_by(ParcelDailyStats.day).order_by(ParcelDailyStats.day)
+    ).all()
+    by_city = db.session.execute(
+        select(ParcelDailyStats.city, func.sum(ParcelDailyStats.parcel_count).label('parcels'))
+        .where(in_range).group_by(ParcelDailyStats.city).order_by(func.sum(ParcelDailyStats.parcel_count).desc())
+    ).all()
+    active_users = db.session.scalar(
+        select(func.count(distinct(UserDailyActivity.user_id))).where(UserDailyActivity.day.between(start, end))
+    )
+
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "parcels_by_status": {status: int(count) for status, count in by_status if count},
+        "parcels_by_day": [
+            {"day": day.isoformat(), "parcels": int(count), "revenue": Decimal(str(revenue or 0))}
+            for day, count, revenue in by_day
+        ],
+        "parcels_by_city": [{"city": city or None, "parcels": int(count)} for city, count in by_city if count],
+        "parcels_total": sum(int(count) for _, count, _ in by_day),
+        "revenue_total": sum((Decimal(str(revenue or 0)) for _, _, revenue in by_day), Decimal(0)),
+        "active_users": active_users,
+        # This process holds deltas it couldn't apply yet, the numbers are behind
+        "stale": bool(unapplied),
+    }
@@ -0,0 +1,165 @@
+# /server/routing.py
+
+# Delivery route planning.
+# Stops are split between drivers with a sweep around the depot (sorted by bearing, cut into equal
+# slices starting at the widest angular gap), then every route is built with nearest-neighbor and
+# improved with 2-opt and Or-opt moves until no move helps or its share of the time budget runs out.
+# Distance matrices and move evaluation are vectorized with NumPy, one pass per tour position.
+# Routes are independent, so they can be optimized in a process pool.
+
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from geo import haversine_pairwise_km
+
+OR_OPT_SEGMENT_LENGTHS = (1, 2, 3)
+MIN_GAIN_KM = 1e-9
+
+
+def distance_matrix(latitudes, longitudes):
+    return haversine_pairwise_km(latitudes[:, None], longitudes[:, None], latitudes[None, :], longitudes[None, :])
+
+
+def sweep_clusters(depot_latitude, depot_longitude, latitudes, longitudes, clusters):
+    # Index arrays into the stops, one per driver
+    angles = np.arctan2(latitudes - depot_latitude, (longitudes - depot_longitude) * math.cos(math.radians(depot_latitude)))
+    order = np.argsort(angles, kind='stable')
+    if order.size > 1:
+        # Start the sweep after the widest gap so no slice straddles it
+        sorted_angles = angles[order]
+        gaps = np.diff(np.append(sorted_angles, sorted_angles[0] + 2 * math.pi))
+        order = np.roll(order, -(int(np.argmax(gaps)) + 1))
+    return [chunk for chunk in np.array_split(order, clusters) if chunk.size]
+
+
+def tour_length(matrix, tour):
+    return float(matrix[tour, np.roll(tour, -1)].sum())
+
+
+def nearest_neighbor_tour(matrix):
+    # Closed tour over every node starting at the depot (node 0)
+    size = len(matrix)
+    visited = np.zeros(size, dtype=bool)
+    visited[0] = True
+    tour = np.zeros(size, dtype=np.int64)
+    current = 0
+    for position in range(1, size):
+        current = int(np.argmin(np.where(visited, np.inf, matrix[current])))
+        visited[current] = True
+        tour[position] = current
+    return tour
+
+
+def two_opt(matrix, tour, deadline):
+    # Best-improvement 2-opt per position: for edge (a, b) every later edge (c, d) is scored at once
+    size = len(tour)
+    improved = False
+    if size < 4:
+        return tour, improved
+    for i in range(size - 2):
+        if time.perf_counter() > deadline:
+            break
+        a, b = tour[i], tour[i + 1]
+        c = tour[i + 2:]
+        d = np.append(tour[i + 3:], tour[0])
+        gain = matrix[a, b] + matrix[c, d] - matrix[a, c] - matrix[b, d]
+        best = int(np.argmax(gain))
+        if gain[best] > MIN_GAIN_KM:
+            j = best + i + 2
+            tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1]
+            improved = True
+    return tour, improved
+
+
+def or_opt(matrix, tour, deadline):
+    # Moves segments of 1-3 stops, forwards or reversed, to the cheapest edge elsewhere in the tour.
+    # The depot stays at position 0
+    improved = False
+    for length in OR_OPT_SEGMENT_LENGTHS:
+        start = 1
+        while start + length <= len(tour):
+            if time.perf_counter() > deadline:
+                return tour, improved
+            segment = tour[start:start + length]
+            previous, following = tour[start - 1], tour[(start + length) % len(tour)]
+            removal_gain = matrix[previous, segment[0]] + matrix[segment[-1], following] - matrix[previous, following]
+
+            rest = np.concatenate((tour[:start], tour[start + length:]))
+            c, d = rest, np.roll(rest, -1)
+            forward = matrix[c, segment[0]] + matrix[segment[-1], d] - matrix[c, d]
+            backward = matrix[c, segment[-1]] + matrix[segment[0], d] - matrix[c, d]
+            best_forward, best_backward = int(np.argmin(forward)), int(np.argmin(backward))
+            if forward[best_forward] <= backward[best_backward]:
+                position, cost, moved = best_forward, forward[best_forward], segment
+            else:
+                position, cost, moved = best_backward, backward[best_backward], segment[::-1]
+
+            if removal_gain - cost > MIN_GAIN_KM:
+                tour = np.concatenate((rest[:position + 1], moved, rest[position + 1:]))
+                improved = True
+            start += 1
+    return tour, improved
+
+
+def optimize_route(latitudes, longitudes, time_budget):
+    # Node 0 is the depot. Returns (stop order as node indexes without the depot, initial km, final km)
+    deadline = time.perf_counter() + time_budget
+    matrix = distance_matrix(latitudes, longitudes)
+    tour = nearest_neighbor_tour(matrix)
+    initial = tour_length(matrix, tour)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        tour, improved_two_opt = two_opt(matrix, tour, deadline)
+        tour, improved_or_opt = or_opt(matrix, tour, deadline)
+        improved = improved_two_opt or improved_or_opt
+    return tour[1:], initial, tour_length(matrix, tour)
+
+
+def _optimize_cluster(arguments):
+    return optimize_route(*arguments)
+
+
+def plan_routes(depot, stop_ids, latitudes, longitudes, max_stops_per_route, drivers=None, time_budget=2.0, workers=0):
+    # depot is (latitude, longitude), stops come as parallel sequences
+    stop_ids = np.asarray(stop_ids)
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    if stop_ids.size == 0:
+        return {"routes": [], "distance_km": 0.0, "initial_distance_km": 0.0}
+
+    needed = math.ceil(stop_ids.size / max_stops_per_route)
+    if drivers is None:
+        drivers = needed
+    elif drivers < needed:
+        raise ValueError(f"{drivers} drivers cannot cover {stop_ids.size} stops at {max_stops_per_route} stops per route")
+
+    depot_latitude, depot_longitude = depot
+    clusters = sweep_clusters(depot_latitude, depot_longitude, latitudes, longitudes, min(drivers, stop_ids.size))
+    # Each route gets an equal share of the budget, a pool runs `workers` of them side by side
+    route_budget = time_budget * max(workers, 1) / len(clusters)
+    tasks = [
+        (np.append(depot_latitude, latitudes[cluster]), np.append(depot_longitude, longitudes[cluster]), route_budget)
+        for cluster in clusters
+    ]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_optimize_cluster, tasks))
+    else:
+        results = [_optimize_cluster(task) for task in tasks]
+
+    routes = []
+    for driver, (cluster, (order, initial, final)) in enumerate(zip(clusters, results), start=1):
+        routes.append({
+            "driver": driver,
+            "stops": stop_ids[cluster[order - 1]].tolist(),
+            "distance_km": round(final, 3),
+            "initial_distance_km": round(initial, 3),
+        })
+    return {
+        "routes": routes,
+        "distance_km": round(sum(route['distance_km'] for route in routes), 3),
+        "initial_distance_km": round(sum(route['initial_distance_km'] for route in routes), 3),
+    }
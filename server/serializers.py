@@ -0,0 +1,129 @@
+# /server/serializers.py
+
+# Compiled serializers for the models.
+# SerializerMixin.to_dict() rebuilds its rule tree and reflects over the mapper on every call.
+# Here the same serialize_rules are resolved once per model into a fixed field plan
+# (column keys + value converters, relationship keys + child plans) and rows are turned into
+# plain dicts by walking that plan. The output is the same as to_dict() so clients need no changes.
+
+from sqlalchemy import inspect as sql_inspect, Date, DateTime, Numeric, Time
+from sqlalchemy.orm import selectinload
+from sqlalchemy_serializer.lib.schema import Schema, Tree
+
+from config import app
+from models import User, Role, Recipient, Parcel, BillingAddress, EmailOutbox
+
+
+def _clone_tree(tree):
+    # The rule tree is mutated while rules are applied, so every plan works on its own copy
+    clone = Tree(to_include=tree.to_include, to_exclude=tree.to_exclude, is_greedy=tree.is_greedy)
+    for key, subtree in tree.items():
+        clone[key] = _clone_tree(subtree)
+    return clone
+
+
+def _converter(column, formats):
+    # Same formatting SerializerMixin applies, picked once from the column type instead of per value
+    column_type = column.type
+    if isinstance(column_type, Numeric) and column_type.asdecimal:
+        if formats.get('decimal_mode') == 'float':
+            return lambda value: None if value is None else float(value)
+        decimal_format = formats['decimal_format']
+        return lambda value: None if value is None else decimal_format.format(value)
+    if isinstance(column_type, DateTime):
+        datetime_format = formats['datetime_format']
+        return lambda value: None if value is None else value.strftime(datetime_format)
+    if isinstance(column_type, Date):
+        date_format = formats['date_format']
+        return lambda value: None if value is None else value.strftime(date_format)
+    if isinstance(column_type, Time):
+        time_format = formats['time_format']
+        return lambda value: None if value is None else value.strftime(time_format)
+    return None
+
+
+class ModelSerializer:
+    def __init__(self, model, tree=None, formats=None):
+        self.model = model
+        self.formats = formats or {
+            'date_format': model.date_format,
+            'datetime_format': model.datetime_format,
+            'time_format': model.time_format,
+            'decimal_format': model.decimal_format,
+            'decimal_mode': app.config['JSON_DECIMAL_MODE'],
+        }
+
+        schema = Schema(tree=_clone_tree(tree) if tree is not None else None)
+        schema.update(only=model.serialize_only, extend=model.serialize_rules)
+
+        mapper = sql_inspect(model)
+        keys = schema.keys
+        if schema.is_greedy:
+            keys.update(model.serializable_keys or {attr.key for attr in mapper.attrs})
+
+        self.columns = []
+        self.relationships = []
+        for key in sorted(keys):
+            if not schema.is_included(key):
+                continue
+            if key in mapper.relationships:
+                relationship = mapper.relationships[key]
+                subtree = _clone_tree(schema._tree[key])
+                self.relationships.append((key, relationship.uselist, relationship.mapper.class_, subtree))
+            elif key in mapper.columns:
+                self.columns.append((key, _converter(mapper.columns[key], self.formats)))
+            else:
+                self.columns.append((key, None))
+
+        # Child plans are resolved on first use and kept, rule trees can nest deeper than any real row does
+        self._children = {}
+
+    def child(self, key):
+        plan = self._children.get(key)
+        if plan is None:
+            for rel_key, _, target, subtree in self.relationships:
+                if rel_key == key:
+                    plan = ModelSerializer(target, tree=subtree, formats=self.formats)
+                    self._children[key] = plan
+                    break
+        return plan
+
+    def dump(self, obj):
+        data = {}
+        # Loaded column values sit in the instance dict, reading them there skips the attribute instrumentation
+        loaded = obj.__dict__
+        for key, convert in self.columns:
+            value = loaded[key] if key in loaded else getattr(obj, key)
+            data[key] = convert(value) if convert is not None else value
+        for key, uselist, _, _ in self.relationships:
+            value = getattr(obj, key)
+            plan = self.child(key)
+            if uselist:
+                data[key] = [plan.dump(item) for item in value]
+            else:
+                data[key] = None if value is None else plan.dump(value)
+        return data
+
+    def load_options(self, depth=None):
+        # selectinload() options that cover the relationships this plan will walk (depth levels of them, all by
+        # default), so a page of rows is serialized with a handful of IN queries instead of lazy loads per row
+        options = []
+        if depth is not None and depth < 1:
+            return options
+        for key, _, _, _ in self.relationships:
+            loader = selectinload(getattr(self.model, key))
+            nested = self.child(key).load_options(None if depth is None else depth - 1)
+            options.append(loader.options(*nested) if nested else loader)
+        return options
+
+
+# Plans for every model are compiled once at import time
+SERIALIZERS = {model: ModelSerializer(model) for model in (User, Role, Recipient, Parcel, BillingAddress, EmailOutbox)}
+
+
+def serializer_for(model):
+    return SERIALIZERS[model]
+
+
+def serialize(obj):
+    return SERIALIZERS[type(obj)].dump(obj)
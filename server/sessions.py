@@ -0,0 +1,291 @@
+# /server/sessions.py
+
+# Session cookies that work on any worker and any node.
+# Cookies are signed with a keyring shared by the whole cluster: SESSION_SIGNING_KEYS (comma separated) or
+# SESSION_SIGNING_KEYS_FILE (one per line, re-read when it changes), newest first. The newest key signs, the
+# older ones are still accepted, so rotating is: put a new key in front, wait out PERMANENT_SESSION_LIFETIME,
+# then drop the old one. `flask session-key` prints a fresh key. Without any configured key every process
+# makes up its own, which only works for a single process (local development).
+# SESSION_BACKEND=cookie keeps the session data in the signed cookie, as Flask does. With "memory" (one
+# process, for development and tests) or "redis" (SESSION_REDIS_URL, shared) the cookie only carries a signed
+# random session id and the data lives in the store: one GET per request, and sessions can be revoked, one at a
+# time (logout) or all of a user's at once. The session id is replaced whenever the signed-in user changes.
+
+import logging
+import os
+import secrets
+import threading
+import time
+
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from cache import TTLCache
+
+logger = logging.getLogger('sessions')
+
+
+class SigningKeyring:
+    def __init__(self, keys=None, path=None, reload_seconds=30):
+        self.configured = [key for key in keys or () if key]
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._file_keys = []
+        self._mtime = None
+        self._checked_at = 0
+        if path:
+            self._load_file()
+        if not self.configured and not self._file_keys:
+            logger.warning("No SESSION_SIGNING_KEYS configured, sessions are only valid in this process")
+            self.configured = [secrets.token_urlsafe(32)]
+
+    def _load_file(self):
+        mtime = os.stat(self.path).st_mtime
+        if mtime != self._mtime:
+            with open(self.path) as keys_file:
+                self._file_keys = [line.strip() for line in keys_file if line.strip() and not line.startswith('#')]
+            self._mtime = mtime
+
+    def keys(self):
+        # Newest first
+        if self.path and time.monotonic() - self._checked_at >= self.reload_seconds:
+            with self._lock:
+                self._checked_at = time.monotonic()
+                try:
+                    self._load_file()
+                except OSError as e:
+                    # Keep the keys we have, a rotation in progress shouldn't log everyone out
+                    logger.warning("Couldn't read %s: %s", self.path, e)
+        return self._file_keys or self.configured
+
+    @property
+    def current(self):
+        return self.keys()[0]
+
+
+class SignedSessionInterface(SecureCookieSessionInterface):
+    # Flask's cookie sessions, signed with the keyring instead of app.secret_key
+    backend = 'cookie'
+    store = None
+
+    def __init__(self, keyring):
+        self.keyring = keyring
+        self._serializer = None
+        self._serializer_keys = None
+
+    def get_signing_serializer(self, app):
+        # Rebuilt only when the keyring changed. itsdangerous signs with the last key of the list and
+        # verifies with any of them
+        keys = self.keyring.keys()
+        if keys is not self._serializer_keys:
+            self._serializer_keys = keys
+            self._serializer = URLSafeTimedSerializer(
+                list(reversed(keys)), salt=self.salt, serializer=self.serializer,
+                signer_kwargs={'key_derivation': self.key_derivation, 'digest_method': self.digest_method}
+            )
+        return self._serializer
+
+    def session_from_cookie(self, app, value):
+        # The session a cookie value stands for, empty when it is missing, forged or expired (also used by asgi.py)
+        if not value:
+            return self.session_class()
+        try:
+            data = self.get_signing_serializer(app).loads(value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            return self.session_class()
+        return self.session_class(data)
+
+    def open_session(self, app, request):
+        return self.session_from_cookie(app, request.cookies.get(self.get_cookie_name(app)))
+
+
+class StoredSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid
+        # Who the session belonged to when it was loaded, a change means a new session id
+        self.loaded_user_id = (initial or {}).get('user_id')
+
+
+class StoredSessionInterface(SignedSessionInterface):
+    session_class = StoredSession
+    salt = 'session-id'
+
+    def __init__(self, keyring, store, backend):
+        super().__init__(keyring)
+        self.store = store
+        self.backend = backend
+
+    def session_from_cookie(self, app, value):
+        if not value:
+            return self.session_class()
+        try:
+            sid = self.get_signing_serializer(app).loads(value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            return self.session_class()
+        data = self.store.get(sid)
+        if data is None:
+            # Revoked or expired
+            return self.session_class()
+        return self.session_class(data, sid=sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        cookie_options = {
+            'domain': self.get_cookie_domain(app),
+            'path': self.get_cookie_path(app),
+            'secure': self.get_cookie_secure(app),
+            'samesite': self.get_cookie_samesite(app),
+            'httponly': self.get_cookie_httponly(app),
+        }
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified:
+                if session.sid:
+                    self.store.delete(session.sid)
+                response.delete_cookie(name, **cookie_options)
+                response.vary.add('Cookie')
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        user_id = session.get('user_id')
+        if session.sid is None or user_id != session.loaded_user_id:
+            # A new id on sign in and sign out, so an id handed out before login is never worth anything after
+            if session.sid:
+                self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            session.loaded_user_id = user_id
+        self.store.set(session.sid, dict(session), int(app.permanent_session_lifetime.total_seconds()), user_id)
+
+        response.set_cookie(name, self.get_signing_serializer(app).dumps(session.sid),
+                            expires=self.get_expiration_time(app, session), **cookie_options)
+        response.vary.add('Cookie')
+
+
+class MemorySessionStore:
+    # In-process stand-in for a shared store: sessions are lost on restart and not visible to other workers
+    def __init__(self, maxsize=100_000):
+        self.sessions = TTLCache(maxsize=maxsize)
+        self.user_sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        data = self.sessions.get(sid)
+        return dict(data) if data is not None else None
+
+    def set(self, sid, data, ttl, user_id=None):
+        self.sessions.set(sid, dict(data), ttl=ttl)
+        if user_id is not None:
+            with self._lock:
+                self.user_sessions.setdefault(int(user_id), set()).add(sid)
+
+    def delete(self, sid):
+        self.sessions.delete(sid)
+
+    def revoke_user(self, user_id, keep=None):
+        with self._lock:
+            sids = self.user_sessions.pop(int(user_id), set())
+            if keep in sids:
+                self.user_sessions[int(user_id)] = {keep}
+        revoked = 0
+        for sid in sids - {keep}:
+            if self.sessions.get(sid) is not None:
+                revoked += 1
+            self.sessions.delete(sid)
+        return revoked
+
+    def stats(self):
+        return {"sessions": len(self.sessions), "users": len(self.user_sessions)}
+
+
+class RedisSessionStore:
+    def __init__(self, url, serializer, timeout=0.5):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout)
+        self.serializer = serializer
+
+    def _key(self, sid):
+        return f'sendit:session:{sid}'
+
+    def _user_key(self, user_id):
+        return f'sendit:user-sessions:{user_id}'
+
+    def get(self, sid):
+        try:
+            raw = self.client.get(self._key(sid))
+        except Exception as e:
+            # Treated as signed out rather than failing every request
+            logger.warning("Session store unavailable: %s", e)
+            return None
+        return self.serializer.loads(raw) if raw else None
+
+    def set(self, sid, data, ttl, user_id=None):
+        pipeline = self.client.pipeline()
+        pipeline.setex(self._key(sid), ttl, self.serializer.dumps(data))
+        if user_id is not None:
+            # The index outlives none of its sessions, stale ids in it only cost a DEL of a missing key
+            pipeline.sadd(self._user_key(user_id), sid)
+            pipeline.expire(self._user_key(user_id), ttl)
+        pipeline.execute()
+
+    def delete(self, sid):
+        self.client.delete(self._key(sid))
+
+    def revoke_user(self, user_id, keep=None):
+        sids = [sid.decode() for sid in self.client.smembers(self._user_key(user_id))]
+        sids = [sid for sid in sids if sid != keep]
+        if not sids:
+            return 0
+        pipeline = self.client.pipeline()
+        pipeline.delete(*[self._key(sid) for sid in sids])
+        pipeline.srem(self._user_key(user_id), *sids)
+        return pipeline.execute()[0]
+
+    def stats(self):
+        return {}
+
+
+def create_session_interface(config):
+    keyring = SigningKeyring(
+        keys=[key.strip() for key in (config.get('SESSION_SIGNING_KEYS') or '').split(',')],
+        path=config.get('SESSION_SIGNING_KEYS_FILE'),
+        reload_seconds=config.get('SESSION_KEYS_RELOAD_SECONDS', 30),
+    )
+    backend = config.get('SESSION_BACKEND', 'cookie')
+    if backend == 'cookie':
+        return SignedSessionInterface(keyring)
+    if backend == 'memory':
+        return StoredSessionInterface(keyring, MemorySessionStore(config.get('SESSION_MEMORY_MAX', 100_000)), backend)
+    if backend == 'redis':
+        if not config.get('SESSION_REDIS_URL'):
+            raise RuntimeError("SESSION_BACKEND=redis needs SESSION_REDIS_URL")
+        store = RedisSessionStore(config['SESSION_REDIS_URL'], SecureCookieSessionInterface.serializer)
+        return StoredSessionInterface(keyring, store, backend)
+    raise RuntimeError(f"Unknown SESSION_BACKEND {backend!r}, expected cookie, memory or redis")
+
+
+def init_sessions(app):
+    app.session_interface = create_session_interface(app.config)
+    # Other users of SECRET_KEY (CSRF tokens, Flask-Security) sign with the same current key
+    app.config['SECRET_KEY'] = app.session_interface.keyring.current
+
+
+def revoke_user_sessions(app, user_id, keep=None):
+    # Number of sessions revoked, None when the backend keeps sessions in the cookie only and can't revoke
+    store = app.session_interface.store
+    if store is None:
+        return None
+    return store.revoke_user(user_id, keep=keep)
+
+
+def session_stats(app):
+    interface = app.session_interface
+    stats = {"backend": interface.backend, "signing_keys": len(interface.keyring.keys())}
+    if interface.store is not None:
+        stats.update(interface.store.stats())
+    return stats
@@ -0,0 +1,149 @@
+# /server/static_assets.py
+
+# In-memory static asset layer for the built client bundle.
+# The bundle is scanned once at startup: files up to STATIC_CACHE_MAX_FILE_SIZE are held in memory with
+# gzip/brotli variants compressed at maximum level (or the .gz/.br files the build already wrote), and
+# their headers are computed up front. Content-hashed names (main.1a2b3c4d.js) are served with
+# `Cache-Control: immutable`; everything else revalidates with its ETag. Unknown paths get the
+# precomputed index.html so client-side routes work.
+
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import zlib
+
+from flask import Response, request, send_file
+
+from compression import COMPRESSIBLE_MIMETYPES, brotli, choose_encoding
+
+HASHED_NAME = re.compile(r'\.[0-9a-f]{8,}\.(?:chunk\.)?[A-Za-z0-9]+$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+INDEX_CACHE_CONTROL = 'no-cache'
+PRECOMPRESSED_SUFFIXES = {'.gz': 'gzip', '.br': 'br'}
+
+
+class StaticAsset:
+    __slots__ = ('path', 'bodies', 'headers', 'etag')
+
+    def __init__(self, path, bodies, headers, etag):
+        self.path = path  # On disk, used when the body isn't cached
+        self.bodies = bodies  # {encoding: bytes}, None for 'identity' when too large to keep in memory
+        self.headers = headers
+        self.etag = etag
+
+
+class StaticAssetCache:
+    def __init__(self, root, max_file_size=512 * 1024, max_age=3600):
+        self.root = root
+        self.max_file_size = max_file_size
+        self.max_age = max_age
+        self.assets = {}
+        self.index = None
+
+    def scan(self):
+        assets = {}
+        if self.root and os.path.isdir(self.root):
+            for directory, _, files in os.walk(self.root):
+                for name in files:
+                    if os.path.splitext(name)[1] in PRECOMPRESSED_SUFFIXES:
+                        continue
+                    path = os.path.join(directory, name)
+                    url_path = os.path.relpath(path, self.root).replace(os.sep, '/')
+                    assets[url_path] = self._load(url_path, path)
+        self.assets = assets
+        self.index = assets.get('index.html')
+        return self
+
+    def _load(self, url_path, path):
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if url_path == 'index.html':
+            cache_control = INDEX_CACHE_CONTROL
+        elif HASHED_NAME.search(os.path.basename(url_path)):
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            cache_control = f'public, max-age={self.max_age}'
+        headers = {'Content-Type': mimetype, 'Cache-Control': cache_control}
+
+        size = os.path.getsize(path)
+        if size > self.max_file_size:
+            stat = os.stat(path)
+            return StaticAsset(path, None, headers, f'{stat.st_mtime_ns:x}-{size:x}')
+
+        with open(path, 'rb') as asset_file:
+            data = asset_file.read()
+        bodies = {'identity': data}
+        if mimetype in COMPRESSIBLE_MIMETYPES or mimetype.startswith('text/'):
+            headers['Vary'] = 'Accept-Encoding'
+            for suffix, encoding in PRECOMPRESSED_SUFFIXES.items():
+                if os.path.exists(path + suffix):
+                    with open(path + suffix, 'rb') as compressed_file:
+                        bodies[encoding] = compressed_file.read()
+            if 'gzip' not in bodies:
+                compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+                bodies['gzip'] = compressor.compress(data) + compressor.flush()
+            if 'br' not in bodies and brotli is not None:
+                bodies['br'] = brotli.compress(data, quality=11)
+            # Keep a variant only when it actually saves bytes
+            bodies = {encoding: body for encoding, body in bodies.items() if encoding == 'identity' or len(body) < len(data)}
+        return StaticAsset(path, bodies, headers, hashlib.sha1(data).hexdigest())
+
+    def response(self, url_path, fallback=True):
+        asset = self.assets.get(url_path) or (self.index if fallback else None)
+        if asset is None:
+            return Response('{"message":"Not found"}\n', status=404, mimetype='application/json')
+
+        if request.if_none_match.contains(asset.etag):
+            response = Response(status=304, headers=asset.headers)
+        elif asset.bodies is None:
+            response = send_file(asset.path, mimetype=asset.headers['Content-Type'], conditional=True, etag=False)
+            response.headers.update(asset.headers)
+        else:
+            # No negotiation for assets without a smaller variant (tiny files, already compressed formats)
+            variants = [e for e in ('br', 'gzip') if e in asset.bodies]
+            encoding = choose_encoding(request.accept_encodings, variants) if variants else None
+            response = Response(asset.bodies[encoding or 'identity'], headers=asset.headers)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(asset.etag)
+        # Already negotiated, keeps the compression hook away from it
+        response.direct_passthrough = True
+        return response
+
+    def is_asset_request(self, request_line):
+        # '"GET /static/js/main.1a2b3c4d.js HTTP/1.1"' -> whether it names a cached asset
+        parts = request_line.split(' ')
+        return len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?', 1)[0].lstrip('/') in self.assets
+
+
+class QuietAssetRequests(logging.Filter):
+    # Drops werkzeug's access log lines for successful asset requests
+    def __init__(self, cache):
+        super().__init__()
+        self.cache = cache
+
+    def filter(self, record):
+        args = record.args if isinstance(record.args, tuple) else ()
+        if len(args) >= 2 and isinstance(args[0], str) and str(args[1]) in ('200', '304'):
+            return not self.cache.is_asset_request(args[0])
+        return True
+
+
+def init_static_assets(app):
+    cache = StaticAssetCache(
+        app.config.get('STATIC_ASSETS_DIR') or app.static_folder,
+        max_file_size=app.config.get('STATIC_CACHE_MAX_FILE_SIZE', 512 * 1024),
+        max_age=app.config.get('STATIC_MAX_AGE', 3600)
+    ).scan()
+    if 'static' in app.view_functions:
+        # Flask's own /static route reads the disk per request, answer it from the cache as well. `filename` is
+        # relative to the static folder when that is inside the bundle, otherwise the bundle's files under the
+        # static URL path (client/build/static/js/... on /static/js/...) stand in for it
+        prefix = os.path.relpath(app.static_folder, cache.root).replace(os.sep, '/') if app.static_folder and cache.root else '..'
+        if prefix.startswith('..'):
+            prefix = app.static_url_path.strip('/')
+        prefix = '' if prefix in ('', '.') else prefix + '/'
+        app.view_functions['static'] = lambda filename: cache.response(prefix + filename, fallback=False)
+    logging.getLogger('werkzeug').addFilter(QuietAssetRequests(cache))
+    return cache
@@ -0,0 +1,51 @@
+# /server/tests/conftest.py
+
+# Run from /server:  python -m pytest tests
+# The modules import each other by bare name (as gunicorn and flask run them from /server), and importing
+# config needs a database URI, a scratch SQLite file is enough for these tests.
+
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+os.environ.setdefault('DATABASE_URI', f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='sendit-tests-'), 'test.db')}")
+os.environ.setdefault('SESSION_SIGNING_KEYS', 'test-signing-key')
+# As deployed behind one load balancer
+os.environ.setdefault('PROXY_FIX_HOPS', '1')
+
+
+@pytest.fixture(scope='session')
+def app():
+    # Imported here, after the environment above is in place
+    from app import app
+    from config import db
+
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def sign_in(app):
+    # Returns a test client signed in as a new user, client.user_id is theirs
+    from app import admission
+
+    admission.local._buckets.clear()
+
+    def sign_in():
+        client = app.test_client()
+        email = f'{uuid.uuid4().hex[:12]}@example.com'
+        response = client.post('/signup', json={'first_name': 'Wanjiru', 'last_name': 'Kamau', 'email': email, 'password': 'secret1'})
+        assert response.status_code == 201
+        client.user_id = response.json['user']['id']
+        assert client.post('/login', json={'email': email, 'password': 'secret1'}).status_code == 200
+        return client
+
+    return sign_in
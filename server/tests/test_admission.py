@@ -0,0 +1,68 @@
+# /server/tests/test_admission.py
+
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def admission(app):
+    from app import admission
+
+    admission.local._buckets.clear()
+    return admission
+
+
+def track(client, address):
+    # Both clients reach the app through the same load balancer
+    return client.get('/track/SI-UNKNOWN', headers={'X-Forwarded-For': address}, environ_base={'REMOTE_ADDR': '10.0.0.2'})
+
+
+def test_forwarded_clients_get_their_own_buckets(app, admission):
+    client = app.test_client()
+    burst = int(admission.rate_limits['public'][1])
+
+    statuses = [track(client, '203.0.113.7').status_code for _ in range(burst)]
+    assert 429 not in statuses
+    limited = track(client, '203.0.113.7')
+    assert limited.status_code == 429
+    assert int(limited.headers['Retry-After']) >= 1
+
+    # Another client behind the same proxy isn't limited by the first one's requests
+    assert track(client, '198.51.100.23').status_code == 404
+
+
+def test_only_trusted_hops_are_read(app, admission):
+    # A client can prepend whatever it likes, the entry the trusted proxy appended is the one that counts
+    client = app.test_client()
+    burst = int(admission.rate_limits['public'][1])
+    for index in range(burst):
+        track(client, f'192.0.2.{index}, 203.0.113.7')
+    assert track(client, '192.0.2.250, 203.0.113.7').status_code == 429
+
+
+def test_principal_is_loaded_only_for_user_keyed_groups(app, admission, monkeypatch):
+    import app as routes
+
+    calls = []
+    monkeypatch.setattr(routes, 'load_principal', lambda: calls.append(1))
+    client = app.test_client()
+
+    track(client, '203.0.113.50')
+    client.post('/login', json={'email': 'nobody@example.com', 'password': 'wrong'})
+    client.get('/check_session')
+    assert calls == []
+
+    client.get('/user/parcels')
+    assert calls
+
+
+def test_process_buckets_without_the_redis_package(monkeypatch):
+    from admission import AdmissionControl
+
+    # None in sys.modules makes the import fail as if the package weren't installed
+    monkeypatch.setitem(sys.modules, 'redis', None)
+    controller = AdmissionControl({'RATE_LIMITS': {'read': '1/2'}, 'RATE_LIMIT_REDIS_URL': 'redis://localhost:6379/0'})
+    assert controller.shared is None
+    assert controller.stats()['backend'] == 'memory'
+    assert controller.admit('read', 'ip:203.0.113.7') is None
@@ -0,0 +1,39 @@
+# /server/tests/test_asgi.py
+
+# The async serving mode needs its own dependencies (see requirements.txt), skipped where they aren't installed
+
+import uuid
+
+import pytest
+
+pytest.importorskip('starlette')
+pytest.importorskip('a2wsgi')
+pytest.importorskip('aiosqlite')
+pytest.importorskip('httpx')
+
+
+@pytest.fixture
+def client(app):
+    from starlette.testclient import TestClient
+
+    from asgi import application
+
+    with TestClient(application) as client:
+        yield client
+
+
+def test_async_routes_share_the_flask_session(client):
+    email = f'{uuid.uuid4().hex[:12]}@example.com'
+    # Both fall through to Flask
+    response = client.post('/signup', json={'first_name': 'Otieno', 'last_name': 'Odhiambo', 'email': email, 'password': 'secret1'})
+    assert response.status_code == 201
+    assert client.post('/login', json={'email': email, 'password': 'secret1'}).status_code == 200
+
+    # Served by the async route, with the cookie Flask set
+    response = client.get('/check_session')
+    assert response.status_code == 200
+    assert response.json()['user']['email'] == email
+
+    response = client.get('/parcels/999999')
+    assert response.status_code == 404
+    assert response.json() == {"message": "Parcel not found"}
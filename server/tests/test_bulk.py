@@ -0,0 +1,35 @@
+# /server/tests/test_bulk.py
+
+from decimal import Decimal
+
+from bulk import validate_parcel_row
+
+RECIPIENT = {
+    'first_name': 'Wambui', 'last_name': 'Njoroge', 'email': 'w.njoroge@example.com', 'phone_number': '+254 733 000444',
+    'street': 'Moi Avenue', 'city': 'Mombasa', 'state': 'Mombasa', 'zip_code': '80100', 'country': 'Kenya',
+}
+PARCEL = {'recipient_id': 1, 'length': 30, 'width': 20, 'height': 10, 'weight': 2, 'status': 'Pending'}
+
+
+def test_values_are_rounded_and_bounded_like_the_columns(app):
+    values, errors = validate_parcel_row(dict(PARCEL, weight='2.345', cost=99999999.99))
+    assert errors is None
+    assert (values['weight'], values['cost']) == (Decimal('2.35'), Decimal('99999999.99'))
+
+    for field, value in (('weight', 10 ** 8), ('cost', '99999999.995'), ('length', '1e30')):
+        values, errors = validate_parcel_row(dict(PARCEL, **{field: value}))
+        assert errors == {field: "must be less than 100,000,000"}
+
+
+def test_oversized_rows_fail_alone(sign_in):
+    client = sign_in()
+    recipient_id = client.post('/recipients', json=RECIPIENT).json['id']
+    parcel = dict(PARCEL, recipient_id=recipient_id)
+
+    response = client.post('/parcels/bulk', json=[parcel, dict(parcel, weight=10 ** 9), dict(parcel, cost='1e12')])
+    assert response.status_code == 207
+    assert [created['index'] for created in response.json['created']] == [0]
+    assert response.json['errors'] == [
+        {"index": 1, "errors": {"weight": "must be less than 100,000,000"}},
+        {"index": 2, "errors": {"cost": "must be less than 100,000,000"}},
+    ]
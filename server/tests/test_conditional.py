@@ -0,0 +1,70 @@
+# /server/tests/test_conditional.py
+
+import pytest
+from sqlalchemy import update
+
+from config import db
+from models import User
+
+
+@pytest.fixture
+def client(sign_in):
+    return sign_in()
+
+
+def test_nested_changes_change_the_etag(client):
+    url = f'/users/{client.user_id}'
+    etag = client.get(url).headers['ETag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    # Only the embedded billing addresses change, the user row itself doesn't
+    address = {'street': 'Moi Avenue', 'city': 'Nairobi', 'country': 'Kenya'}
+    assert client.post('/billing_addresses', json=address).status_code == 201
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.json['billing_addresses'][0]['street'] == 'Moi Avenue'
+
+
+def test_not_modified_without_serializing(client, monkeypatch):
+    import conditional
+
+    url = f'/users/{client.user_id}'
+    address = {'street': 'Kenyatta Avenue', 'city': 'Nakuru', 'country': 'Kenya'}
+    assert client.post('/billing_addresses', json=address).status_code == 201
+    etag = client.get(url).headers['ETag']
+
+    def serialize(obj):
+        raise AssertionError("serialized for a 304")
+
+    monkeypatch.setattr(conditional, 'serialize', serialize)
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+
+def test_every_update_bumps_the_row_version(app, client):
+    url = f'/users/{client.user_id}'
+    with app.app_context():
+        before = db.session.get(User, client.user_id).version_id
+    # Well within one second, updated_at alone couldn't tell these apart
+    first = client.patch(url, json={'city': 'Kisumu'})
+    second = client.patch(url, json={'city': 'Nakuru'})
+    assert first.headers['ETag'] != second.headers['ETag']
+    with app.app_context():
+        assert db.session.get(User, client.user_id).version_id == before + 2
+
+
+def test_concurrent_update_is_a_conflict(app, client, monkeypatch):
+    import app as routes
+
+    def updated_elsewhere(obj):
+        # Another request commits between this one's read and its write
+        with db.engine.begin() as connection:
+            connection.execute(update(User).where(User.id == obj.id).values(version_id=User.version_id + 1))
+        return None
+
+    monkeypatch.setattr(routes, 'precondition_failed', updated_elsewhere)
+    response = client.patch(f'/users/{client.user_id}', json={'city': 'Eldoret'})
+    assert response.status_code == 409
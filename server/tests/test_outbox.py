@@ -0,0 +1,30 @@
+# /server/tests/test_outbox.py
+
+import smtplib
+
+from outbox import rejection_code
+
+EMAIL = {'to': 'amani@example.com', 'subject': 'Parcel update', 'body': 'Your parcel is on its way.'}
+
+
+def test_only_the_sender_can_look_up_an_email(app, sign_in):
+    sender, other = sign_in(), sign_in()
+    assert app.test_client().post('/send-email', json=EMAIL).status_code == 401
+
+    response = sender.post('/send-email', json=EMAIL)
+    assert response.status_code == 202
+    url = f"/send-email/{response.json['id']}"
+
+    assert app.test_client().get(url).status_code == 401
+    assert other.get(url).status_code == 404
+    response = sender.get(url)
+    assert response.status_code == 200
+    assert response.json['status'] == 'queued'
+    assert 'claimed_by' not in response.json
+
+
+def test_only_5xx_rejections_are_permanent():
+    assert rejection_code(smtplib.SMTPDataError(451, b'Try again later')) == 451
+    assert rejection_code(smtplib.SMTPDataError(554, b'Rejected')) == 554
+    refused = smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'No such user'), 'b@example.com': (452, b'Mailbox full')})
+    assert rejection_code(refused) == 452
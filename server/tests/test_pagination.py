@@ -0,0 +1,56 @@
+# /server/tests/test_pagination.py
+
+import contextlib
+
+import pytest
+from sqlalchemy import event
+
+from config import db
+
+RECIPIENT = {
+    'first_name': 'Chebet', 'last_name': 'Kiprono', 'email': 'chebet.k@example.com', 'phone_number': '+254 744 000555',
+    'street': 'Kenyatta Street', 'city': 'Kericho', 'state': 'Kericho', 'zip_code': '20200', 'country': 'Kenya',
+}
+
+
+@contextlib.contextmanager
+def counted_statements(app):
+    statements = []
+
+    def count(*args):
+        statements.append(1)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
+def add_sender(sign_in):
+    # A user with a billing address, a recipient and a parcel, so every nested list has rows
+    client = sign_in()
+    client.post('/billing_addresses', json={'street': 'Moi Avenue', 'city': 'Nairobi', 'country': 'Kenya'})
+    recipient_id = client.post('/recipients', json=RECIPIENT).json['id']
+    client.post('/parcels', json={'recipient_id': recipient_id, 'length': 30, 'width': 20, 'height': 10, 'weight': 2, 'status': 'Pending'})
+    return client
+
+
+@pytest.mark.parametrize('url', ['/users', '/recipients', '/billing_addresses'])
+def test_pages_take_the_same_queries_for_more_rows(app, sign_in, url):
+    client = add_sender(sign_in)
+
+    def page_queries():
+        with counted_statements(app) as statements:
+            response = client.get(url, query_string={'limit': 500})
+        assert response.status_code == 200
+        return len(response.json['items']), len(statements)
+
+    rows, queries = page_queries()
+    for _ in range(3):
+        add_sender(sign_in)
+    more_rows, more_queries = page_queries()
+    assert more_rows > rows
+    assert more_queries == queries
@@ -0,0 +1,21 @@
+# /server/tests/test_parcel_events.py
+
+RECIPIENT = {
+    'first_name': 'Kipchoge', 'last_name': 'Ruto', 'email': 'k.ruto@example.com', 'phone_number': '+254 711 000222',
+    'street': 'Uganda Road', 'city': 'Eldoret', 'state': 'Uasin Gishu', 'zip_code': '30100', 'country': 'Kenya',
+}
+
+
+def test_history_is_for_the_sender(app, sign_in):
+    sender, other = sign_in(), sign_in()
+    recipient_id = sender.post('/recipients', json=RECIPIENT).json['id']
+    parcel = {'recipient_id': recipient_id, 'length': 30, 'width': 20, 'height': 10, 'weight': 2, 'status': 'pending'}
+    response = sender.post('/parcels', json=parcel)
+    assert response.status_code == 201
+    url = f"/parcels/{response.json['id']}/events"
+
+    assert app.test_client().get(url).status_code == 401
+    assert other.get(url).status_code == 404
+    response = sender.get(url)
+    assert response.status_code == 200
+    assert response.json['status'] == 'pending'
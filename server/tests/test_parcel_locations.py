@@ -0,0 +1,34 @@
+# /server/tests/test_parcel_locations.py
+
+from config import db
+from models import User, Role
+from principal import invalidate_principal
+
+
+def test_nearby_needs_a_user(app, sign_in):
+    url = '/parcels/nearby?lat=-1.2864&lng=36.8172&radius_km=5'
+    assert app.test_client().get(url).status_code == 401
+    response = sign_in().get(url)
+    assert response.status_code == 200
+    assert isinstance(response.json, list)
+
+
+def test_route_plans_take_integer_parcel_ids(app, sign_in):
+    from app import admission
+
+    client = sign_in()
+    with app.app_context():
+        user = db.session.get(User, client.user_id)
+        user.roles.append(Role.query.filter_by(name='admin').first() or Role(name='admin'))
+        db.session.commit()
+        invalidate_principal(client.user_id)
+
+    depot = {'latitude': -1.2864, 'longitude': 36.8172}
+    for parcel_ids in (['a'], [1, '2'], [True], [[1]], 'all'):
+        # Route plans are rate limited as heavy requests, a burst of 3
+        admission.local._buckets.clear()
+        response = client.post('/routes/plan', json={'depot': depot, 'parcel_ids': parcel_ids})
+        assert response.status_code == 400, parcel_ids
+        assert 'parcel_ids' in response.json['message']
+    admission.local._buckets.clear()
+    assert client.post('/routes/plan', json={'depot': depot, 'parcel_ids': [999999]}).status_code == 200
@@ -0,0 +1,48 @@
+# /server/tests/test_quotes.py
+
+import pytest
+
+SHIPMENT = {'length': 30, 'width': 20, 'height': 10, 'weight': 2, 'distance_km': 120}
+
+
+@pytest.fixture
+def parse_shipments(app):
+    from quotes import parse_shipments
+
+    return parse_shipments
+
+
+def test_booleans_are_rejected_on_the_vectorized_path(parse_shipments):
+    # Every other value converts in one pass, True must not slip through as 1
+    indexes, arrays, errors = parse_shipments([SHIPMENT, dict(SHIPMENT, weight=True), dict(SHIPMENT, distance_km=False)])
+
+    assert indexes == [0]
+    assert arrays['weight'].tolist() == [2.0]
+    assert errors == [
+        {"index": 1, "errors": {"weight": "must be a non-negative number"}},
+        {"index": 2, "errors": {"distance_km": "must be a non-negative number"}},
+    ]
+
+
+def test_lists_are_rejected_on_the_vectorized_path(parse_shipments):
+    # Lists of the same length in every row would convert to a 2-D column
+    indexes, _, errors = parse_shipments([dict(SHIPMENT, length=[30]), dict(SHIPMENT, length=[30])])
+    assert indexes == []
+    assert [error["errors"] for error in errors] == [{"length": "must be a non-negative number"}] * 2
+
+    indexes, _, errors = parse_shipments([dict(SHIPMENT, distance_km=[1, 2]), dict(SHIPMENT, distance_km=[1, 2])])
+    assert indexes == []
+    assert [error["errors"] for error in errors] == [{"distance_km": "must be a non-negative number"}] * 2
+
+
+def test_malformed_distance_is_named_even_with_coordinates(parse_shipments):
+    row = dict(SHIPMENT, distance_km='far', origin_lat=52.5, origin_lng=13.4, destination_lat=48.1, destination_lng=11.6)
+    indexes, _, errors = parse_shipments([row, dict(SHIPMENT, distance_km=None, origin_lat='north')])
+
+    assert indexes == []
+    assert errors == [
+        {"index": 0, "errors": {"distance_km": "must be a non-negative number"}},
+        {"index": 1, "errors": {
+            "origin_lat": "must be a number", "distance_km": "give distance_km or origin/destination coordinates",
+        }},
+    ]
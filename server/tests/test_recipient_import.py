@@ -0,0 +1,48 @@
+# /server/tests/test_recipient_import.py
+
+import json
+
+from sqlalchemy import select, update
+
+from config import db
+from models import Recipient
+from recipient_import import backfill_dedupe_keys
+
+CONTACT = {'first_name': 'Achieng', 'last_name': 'Otieno', 'email': 'achieng.otieno@example.com', 'city': 'Kisumu'}
+
+
+def upload(client, *rows):
+    body = ''.join(json.dumps(row) + '\n' for row in rows)
+    return client.post('/recipients/import', data=body, content_type='application/x-ndjson')
+
+
+def test_imports_belong_to_the_caller(app, sign_in):
+    assert upload(app.test_client(), CONTACT).status_code == 401
+
+    first, second = sign_in(), sign_in()
+    response = upload(first, CONTACT, CONTACT)
+    assert response.status_code == 201
+    assert (response.json['inserted'], response.json['duplicates']) == (1, 1)
+
+    # Someone else's contact is no duplicate of theirs
+    response = upload(second, CONTACT)
+    assert (response.json['inserted'], response.json['duplicates']) == (1, 0)
+
+    with app.app_context():
+        owners = db.session.scalars(select(Recipient.user_id).where(Recipient.email == CONTACT['email'])).all()
+    assert sorted(owners) == sorted([first.user_id, second.user_id])
+
+
+def test_backfill_keeps_row_versions(app):
+    with app.app_context():
+        recipient = Recipient(first_name='Baraka', last_name='Mwangi', email='baraka@example.com')
+        db.session.add(recipient)
+        db.session.commit()
+        db.session.execute(update(Recipient).where(Recipient.id == recipient.id).values(dedupe_key=None))
+        db.session.commit()
+        version = recipient.version_id
+
+        assert backfill_dedupe_keys() >= 1
+        db.session.refresh(recipient)
+        assert recipient.dedupe_key is not None
+        assert recipient.version_id == version + 1
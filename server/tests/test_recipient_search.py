@@ -0,0 +1,21 @@
+# /server/tests/test_recipient_search.py
+
+
+def test_search_needs_a_user_and_three_characters(app, sign_in):
+    assert app.test_client().get('/recipients/search?q=otieno').status_code == 401
+
+    client = sign_in()
+    recipient = {
+        'first_name': 'Achieng', 'last_name': 'Otieno', 'email': 'a.otieno@example.com', 'phone_number': '+254 700 000111',
+        'street': 'Oginga Odinga Street', 'city': 'Kisumu', 'state': 'Kisumu', 'zip_code': '40100', 'country': 'Kenya',
+    }
+    assert client.post('/recipients', json=recipient).status_code == 201
+
+    for term in ('', 'o', ' ot '):
+        response = client.get('/recipients/search', query_string={'q': term})
+        assert response.status_code == 400
+        assert response.json['message'] == "q must be at least 3 characters"
+
+    response = client.get('/recipients/search', query_string={'q': 'otie'})
+    assert response.status_code == 200
+    assert 'Otieno' in [result['last_name'] for result in response.json]
@@ -0,0 +1,77 @@
+# /server/tests/test_rollups.py
+
+import uuid
+
+import pytest
+from sqlalchemy import select
+
+import rollups
+from config import db
+from models import ParcelDailyStats
+from rollups import reconcile_rollups
+
+RECIPIENT = {
+    'first_name': 'Njeri', 'last_name': 'Mutua', 'email': 'njeri.mutua@example.com', 'phone_number': '+254 722 000333',
+    'street': 'Kenyatta Avenue', 'city': 'Nyeri', 'state': 'Nyeri', 'zip_code': '10100', 'country': 'Kenya',
+}
+
+
+def city_counts(app):
+    with app.app_context():
+        rows = db.session.execute(select(ParcelDailyStats.city, ParcelDailyStats.parcel_count)).all()
+    counts = {}
+    for city, count in rows:
+        counts[city] = counts.get(city, 0) + count
+    return {city: count for city, count in counts.items() if count}
+
+
+def snapshot(app):
+    with app.app_context():
+        return sorted(db.session.execute(select(
+            ParcelDailyStats.day, ParcelDailyStats.city, ParcelDailyStats.status, ParcelDailyStats.parcel_count
+        ).where(ParcelDailyStats.parcel_count != 0)).all())
+
+
+@pytest.fixture
+def recipient(sign_in):
+    # Cities of their own, the counts don't depend on other tests' parcels
+    client = sign_in()
+    client.city, client.new_city = f'Nyeri {uuid.uuid4().hex[:8]}', f'Nanyuki {uuid.uuid4().hex[:8]}'
+    client.recipient_id = client.post('/recipients', json=dict(RECIPIENT, city=client.city)).json['id']
+    return client
+
+
+def test_parcels_without_a_city_count_in_their_recipients(app, recipient):
+    parcel = {'recipient_id': recipient.recipient_id, 'length': 30, 'width': 20, 'height': 10, 'weight': 2, 'status': 'Pending'}
+    assert recipient.post('/parcels', json=parcel).status_code == 201
+    assert recipient.post('/parcels/bulk', json=[parcel, parcel]).status_code == 201
+    assert city_counts(app).get(recipient.city) == 3
+
+    # The recipient moves, their parcels go with them
+    assert recipient.patch(f'/recipients/{recipient.recipient_id}', json={'city': recipient.new_city}).status_code == 200
+    counts = city_counts(app)
+    assert recipient.city not in counts
+    assert counts.get(recipient.new_city) == 3
+
+    incremental = snapshot(app)
+    with app.app_context():
+        reconcile_rollups()
+    assert snapshot(app) == incremental
+
+
+def test_failed_deltas_are_retried_with_the_next_commit(app, recipient, monkeypatch):
+    parcel = {'recipient_id': recipient.recipient_id, 'length': 30, 'width': 20, 'height': 10, 'weight': 2, 'status': 'Pending'}
+    apply_deltas = rollups.apply_deltas
+
+    def unavailable(connection, deltas):
+        raise RuntimeError("rollup tables locked")
+
+    monkeypatch.setattr(rollups, 'apply_deltas', unavailable)
+    assert recipient.post('/parcels', json=parcel).status_code == 201
+    assert rollups.unapplied
+    assert recipient.city not in city_counts(app)
+
+    monkeypatch.setattr(rollups, 'apply_deltas', apply_deltas)
+    assert recipient.post('/parcels', json=parcel).status_code == 201
+    assert not rollups.unapplied
+    assert city_counts(app).get(recipient.city) == 2
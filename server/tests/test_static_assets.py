@@ -0,0 +1,64 @@
+# /server/tests/test_static_assets.py
+
+import gzip
+
+import pytest
+from flask import Flask
+
+from static_assets import StaticAssetCache, init_static_assets
+
+SCRIPT = b'console.log("SendIT");\n' * 200
+
+
+@pytest.fixture
+def bundle(tmp_path):
+    (tmp_path / 'index.html').write_text('<!doctype html><div id="root"></div>')
+    (tmp_path / 'robots.txt').write_text('User-agent: *\n')
+    (tmp_path / 'logo.png').write_bytes(b'\x89PNG\r\n\x1a\n')
+    (tmp_path / 'static' / 'js').mkdir(parents=True)
+    (tmp_path / 'static' / 'js' / 'main.1a2b3c4d.js').write_bytes(SCRIPT)
+    return tmp_path
+
+
+def asset_app(bundle, **options):
+    app = Flask(__name__, **options)
+    app.config['STATIC_ASSETS_DIR'] = str(bundle)
+    cache = init_static_assets(app)
+
+    @app.route('/<path:path>')
+    def serve(path):
+        return cache.response(path)
+
+    return app, cache
+
+
+def test_asset_without_variants_is_served_as_identity(bundle):
+    app, _ = asset_app(bundle)
+    assert 'gzip' not in StaticAssetCache(str(bundle)).scan().assets['robots.txt'].bodies
+
+    for path, body in (('robots.txt', b'User-agent: *\n'), ('logo.png', b'\x89PNG\r\n\x1a\n')):
+        response = app.test_client().get(f'/{path}', headers={'Accept-Encoding': 'gzip, br'})
+        assert response.status_code == 200
+        assert 'Content-Encoding' not in response.headers
+        assert response.data == body
+
+
+def test_asset_with_variants_is_negotiated(bundle):
+    app, _ = asset_app(bundle)
+    response = app.test_client().get('/static/js/main.1a2b3c4d.js', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == SCRIPT
+    assert 'immutable' in response.headers['Cache-Control']
+
+
+def test_static_route_looks_up_filename(bundle):
+    # The static folder inside the bundle, on a URL path that isn't its name on disk
+    app, cache = asset_app(bundle, static_folder=str(bundle / 'static'), static_url_path='/assets')
+    client = app.test_client()
+
+    response = client.get('/assets/js/main.1a2b3c4d.js')
+    assert response.status_code == 200
+    assert response.data == SCRIPT
+    assert response.headers['ETag'] == f'"{cache.assets["static/js/main.1a2b3c4d.js"].etag}"'
+    assert client.get('/assets/js/missing.js').status_code == 404
@@ -0,0 +1,113 @@
+# /server/tracking.py
+
+# Public parcel tracking lookups.
+# A tracking page only needs status, last update and destination city, so we select just those columns
+# by the indexed tracking_number and keep the result in an in-process LRU, optionally backed by a shared
+# Redis cache (TRACKING_CACHE_REDIS_URL) so all workers and nodes warm each other up.
+# Parcel writes that change what a tracking page shows must call invalidate_tracking().
+
+import json
+import logging
+
+from sqlalchemy import select, func
+
+from cache import TTLCache
+from config import app, db
+from models import Parcel, Recipient
+
+logger = logging.getLogger('tracking')
+
+tracking_cache = TTLCache(maxsize=app.config['TRACKING_CACHE_SIZE'], ttl=app.config['TRACKING_CACHE_TTL'])
+
+_shared_cache = None
+
+
+def shared_cache():
+    # Redis is optional, the import only happens when a shared cache is configured
+    global _shared_cache
+    url = app.config.get('TRACKING_CACHE_REDIS_URL')
+    if not url:
+        return None
+    if _shared_cache is None:
+        import redis
+        _shared_cache = redis.Redis.from_url(url, socket_timeout=0.05)
+    return _shared_cache
+
+
+def _shared_key(tracking_number):
+    return f'sendit:track:{tracking_number}'
+
+
+def _shared_get(tracking_number):
+    cache = shared_cache()
+    if cache is None:
+        return None
+    try:
+        raw = cache.get(_shared_key(tracking_number))
+    except Exception as e:
+        # A shared cache outage should only cost us the database lookup
+        logger.warning("Shared tracking cache unavailable: %s", e)
+        return None
+    return json.loads(raw) if raw else None
+
+
+def _shared_set(tracking_number, projection):
+    cache = shared_cache()
+    if cache is None:
+        return
+    try:
+        cache.setex(_shared_key(tracking_number), app.config['TRACKING_CACHE_TTL'], json.dumps(projection))
+    except Exception as e:
+        logger.warning("Shared tracking cache unavailable: %s", e)
+
+
+def fetch_tracking_projection(tracking_number, session=None):
+    # session defaults to the Flask-SQLAlchemy one, the ASGI app passes its own (see asgi.py)
+    row = (session or db.session).execute(
+        select(
+            Parcel.tracking_number,
+            Parcel.status,
+            Parcel.updated_at,
+            func.coalesce(Parcel.city, Recipient.city).label('destination_city')
+        )
+        .outerjoin(Recipient, Recipient.id == Parcel.recipient_id)
+        .where(Parcel.tracking_number == tracking_number)
+    ).first()
+    if row is None:
+        return None
+    return {
+        "tracking_number": row.tracking_number,
+        "status": row.status,
+        "last_update": row.updated_at.strftime(Parcel.datetime_format) if row.updated_at else None,
+        "destination_city": row.destination_city
+    }
+
+
+def lookup_tracking(tracking_number):
+    projection = tracking_cache.get(tracking_number)
+    if projection is not None:
+        return projection
+
+    projection = _shared_get(tracking_number)
+    if projection is None:
+        projection = fetch_tracking_projection(tracking_number)
+        if projection is None:
+            return None
+        _shared_set(tracking_number, projection)
+
+    tracking_cache.set(tracking_number, projection)
+    return projection
+
+
+def invalidate_tracking(*tracking_numbers):
+    # Other workers' LRUs age out within TRACKING_CACHE_TTL, the shared cache is cleared right away
+    cache = shared_cache()
+    for tracking_number in tracking_numbers:
+        if not tracking_number:
+            continue
+        tracking_cache.delete(tracking_number)
+        if cache is not None:
+            try:
+                cache.delete(_shared_key(tracking_number))
+            except Exception as e:
+                logger.warning("Shared tracking cache unavailable: %s", e)